@@ -10,14 +10,7 @@ import pickle
 
 import pandas
 
-import mhcnames
-
-
-def normalize_allele_name(s):
-    try:
-        return mhcnames.normalize_allele_name(s)
-    except Exception:
-        return "UNKNOWN"
+from mhcflurry.allele_names import normalize_allele_names
 
 
 parser = argparse.ArgumentParser(usage=__doc__)
@@ -62,7 +55,7 @@ def load_data_kim2014(filename):
     })
     df["original_allele"] = df.mhc
     df["peptide"] = df.sequence
-    df["allele"] = df.mhc.map(normalize_allele_name)
+    df["allele"] = normalize_allele_names(df.mhc, default="UNKNOWN")
     print("Dropping un-parseable alleles: %s" % ", ".join(
         df.ix[df.allele == "UNKNOWN"]["mhc"].unique()))
     df = df.ix[df.allele != "UNKNOWN"]
@@ -90,7 +83,8 @@ def load_data_iedb(iedb_csv, include_qualitative=True):
         (~iedb_df["Allele Name"].str.contains("CD1"))
     ]
 
-    iedb_df["allele"] = iedb_df["Allele Name"].map(normalize_allele_name)
+    iedb_df["allele"] = normalize_allele_names(
+        iedb_df["Allele Name"], default="UNKNOWN")
     print("Dropping un-parseable alleles: %s" % ", ".join(
         iedb_df.ix[iedb_df.allele == "UNKNOWN"]["Allele Name"].unique()))
     iedb_df = iedb_df.ix[iedb_df.allele != "UNKNOWN"]
@@ -33,6 +33,8 @@ time mhcflurry-class1-train-allele-specific-models \
     --out-models-dir models \
     --min-measurements-per-allele 200
 
+time mhcflurry-class1-calibrate-percentile-ranks --models models
+
 cp $SCRIPT_ABSOLUTE_PATH .
 bzip2 LOG.txt
 tar -cjf "../${DOWNLOAD_NAME}.tar.bz2" *
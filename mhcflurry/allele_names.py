@@ -0,0 +1,165 @@
+"""
+Memoized allele name normalization.
+
+Parsing allele names with mhcnames is slow relative to the rest of
+prediction, and inputs typically repeat a few alleles many times. Names are
+therefore normalized once per process (see `normalize_allele_name`), and
+columns of names are normalized by factorizing them and normalizing only the
+distinct values (see `normalize_allele_names`).
+
+An alias table giving common spellings of the supported alleles can be saved
+with a model release (see `write_allele_aliases`) and loaded into the memo
+(see `read_allele_aliases`), so these spellings need no parsing at all.
+"""
+from __future__ import (
+    print_function,
+    division,
+    absolute_import,
+)
+
+import numpy
+import pandas
+
+import mhcnames
+
+# Process-wide memo of raw allele name -> normalized allele name, or the
+# (type, args) of the exception raised when normalizing it. A new exception is
+# raised each time, as raising a stored exception object would accumulate
+# tracebacks on it.
+_NORMALIZED_ALLELE_NAMES = {}
+
+
+def normalize_allele_name(allele):
+    """
+    Memoized `mhcnames.normalize_allele_name`.
+
+    Parameters
+    ----------
+    allele : string
+
+    Returns
+    -------
+    string
+    """
+    try:
+        result = _NORMALIZED_ALLELE_NAMES[allele]
+    except KeyError:
+        try:
+            result = mhcnames.normalize_allele_name(allele)
+        except Exception as e:
+            result = (type(e), e.args)
+        _NORMALIZED_ALLELE_NAMES[allele] = result
+    if isinstance(result, tuple):
+        (exception_type, args) = result
+        raise exception_type(*args)
+    return result
+
+
+def normalize_allele_names(alleles, default=None):
+    """
+    Normalize a collection of allele names, parsing each distinct name at
+    most once.
+
+    Parameters
+    ----------
+    alleles : list or numpy.array or pandas.Series of string
+
+    default : string, optional
+        Value to give names that cannot be parsed or are missing (None or
+        NaN). If not specified, an error is raised for such names.
+
+    Returns
+    -------
+    numpy.array of object giving the normalized name of each allele
+    """
+    (codes, distinct_alleles) = pandas.factorize(
+        numpy.asarray(alleles, dtype=object))
+    if default is None and (codes < 0).any():
+        raise ValueError(
+            "%d allele names are missing (None or NaN)" % (codes < 0).sum())
+    normalized = []
+    for allele in distinct_alleles:
+        if default is None:
+            normalized.append(normalize_allele_name(allele))
+        else:
+            try:
+                normalized.append(normalize_allele_name(allele))
+            except Exception:
+                normalized.append(default)
+    # Missing values (code -1) take the last entry.
+    normalized.append(default)
+    return numpy.array(normalized, dtype=object)[codes]
+
+
+def allele_aliases(allele):
+    """
+    Common spellings of a normalized allele name, e.g. "HLA-A0201",
+    "A*02:01", and "A0201" for "HLA-A*02:01". Only spellings that normalize
+    back to the allele are returned.
+
+    Parameters
+    ----------
+    allele : string
+        Normalized allele name
+
+    Returns
+    -------
+    list of string, including allele itself
+    """
+    candidates = [allele]
+    if "-" in allele:
+        candidates.append(allele.split("-", 1)[1])
+    for candidate in list(candidates):
+        candidates.append(candidate.replace("*", ""))
+        candidates.append(candidate.replace(":", ""))
+        candidates.append(candidate.replace("*", "").replace(":", ""))
+    result = []
+    for candidate in candidates:
+        if candidate in result:
+            continue
+        try:
+            normalized = normalize_allele_name(candidate)
+        except Exception:
+            continue
+        if normalized == allele:
+            result.append(candidate)
+    return result
+
+
+def write_allele_aliases(path, alleles):
+    """
+    Write the alias table for the given alleles to a CSV file with columns
+    "alias" and "allele".
+
+    Parameters
+    ----------
+    path : string
+    alleles : list of string
+        Normalized allele names
+    """
+    rows = [
+        (alias, allele)
+        for allele in sorted(set(alleles))
+        for alias in allele_aliases(allele)
+    ]
+    pandas.DataFrame(rows, columns=["alias", "allele"]).to_csv(
+        path, index=False)
+
+
+def read_allele_aliases(path):
+    """
+    Load an alias table written by `write_allele_aliases` into the memo used
+    by `normalize_allele_name`.
+
+    Parameters
+    ----------
+    path : string
+
+    Returns
+    -------
+    dict of alias -> normalized allele name
+    """
+    df = pandas.read_csv(path, keep_default_na=False)
+    aliases = dict(zip(df.alias, df.allele))
+    _NORMALIZED_ALLELE_NAMES.update(aliases)
+    return aliases
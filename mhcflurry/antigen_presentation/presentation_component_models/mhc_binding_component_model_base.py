@@ -7,7 +7,7 @@ from ...common import dataframe_cryptographic_hash
 
 from .presentation_component_model import PresentationComponentModel
 from ..decoy_strategies import SameTranscriptsAsHits
-from ..percent_rank_transform import PercentRankTransform
+from ...percent_rank_transform import PercentRankTransform
 
 
 class MHCBindingComponentModelBase(PresentationComponentModel):
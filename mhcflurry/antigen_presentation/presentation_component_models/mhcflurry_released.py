@@ -3,9 +3,8 @@ import logging
 import numpy
 import pandas
 
-from mhcnames import normalize_allele_name
-
-from ..percent_rank_transform import PercentRankTransform
+from ...percent_rank_transform import PercentRankTransform
+from ...allele_names import normalize_allele_names
 from ...encodable_sequences import EncodableSequences
 from .presentation_component_model import PresentationComponentModel
 from ...class1_affinity_prediction.class1_affinity_predictor import (
@@ -23,7 +22,11 @@ class MHCflurryReleased(PresentationComponentModel):
 
     random_peptides_for_percent_rank : list of string
         If specified, then percentile rank will be calibrated and emitted
-        using the given peptides.
+        using the given peptides. Otherwise, if the predictor has a saved
+        percentile rank calibration (see
+        `Class1AffinityPredictor.calibrate_percentile_ranks`), percentile
+        rank is emitted using that calibration. Peptides given here take
+        precedence over the saved calibration.
 
     predictor : Class1EnsembleMultiAllelePredictor-like object
         Predictor to use.
@@ -43,8 +46,11 @@ class MHCflurryReleased(PresentationComponentModel):
         self.predictor = predictor
         self.predictor_name = predictor_name
         if random_peptides_for_percent_rank is None:
-            self.percent_rank_transforms = None
             self.random_peptides_for_percent_rank = None
+            if predictor.allele_to_percent_rank_transform:
+                self.percent_rank_transforms = {}
+            else:
+                self.percent_rank_transforms = None
         else:
             self.percent_rank_transforms = {}
             self.random_peptides_for_percent_rank = numpy.array(
@@ -61,7 +67,17 @@ class MHCflurryReleased(PresentationComponentModel):
 
     def fit_percentile_rank_if_needed(self, alleles):
         for allele in alleles:
-            if allele not in self.percent_rank_transforms:
+            if allele in self.percent_rank_transforms:
+                continue
+            if self.random_peptides_for_percent_rank is None:
+                # Use the calibration saved with the predictor.
+                if allele not in self.predictor.allele_to_percent_rank_transform:
+                    raise ValueError(
+                        "No percentile rank calibration for allele %s" % (
+                            allele))
+                self.percent_rank_transforms[allele] = (
+                    self.predictor.allele_to_percent_rank_transform[allele])
+            else:
                 logging.info('fitting percent rank for allele: %s' % allele)
                 self.percent_rank_transforms[allele] = PercentRankTransform()
                 self.percent_rank_transforms[allele].fit(
@@ -70,10 +86,7 @@ class MHCflurryReleased(PresentationComponentModel):
                         peptides=self.random_peptides_for_percent_rank))
 
     def predict_min_across_alleles(self, alleles, peptides):
-        alleles = list(set([
-            normalize_allele_name(allele)
-            for allele in alleles
-        ]))
+        alleles = list(set(normalize_allele_names(alleles)))
         peptides = EncodableSequences.create(peptides)
         df = pandas.DataFrame()
         df["peptide"] = peptides.sequences
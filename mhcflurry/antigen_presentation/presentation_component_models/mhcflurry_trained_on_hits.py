@@ -3,8 +3,8 @@ from copy import copy
 import pandas
 from numpy import log, exp, nanmean
 
+from ...allele_names import normalize_allele_name
 from ...class1_affinity_prediction import Class1AffinityPredictor
-from mhcnames import normalize_allele_name
 
 from .mhc_binding_component_model_base import MHCBindingComponentModelBase
 
@@ -7,6 +7,7 @@ import pandas
 
 from ...common import (
     dataframe_cryptographic_hash, assert_no_null, freeze_object)
+from ...encodable_sequences import EncodableSequences
 
 
 def cache_dict_for_policy(policy):
@@ -183,10 +184,14 @@ class PresentationComponentModel(object):
         if len(grouped) == 1:
             print("%s : using single-experiment predict optimization" % (
                 str(self)))
-            return_value = pandas.DataFrame(
-                self.predict_for_experiment(
-                    str(peptides_df.iloc[0].experiment_name),
-                    peptides_df.peptide.values))
+            (unique_peptides, inverse) = EncodableSequences.create(
+                peptides_df.peptide.values).unique()
+            result_dict = self.predict_for_experiment(
+                str(peptides_df.iloc[0].experiment_name),
+                unique_peptides.sequences)
+            return_value = pandas.DataFrame(dict(
+                (col, numpy.asarray(values)[inverse])
+                for (col, values) in result_dict.items()))
             assert len(return_value) == len(peptides_df), (
                 "%d != %d" % (len(return_value), len(peptides_df)),
                 str(self),
@@ -207,12 +212,13 @@ class PresentationComponentModel(object):
                     result_df.loc[sub_df.index, "experiment_name"] ==
                     experiment_name).all()
 
-                unique_peptides = list(set(sub_df.peptide))
+                (unique_peptides, inverse) = EncodableSequences.create(
+                    sub_df.peptide.values).unique()
                 if len(unique_peptides) == 0:
                     continue
 
                 result_dict = self.predict_for_experiment(
-                    experiment_name, unique_peptides)
+                    experiment_name, unique_peptides.sequences)
 
                 for col in columns:
                     assert len(result_dict[col]) == len(unique_peptides), (
@@ -225,15 +231,10 @@ class PresentationComponentModel(object):
                             col,
                             result_dict[col],
                             experiment_name,
-                            unique_peptides))
-                    prediction_series = pandas.Series(
-                        result_dict[col],
-                        index=unique_peptides)
-                    prediction_values = (
-                        prediction_series.ix[sub_df.peptide.values]).values
+                            unique_peptides.sequences))
                     result_df.loc[
                         sub_df.index, col
-                    ] = prediction_values
+                    ] = numpy.asarray(result_dict[col])[inverse]
 
             assert len(result_df) == len(peptides_df), "%s != %s" % (
                 len(result_df),
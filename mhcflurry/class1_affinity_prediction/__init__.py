@@ -2,8 +2,10 @@ from __future__ import absolute_import
 
 from .class1_neural_network import Class1NeuralNetwork
 from .class1_affinity_predictor import Class1AffinityPredictor
+from .prediction_cache import PredictionCache
 
 __all__ = [
     'Class1NeuralNetwork',
     'Class1AffinityPredictor',
+    'PredictionCache',
 ]
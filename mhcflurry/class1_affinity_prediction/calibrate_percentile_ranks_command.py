@@ -0,0 +1,85 @@
+"""
+Calibrate percentile ranks for the alleles of a Class1 models directory, so
+that predictions include a "prediction_percentile" column. The calibration
+is saved in the models directory and needs to be computed only once.
+
+Example:
+
+    mhcflurry-class1-calibrate-percentile-ranks --models DIR
+"""
+from __future__ import (
+    print_function,
+    division,
+    absolute_import,
+)
+import os
+import sys
+import argparse
+import time
+
+from .class1_affinity_predictor import Class1AffinityPredictor
+from ..common import configure_logging
+from ..downloads import get_path
+
+
+parser = argparse.ArgumentParser(usage=__doc__)
+
+parser.add_argument(
+    "--models",
+    metavar="DIR",
+    default=None,
+    help="Directory containing models. Default: the downloaded models")
+parser.add_argument(
+    "--out-models-dir",
+    metavar="DIR",
+    default=None,
+    help="Directory to write the calibrated models. Default: same as --models")
+parser.add_argument(
+    "--alleles",
+    metavar="ALLELE",
+    nargs="+",
+    help="Alleles to calibrate. Default: all supported alleles")
+parser.add_argument(
+    "--num-peptides-per-length",
+    type=int,
+    metavar="N",
+    default=int(1e5),
+    help="Number of random peptides of each length to predict. "
+    "Default: %(default)s")
+parser.add_argument(
+    "--verbosity",
+    type=int,
+    help="Default: %(default)s",
+    default=0)
+
+
+def run(argv=sys.argv[1:]):
+    args = parser.parse_args(argv)
+
+    configure_logging(verbose=args.verbosity > 0)
+
+    models_dir = args.models
+    if models_dir is None:
+        models_dir = get_path("models_class1", "models")
+    out_models_dir = args.out_models_dir
+    if out_models_dir is None:
+        out_models_dir = models_dir
+    if not os.path.exists(out_models_dir):
+        os.makedirs(out_models_dir)
+
+    predictor = Class1AffinityPredictor.load(models_dir)
+
+    start = time.time()
+    predictor.calibrate_percentile_ranks(
+        num_peptides_per_length=args.num_peptides_per_length,
+        alleles=args.alleles)
+    print("Calibrated percentile ranks for %d alleles in %0.2f sec." % (
+        len(predictor.allele_to_percent_rank_transform),
+        time.time() - start))
+
+    if out_models_dir == models_dir:
+        # Leave the weights, in whatever format, as they are.
+        predictor.save_percent_ranks(out_models_dir)
+    else:
+        predictor.save(out_models_dir)
+    print("Wrote: %s" % out_models_dir)
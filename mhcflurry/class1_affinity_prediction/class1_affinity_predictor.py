@@ -1,20 +1,35 @@
 import collections
+import functools
+import itertools
 import time
 import hashlib
 import json
 from os.path import join, exists
 from six import string_types
 import logging
+import os
+import threading
 
 import numpy
 import pandas
 
-import mhcnames
-
-from ..encodable_sequences import EncodableSequences
+from ..allele_names import (
+    normalize_allele_name,
+    normalize_allele_names,
+    read_allele_aliases,
+    write_allele_aliases)
+from ..amino_acid import AMINO_ACID_INDEX
+from ..common import random_peptides
+from ..encodable_sequences import EncodableSequences, index_encoding_table
+from ..percent_rank_transform import PercentRankTransform
 from ..downloads import get_path
+from ..regression_target import to_ic50
+from ..common import nanmean_rows, nanquantile_rows
 
 from .class1_neural_network import Class1NeuralNetwork
+from .numpy_network import NumpyNetwork
+from .weights_archive import (
+    WeightsArchive, write_weights_archive, file_digest)
 
 
 class Class1AffinityPredictor(object):
@@ -27,12 +42,21 @@ class Class1AffinityPredictor(object):
     It supports prediction across multiple alleles using ensembles of single-
     or pan-allele predictors.
     """
+    # Maximum number of sets of stacked allele-specific networks kept. See
+    # _cross_allele_networks.
+    CROSS_ALLELE_NETWORKS_CACHE_SIZE = 8
+
     def __init__(
             self,
             allele_to_allele_specific_models=None,
             class1_pan_allele_models=None,
             allele_to_pseudosequence=None,
-            manifest_df=None):
+            manifest_df=None,
+            backend=None,
+            batch_size="auto",
+            max_loaded_alleles=None,
+            prediction_cache=None,
+            allele_to_percent_rank_transform=None):
         """
         Parameters
         ----------
@@ -50,6 +74,28 @@ class Class1AffinityPredictor(object):
             Only required if you want to update an existing serialization of a
             Class1AffinityPredictor. Otherwise this dataframe will be generated
             automatically based on the supplied models.
+
+        backend : string, optional
+            Backend used to run the networks, e.g. "keras" or "numpy". See
+            `Class1NeuralNetwork.predict`.
+
+        batch_size : int or "auto"
+            Number of inputs to encode and run through each network at once.
+            See `Class1NeuralNetwork.prediction_batch_size`.
+
+        max_loaded_alleles : int, optional
+            For models whose weights are loaded on first use (see `load`),
+            the maximum number of alleles whose allele-specific model weights
+            are kept in memory. The weights of the least recently used
+            alleles are released beyond this.
+
+        prediction_cache : PredictionCache, optional
+            Cache of predictions for (allele, peptide) pairs. Only pairs not
+            in the cache are run through the models.
+
+        allele_to_percent_rank_transform : dict of string -> PercentRankTransform
+            Percentile rank calibration for each allele. See
+            `calibrate_percentile_ranks`.
         """
 
         if allele_to_allele_specific_models is None:
@@ -63,6 +109,44 @@ class Class1AffinityPredictor(object):
         self.allele_to_allele_specific_models = allele_to_allele_specific_models
         self.class1_pan_allele_models = class1_pan_allele_models
         self.allele_to_pseudosequence = allele_to_pseudosequence
+        self.backend = backend
+        self.batch_size = batch_size
+        self.max_loaded_alleles = max_loaded_alleles
+        self.prediction_cache = prediction_cache
+        if allele_to_percent_rank_transform is None:
+            allele_to_percent_rank_transform = {}
+        self.allele_to_percent_rank_transform = allele_to_percent_rank_transform
+
+        # Hash of the models, computed on first use. See fingerprint.
+        self._fingerprint = None
+
+        # Guards _allele_usage and _cross_allele_networks_cache, which are
+        # updated by concurrent predictions.
+        self._lock = threading.Lock()
+
+        # Alleles used for allele-specific predictions, least recently used
+        # first.
+        self._allele_usage = collections.OrderedDict()
+
+        # Allele-specific models stacked for the numpy backend, computed on
+        # first use. See _cross_allele_networks.
+        # (precision, frozenset of alleles) -> stacked networks, least
+        # recently used first
+        self._cross_allele_networks_cache = collections.OrderedDict()
+
+        # Table of allele pseudosequences, encoded once for each pan-allele
+        # model. Per-row network inputs are taken from it by allele index.
+        self.pseudosequence_alleles = None
+        self.pseudosequences = None
+        if allele_to_pseudosequence:
+            self.pseudosequence_alleles = pandas.Index(
+                sorted(allele_to_pseudosequence))
+            self.pseudosequences = EncodableSequences.create([
+                allele_to_pseudosequence[allele]
+                for allele in self.pseudosequence_alleles
+            ])
+            for model in self.class1_pan_allele_models:
+                model.pseudosequence_to_network_input(self.pseudosequences)
 
         if manifest_df is None:
             rows = []
@@ -86,6 +170,35 @@ class Class1AffinityPredictor(object):
                 columns=["model_name", "allele", "config_json", "model"])
         self.manifest_df = manifest_df
 
+    def fingerprint(self):
+        """
+        Hash identifying the models of this predictor, computed from the
+        name, configuration, and weights of each model in the manifest. Used
+        to key `prediction_cache` entries.
+
+        Weights loaded from a models directory are identified by a digest of
+        the file they were read from (see
+        `Class1NeuralNetwork.weights_fingerprint`). The fingerprint is
+        therefore the same for copies of the models directory, and changes
+        when the models are retrained or re-saved, including at a different
+        precision. Each file is read once, on the first call.
+
+        Returns
+        -------
+        string
+        """
+        if self._fingerprint is None:
+            digest = hashlib.sha1()
+            for (model_name, config_json, model) in zip(
+                    self.manifest_df.model_name,
+                    self.manifest_df.config_json,
+                    self.manifest_df.model):
+                digest.update(model_name.encode())
+                digest.update(config_json.encode())
+                digest.update(model.weights_fingerprint().encode())
+            self._fingerprint = digest.hexdigest()
+        return self._fingerprint
+
     @property
     def supported_alleles(self):
         """
@@ -119,15 +232,25 @@ class Class1AffinityPredictor(object):
             max(lower for (lower, upper) in length_ranges),
             min(upper for (lower, upper) in length_ranges))
 
-    def save(self, models_dir, model_names_to_write=None):
+    # Formats for the model weights. See save.
+    WEIGHTS_FORMATS = ("npz", "archive", "archive-float16")
+
+    def save(self, models_dir, model_names_to_write=None, weights_format="npz"):
         """
         Serialize the predictor to a directory on disk.
         
         The serialization format consists of a file called "manifest.csv" with
-        the configurations of each Class1NeuralNetwork, along with per-network
-        files giving the model weights. If there are pan-allele predictors in
-        the ensemble, the allele pseudosequences are also stored in the
-        directory.
+        the configurations of each Class1NeuralNetwork, along with the model
+        weights. If there are pan-allele predictors in the ensemble, the allele
+        pseudosequences are also stored in the directory. A table of common
+        spellings of the supported alleles, "allele_aliases.csv", is written
+        so that `load` can normalize them without parsing (see
+        `allele_names.write_allele_aliases`), as is the percentile rank
+        calibration, if any (see `save_percent_ranks`).
+
+        The weights are written either as one ".npz" file per network or as a
+        single weights archive (see `weights_archive`), which is faster to
+        load.
         
         Parameters
         ----------
@@ -136,8 +259,16 @@ class Class1AffinityPredictor(object):
             
         model_names_to_write : list of string, optional
             Only write the weights for the specified models. Useful for
-            incremental updates during training.
+            incremental updates during training. Ignored for weights
+            archives, which always include all models.
+
+        weights_format : string
+            One of WEIGHTS_FORMATS: "npz" for per-network files, "archive"
+            for a weights archive, or "archive-float16" for a weights archive
+            storing the weights as float16.
         """
+        if weights_format not in self.WEIGHTS_FORMATS:
+            raise ValueError("Unsupported weights format: %s" % weights_format)
         num_models = len(self.class1_pan_allele_models) + sum(
             len(v) for v in self.allele_to_allele_specific_models.values())
         assert len(self.manifest_df) == num_models, (
@@ -148,15 +279,34 @@ class Class1AffinityPredictor(object):
             # Write all models
             model_names_to_write = self.manifest_df.model_name.values
 
-        sub_manifest_df = self.manifest_df.ix[
-            self.manifest_df.model_name.isin(model_names_to_write)
-        ]
+        archive_path = self.weights_archive_path(models_dir)
+        if weights_format == "npz":
+            sub_manifest_df = self.manifest_df.ix[
+                self.manifest_df.model_name.isin(model_names_to_write)
+            ]
 
-        for (_, row) in sub_manifest_df.iterrows():
-            weights_path = self.weights_path(models_dir, row.model_name)
-            Class1AffinityPredictor.save_weights(
-                row.model.get_weights(), weights_path)
-            logging.info("Wrote: %s" % weights_path)
+            for (_, row) in sub_manifest_df.iterrows():
+                weights_path = self.weights_path(models_dir, row.model_name)
+                Class1AffinityPredictor.save_weights(
+                    row.model.get_weights(), weights_path)
+                logging.info("Wrote: %s" % weights_path)
+
+            if exists(archive_path):
+                # The archive takes precedence on load, so it must not be
+                # left out of date.
+                os.remove(archive_path)
+                logging.info("Removed: %s" % archive_path)
+        else:
+            write_weights_archive(
+                archive_path,
+                (
+                    (row.model_name, row.model.get_weights())
+                    for (_, row) in self.manifest_df.iterrows()
+                ),
+                dtype=(
+                    "float16" if weights_format == "archive-float16"
+                    else "float32"))
+            logging.info("Wrote: %s" % archive_path)
 
         write_manifest_df = self.manifest_df[[
             c for c in self.manifest_df.columns if c != "model"
@@ -165,10 +315,60 @@ class Class1AffinityPredictor(object):
         write_manifest_df.to_csv(manifest_path, index=False)
         logging.info("Wrote: %s" % manifest_path)
 
+        if self.allele_to_pseudosequence:
+            pseudosequences_path = join(models_dir, "pseudosequences.csv")
+            pandas.Series(
+                self.allele_to_pseudosequence,
+                name="pseudosequence").rename_axis("allele").to_csv(
+                pseudosequences_path, header=True)
+            logging.info("Wrote: %s" % pseudosequences_path)
+
+        if self.allele_to_percent_rank_transform:
+            self.save_percent_ranks(models_dir)
+
+        aliases_path = join(models_dir, "allele_aliases.csv")
+        write_allele_aliases(aliases_path, self.supported_alleles)
+        logging.info("Wrote: %s" % aliases_path)
+
+    def save_percent_ranks(self, models_dir):
+        """
+        Write the percentile rank calibration (see
+        `calibrate_percentile_ranks`) to "percent_ranks.csv" in the given
+        directory. This is done by `save`, but may also be used on its own to
+        add a calibration to an existing models directory without rewriting
+        the weights.
+
+        The file has a row for each bin edge and a column for each allele
+        giving the percentile rank of predictions at that edge.
+
+        Parameters
+        ----------
+        models_dir : string
+            Path to directory
+        """
+        percent_ranks_path = join(models_dir, "percent_ranks.csv")
+        pandas.DataFrame(
+            collections.OrderedDict(
+                (allele, transform.to_series())
+                for (allele, transform) in sorted(
+                    self.allele_to_percent_rank_transform.items()))
+        ).rename_axis("bin_edge").to_csv(percent_ranks_path)
+        logging.info("Wrote: %s" % percent_ranks_path)
+
     @staticmethod
-    def load(models_dir=None, max_models=None):
+    def load(
+            models_dir=None,
+            max_models=None,
+            backend=None,
+            batch_size="auto",
+            lazy=False,
+            max_loaded_alleles=None,
+            prediction_cache=None):
         """
         Deserialize a predictor from a directory on disk.
+
+        If the directory has a weights archive (see `save`), the weights are
+        read from it, otherwise from the per-network ".npz" files.
         
         Parameters
         ----------
@@ -178,6 +378,25 @@ class Class1AffinityPredictor(object):
         max_models : int, optional
             Maximum number of Class1NeuralNetwork instances to load
 
+        backend : string, optional
+            Backend used to run the networks, e.g. "keras" or "numpy". See
+            `Class1NeuralNetwork.predict`.
+
+        batch_size : int or "auto"
+            Number of inputs to encode and run through each network at once.
+            See `Class1NeuralNetwork.prediction_batch_size`.
+
+        lazy : boolean
+            If True, only the manifest is read here, and the weights of each
+            model are loaded when the model is first used.
+
+        max_loaded_alleles : int, optional
+            With lazy loading, the maximum number of alleles whose
+            allele-specific model weights are kept in memory. See `__init__`.
+
+        prediction_cache : PredictionCache, optional
+            Cache of predictions. See `__init__`.
+
         Returns
         -------
         Class1AffinityPredictor
@@ -188,15 +407,36 @@ class Class1AffinityPredictor(object):
         manifest_path = join(models_dir, "manifest.csv")
         manifest_df = pandas.read_csv(manifest_path, nrows=max_models)
 
+        archive = None
+        if exists(Class1AffinityPredictor.weights_archive_path(models_dir)):
+            archive = WeightsArchive(
+                Class1AffinityPredictor.weights_archive_path(models_dir))
+
         allele_to_allele_specific_models = collections.defaultdict(list)
         class1_pan_allele_models = []
         all_models = []
         for (_, row) in manifest_df.iterrows():
-            weights_filename = Class1AffinityPredictor.weights_path(
-                models_dir, row.model_name)
-            weights = Class1AffinityPredictor.load_weights(weights_filename)
+            if archive is not None:
+                weights_loader = functools.partial(
+                    archive.get_weights, row.model_name)
+                weights_source = archive.signature
+            else:
+                weights_path = Class1AffinityPredictor.weights_path(
+                    models_dir, row.model_name)
+                weights_loader = functools.partial(
+                    Class1AffinityPredictor.load_weights, weights_path)
+                weights_source = functools.partial(file_digest, weights_path)
             config = json.loads(row.config_json)
-            model = Class1NeuralNetwork.from_config(config, weights=weights)
+            if lazy:
+                model = Class1NeuralNetwork.from_config(
+                    config,
+                    weights_loader=weights_loader,
+                    weights_source=weights_source)
+            else:
+                model = Class1NeuralNetwork.from_config(
+                    config,
+                    weights=weights_loader(),
+                    weights_source=weights_source)
             if row.allele == "pan-class1":
                 class1_pan_allele_models.append(model)
             else:
@@ -209,7 +449,21 @@ class Class1AffinityPredictor(object):
         if exists(join(models_dir, "pseudosequences.csv")):
             pseudosequences = pandas.read_csv(
                 join(models_dir, "pseudosequences.csv"),
-                index_col="allele").to_dict()
+                index_col="allele").pseudosequence.to_dict()
+
+        allele_to_percent_rank_transform = None
+        if exists(join(models_dir, "percent_ranks.csv")):
+            percent_ranks_df = pandas.read_csv(
+                join(models_dir, "percent_ranks.csv"), index_col="bin_edge")
+            allele_to_percent_rank_transform = dict(
+                (allele, PercentRankTransform.from_series(
+                    percent_ranks_df[allele].dropna()))
+                for allele in percent_ranks_df.columns)
+
+        # Common spellings of the supported alleles, so they are normalized
+        # without parsing.
+        if exists(join(models_dir, "allele_aliases.csv")):
+            read_allele_aliases(join(models_dir, "allele_aliases.csv"))
 
         logging.info(
             "Loaded %d class1 pan allele predictors, %d pseudosequences, and "
@@ -226,7 +480,12 @@ class Class1AffinityPredictor(object):
             allele_to_allele_specific_models=allele_to_allele_specific_models,
             class1_pan_allele_models=class1_pan_allele_models,
             allele_to_pseudosequence=pseudosequences,
-            manifest_df=manifest_df)
+            manifest_df=manifest_df,
+            backend=backend,
+            batch_size=batch_size,
+            max_loaded_alleles=max_loaded_alleles,
+            prediction_cache=prediction_cache,
+            allele_to_percent_rank_transform=allele_to_percent_rank_transform)
         return result
 
     @staticmethod
@@ -264,6 +523,22 @@ class Class1AffinityPredictor(object):
         """
         return join(models_dir, "weights_%s.npz" % model_name)
 
+    @staticmethod
+    def weights_archive_path(models_dir):
+        """
+        Generate the path to the weights archive in a models directory. See
+        `save`.
+
+        Parameters
+        ----------
+        models_dir : string
+
+        Returns
+        -------
+        string
+        """
+        return join(models_dir, "weights.mhcflurry")
+
     def fit_allele_specific_predictors(
             self,
             n_models,
@@ -306,7 +581,7 @@ class Class1AffinityPredictor(object):
         list of Class1NeuralNetwork
         """
 
-        allele = mhcnames.normalize_allele_name(allele)
+        allele = normalize_allele_name(allele)
         models = self._fit_predictors(
             n_models=n_models,
             architecture_hyperparameters=architecture_hyperparameters,
@@ -331,6 +606,9 @@ class Class1AffinityPredictor(object):
             self.manifest_df = pandas.concat(
                 [self.manifest_df, row], ignore_index=True)
             self.allele_to_allele_specific_models[allele].append(model)
+            with self._lock:
+                self._cross_allele_networks_cache.clear()
+            self._fingerprint = None
             if models_dir_for_save:
                 self.save(
                     models_dir_for_save, model_names_to_write=[model_name])
@@ -379,7 +657,7 @@ class Class1AffinityPredictor(object):
         list of Class1NeuralNetwork
         """
 
-        alleles = pandas.Series(alleles).map(mhcnames.normalize_allele_name)
+        alleles = pandas.Series(normalize_allele_names(alleles))
         allele_pseudosequences = alleles.map(self.allele_to_pseudosequence)
 
         models = self._fit_predictors(
@@ -401,6 +679,7 @@ class Class1AffinityPredictor(object):
             ])).to_frame().T
             self.manifest_df = pandas.concat(
                 [self.manifest_df, row], ignore_index=True)
+            self._fingerprint = None
             if models_dir_for_save:
                 self.save(
                     models_dir_for_save, model_names_to_write=[model_name])
@@ -441,6 +720,135 @@ class Class1AffinityPredictor(object):
                 verbose=verbose)
             yield model
 
+    def _use_alleles(self, alleles):
+        """
+        Private helper for `predict_to_dataframe` that records the alleles
+        used by a prediction and, if `max_loaded_alleles` is set, releases the
+        allele-specific model weights of the least recently used other
+        alleles. Released weights are loaded again on next use.
+
+        Parameters
+        ----------
+        alleles : list of string
+        """
+        with self._lock:
+            for allele in alleles:
+                self._allele_usage.pop(allele, None)
+                self._allele_usage[allele] = True
+            if self.max_loaded_alleles is None:
+                return
+            requested = set(alleles)
+            excess = len(self._allele_usage) - max(
+                self.max_loaded_alleles, len(requested))
+            evicted = [
+                allele for allele in self._allele_usage
+                if allele not in requested
+            ][:max(excess, 0)]
+            for allele in evicted:
+                del self._allele_usage[allele]
+
+            # Stacked networks hold copies of the released weights.
+            for key in list(self._cross_allele_networks_cache):
+                if not key[1].isdisjoint(evicted):
+                    del self._cross_allele_networks_cache[key]
+
+        # Weights in use by other predictions are released when they finish:
+        # see Class1NeuralNetwork.pinned_weights.
+        for allele in evicted:
+            for model in self.allele_to_allele_specific_models[allele]:
+                model.unload_weights()
+
+    def _cross_allele_networks(self, precision="float32", alleles=None):
+        """
+        Allele-specific models grouped by architecture and input encoding for
+        prediction with the numpy backends. The models of each group are
+        stacked into one NumpyNetwork, so that rows for any mix of alleles
+        can be evaluated together.
+
+        When some models' weights are not loaded (see the `lazy` argument of
+        `load`), only the models for the given alleles and the models whose
+        weights are already loaded are stacked.
+
+        The stacked networks are cached by precision and set of alleles. A
+        cached set including all the given alleles is reused, so requests for
+        varying subsets of the loaded alleles do not restack models. Up to
+        CROSS_ALLELE_NETWORKS_CACHE_SIZE sets are kept.
+
+        Parameters
+        ----------
+        precision : string
+            Precision of the stored weights. See
+            `NumpyNetwork.with_precision`.
+
+        alleles : list of string, optional
+            Alleles that must be included. If not specified, all alleles are
+            included.
+
+        Returns
+        -------
+        list of (NumpyNetwork, Class1NeuralNetwork, dict) tuples
+            The stacked network, a model of the group (used to encode
+            inputs), and a dict from allele to a list of (model number, index
+            in the stacked network) pairs
+        """
+        if alleles is None:
+            alleles = self.allele_to_allele_specific_models
+        required = set(alleles).intersection(
+            self.allele_to_allele_specific_models)
+        with self._lock:
+            key = next(
+                (
+                    key for key in self._cross_allele_networks_cache
+                    if key[0] == precision and required.issubset(key[1])
+                ),
+                None)
+            if key is not None:
+                networks = self._cross_allele_networks_cache.pop(key)
+                self._cross_allele_networks_cache[key] = networks
+                return networks
+            candidates = (
+                self.allele_to_allele_specific_models
+                if self.max_loaded_alleles is None
+                else list(self._allele_usage))
+
+        covered = frozenset(required.union(
+            allele for allele in candidates
+            if all(
+                model.weights_loaded
+                for model in self.allele_to_allele_specific_models[allele])))
+        groups = collections.OrderedDict()
+        for allele in sorted(covered):
+            models = self.allele_to_allele_specific_models[allele]
+            for (i, model) in enumerate(models):
+                (group_models, allele_to_indices) = groups.setdefault(
+                    model.stacking_key(), ([], {}))
+                allele_to_indices.setdefault(allele, []).append(
+                    (i, len(group_models)))
+                group_models.append(model)
+        networks = [
+            (
+                NumpyNetwork.stack([
+                    model.numpy_network(precision)
+                    for model in group_models
+                ]),
+                group_models[0],
+                allele_to_indices
+            )
+            for (group_models, allele_to_indices) in groups.values()
+        ]
+
+        with self._lock:
+            # Not cached if alleles were released meanwhile by _use_alleles,
+            # as the stacked networks would keep their weights in memory.
+            if self.max_loaded_alleles is None or covered.issubset(
+                    self._allele_usage):
+                self._cross_allele_networks_cache[(precision, covered)] = (
+                    networks)
+                while (len(self._cross_allele_networks_cache) >
+                        self.CROSS_ALLELE_NETWORKS_CACHE_SIZE):
+                    self._cross_allele_networks_cache.popitem(last=False)
+        return networks
+
     def predict(self, peptides, alleles=None, allele=None, throw=True):
         """
         Predict nM binding affinities.
@@ -452,6 +860,9 @@ class Class1AffinityPredictor(object):
         all predictions will be for the given allele. If 'alleles' is specified
         it must be the same length as 'peptides' and give the allele
         corresponding to each peptide.
+
+        Unlike `predict_to_dataframe`, no DataFrame or prediction intervals
+        are computed.
         
         Parameters
         ----------
@@ -467,13 +878,12 @@ class Class1AffinityPredictor(object):
         -------
         numpy.array of predictions
         """
-        df = self.predict_to_dataframe(
+        (_, _, _, log_predictions) = self._predict_log_affinities(
             peptides=peptides,
             alleles=alleles,
             allele=allele,
-            throw=throw,
-        )
-        return df.prediction.values
+            throw=throw)
+        return numpy.exp(nanmean_rows(log_predictions))
 
     def predict_to_dataframe(
             self,
@@ -509,7 +919,464 @@ class Class1AffinityPredictor(object):
 
         Returns
         -------
-        pandas.DataFrame of predictions
+        pandas.DataFrame of predictions. If the predictor has a percentile
+        rank calibration (see `calibrate_percentile_ranks`), this includes a
+        "prediction_percentile" column.
+        """
+        (peptides, alleles, model_columns, log_predictions) = (
+            self._predict_log_affinities(
+                peptides=peptides,
+                alleles=alleles,
+                allele=allele,
+                throw=throw))
+
+        # Geometric mean and 5-95% interval
+        (log_low, log_high) = nanquantile_rows(log_predictions, [0.05, 0.95])
+        df = pandas.DataFrame(collections.OrderedDict([
+            ("peptide", peptides.sequences),
+            ("allele", alleles),
+            ("prediction", numpy.exp(nanmean_rows(log_predictions))),
+            ("prediction_low", numpy.exp(log_low)),
+            ("prediction_high", numpy.exp(log_high)),
+        ]))
+        if self.allele_to_percent_rank_transform:
+            df["prediction_percentile"] = self.percentile_ranks(
+                df.prediction.values, alleles=alleles, throw=False)
+        if include_individual_model_predictions:
+            # Only models used for at least one row are included.
+            for (i, column) in enumerate(model_columns):
+                if not numpy.isnan(log_predictions[:, i]).all():
+                    df[column] = numpy.exp(log_predictions[:, i])
+        return df
+
+    def calibrate_percentile_ranks(
+            self,
+            peptides=None,
+            num_peptides_per_length=int(1e5),
+            alleles=None,
+            bins=None):
+        """
+        Compute the distribution of predictions for random peptides for each
+        allele, used by `percentile_ranks` and `predict_to_dataframe` to give
+        the percentile rank of a prediction. This is saved with the
+        predictor (see `save`), so it needs to be computed only once per set
+        of models.
+
+        Parameters
+        ----------
+        peptides : list of string or EncodableSequences, optional
+            Peptides to predict. If not specified, num_peptides_per_length
+            random peptides of each supported length are used.
+
+        num_peptides_per_length : int
+            Number of random peptides of each length, if peptides is not
+            specified.
+
+        alleles : list of string, optional
+            Alleles to calibrate. Default: all supported alleles.
+
+        bins : numpy.array, optional
+            Bin edges, in nM, of the stored histograms. Default: 1000 log
+            spaced edges between 1 and 50000 nM.
+        """
+        if peptides is None:
+            peptides = []
+            (min_length, max_length) = self.supported_peptide_lengths
+            for length in range(min_length, max_length + 1):
+                peptides.extend(
+                    random_peptides(num_peptides_per_length, length=length))
+        peptides = EncodableSequences.create(peptides)
+        if alleles is None:
+            alleles = self.supported_alleles
+        if bins is None:
+            bins = to_ic50(numpy.linspace(1, 0, 1000))
+
+        for allele in alleles:
+            logging.info("Calibrating percentile ranks for %s" % allele)
+            predictions = self.predict(peptides, allele=allele)
+            transform = PercentRankTransform()
+            transform.fit(predictions, bins=bins)
+            self.allele_to_percent_rank_transform[
+                normalize_allele_name(allele)] = transform
+
+    def percentile_ranks(self, affinities, alleles=None, allele=None, throw=True):
+        """
+        Return percentile ranks for the given nM affinities, relative to the
+        predictions for random peptides (see `calibrate_percentile_ranks`).
+        Lower values indicate stronger binding.
+
+        Parameters
+        ----------
+        affinities : list of float
+            nM affinities
+        alleles : list of string
+        allele : string
+        throw : boolean
+            If True, a ValueError will be raised for alleles that have not
+            been calibrated. If False, a warning will be logged and the
+            percentile ranks for such alleles will be NaN.
+
+        Returns
+        -------
+        numpy.array of float
+        """
+        affinities = numpy.asarray(affinities, dtype=float)
+        if allele is not None:
+            if alleles is not None:
+                raise ValueError("Specify exactly one of allele or alleles")
+            alleles = [allele]
+            codes = numpy.zeros(len(affinities), dtype=int)
+        else:
+            (codes, alleles) = pandas.factorize(numpy.asarray(alleles))
+        normalized_alleles = normalize_allele_names(alleles)
+
+        result = numpy.full(len(affinities), numpy.nan)
+        unsupported_alleles = []
+        for (code, allele) in enumerate(normalized_alleles):
+            transform = self.allele_to_percent_rank_transform.get(allele)
+            if transform is None:
+                unsupported_alleles.append(allele)
+                continue
+            rows = numpy.flatnonzero(codes == code)
+            result[rows] = transform.transform(affinities[rows])
+        if unsupported_alleles:
+            msg = "No percentile rank calibration for allele(s): %s" % (
+                " ".join(unsupported_alleles))
+            logging.warning(msg)
+            if throw:
+                raise ValueError(msg)
+        result[numpy.isnan(affinities)] = numpy.nan
+        return result
+
+    def predict_matrix(
+            self, peptides, alleles, throw=True, include_interval=False):
+        """
+        Predict nM binding affinities of every peptide to every allele.
+
+        This is equivalent to predicting all (peptide, allele) pairs, but the
+        peptides are encoded once and shared by the models for all alleles,
+        the pairs for all alleles are predicted together, and the results are
+        returned as dense matrices rather than a row per pair.
+
+        Parameters
+        ----------
+        peptides : EncodableSequences or list of string
+        alleles : list of string
+        throw : boolean
+            If True, a ValueError will be raised in the case of unsupported
+            alleles or peptide lengths. If False, a warning will be logged and
+            the predictions for the unsupported alleles or peptides will be NaN.
+        include_interval : boolean
+            If True, also return the 5% and 95% quantiles of the individual
+            model predictions (see `predict_to_dataframe`).
+
+        Returns
+        -------
+        numpy.array of float32 with shape (num peptides, num alleles) giving
+        the predictions, or, if include_interval is True, a tuple of three
+        such arrays giving the predictions and their low and high bounds
+        """
+        if isinstance(peptides, string_types):
+            raise TypeError("peptides must be a list or array, not a string")
+        if isinstance(alleles, string_types):
+            raise TypeError("alleles must be a list or array, not a string")
+        peptides = EncodableSequences.create(peptides)
+
+        (min_peptide_length, max_peptide_length) = (
+            self.supported_peptide_lengths)
+        peptide_lengths = peptides.sequence_lengths()
+        supported_indices = numpy.flatnonzero(
+            (peptide_lengths >= min_peptide_length) &
+            (peptide_lengths <= max_peptide_length))
+        if len(supported_indices) < len(peptides):
+            msg = (
+                "%d peptides have lengths outside of supported range [%d, %d]"
+                % (
+                    len(peptides) - len(supported_indices),
+                    min_peptide_length,
+                    max_peptide_length))
+            logging.warning(msg)
+            if throw:
+                raise ValueError(msg)
+            supported_peptides = peptides.take(
+                supported_indices, share_encodings=False)
+        else:
+            supported_peptides = peptides
+
+        matrices = [
+            numpy.full((len(peptides), len(alleles)), numpy.nan, dtype="float32")
+            for _ in range(3 if include_interval else 1)
+        ]
+        num_supported = len(supported_indices)
+        if num_supported > 0 and len(alleles) > 0:
+            # All (allele, peptide) pairs are predicted in one call, with
+            # rows grouped by allele. The pairs are taken from
+            # supported_peptides, so each peptide is encoded once, and with
+            # the numpy backend the allele-specific models for all alleles
+            # are evaluated together (see _predict_cross_allele).
+            pair_peptides = supported_peptides.take(
+                numpy.tile(numpy.arange(num_supported), len(alleles)))
+            pair_alleles = numpy.repeat(
+                numpy.array(alleles, dtype=object), num_supported)
+            (_, _, _, log_predictions) = self._predict_log_affinities(
+                pair_peptides, alleles=pair_alleles, throw=throw)
+            columns = [nanmean_rows(log_predictions)]
+            if include_interval:
+                columns.extend(
+                    nanquantile_rows(log_predictions, [0.05, 0.95]))
+            for (matrix, column) in zip(matrices, columns):
+                matrix[supported_indices] = numpy.exp(
+                    column.reshape((len(alleles), num_supported)).T)
+        if include_interval:
+            return tuple(matrices)
+        return matrices[0]
+
+    def scan_proteins(
+            self,
+            sequences,
+            alleles,
+            peptide_lengths=None,
+            top_k=None,
+            max_affinity=None,
+            chunk_size=100000):
+        """
+        Predict the peptides of every length in peptide_lengths at every
+        position of the given protein sequences, and return the strongest
+        binders for each allele.
+
+        The peptides are generated and predicted chunk_size at a time, and
+        only the binders selected so far for each allele are kept between
+        chunks, so memory use does not grow with the number of peptides
+        predicted.
+
+        Characters in the sequences that are not amino acids (e.g. "U" or "*")
+        are treated as unknown amino acids ("X").
+
+        Parameters
+        ----------
+        sequences : dict of string -> string, or list of string
+            Protein sequences, keyed by name. If a list is given, the
+            sequences are named by their index in the list.
+        alleles : list of string
+        peptide_lengths : list of int, optional
+            Default: the supported peptide lengths from 8 to 15.
+        top_k : int, optional
+            Return the top_k strongest binders for each allele. Must be at
+            least 1.
+        max_affinity : float, optional
+            Return only binders with predicted affinity at most this many nM.
+            At least one of top_k and max_affinity must be specified; if both
+            are, the top_k strongest binders below max_affinity are returned.
+        chunk_size : int
+            Number of peptides to predict at once.
+
+        Returns
+        -------
+        pandas.DataFrame with columns "sequence_name", "offset" (0-based
+        position of the peptide in the sequence), "peptide", "allele", and
+        "prediction", plus "prediction_percentile" if the predictor has a
+        percentile rank calibration (see `calibrate_percentile_ranks`). The
+        rows are sorted by allele (in the given order) and then prediction.
+        """
+        if top_k is None and max_affinity is None:
+            raise ValueError("Specify at least one of top_k and max_affinity")
+        if top_k is not None and top_k < 1:
+            raise ValueError("top_k must be at least 1, not %s" % top_k)
+        if isinstance(alleles, string_types):
+            raise TypeError("alleles must be a list or array, not a string")
+        alleles = list(normalize_allele_names(alleles))
+
+        (min_peptide_length, max_peptide_length) = (
+            self.supported_peptide_lengths)
+        if peptide_lengths is None:
+            peptide_lengths = range(
+                max(8, min_peptide_length), min(15, max_peptide_length) + 1)
+        peptide_lengths = sorted(set(int(l) for l in peptide_lengths))
+        unsupported_lengths = [
+            l for l in peptide_lengths
+            if l < min_peptide_length or l > max_peptide_length
+        ]
+        if unsupported_lengths:
+            raise ValueError(
+                "Unsupported peptide lengths: %s. Supported range: [%d, %d]"
+                % (unsupported_lengths, min_peptide_length, max_peptide_length))
+
+        columns = ["sequence_name", "offset", "peptide", "allele", "prediction"]
+        if self.allele_to_percent_rank_transform:
+            columns.append("prediction_percentile")
+        if not alleles:
+            return pandas.DataFrame(columns=columns)
+
+        if isinstance(sequences, dict):
+            (names, sequences) = (list(sequences), list(sequences.values()))
+        else:
+            sequences = list(sequences)
+            names = [str(i) for i in range(len(sequences))]
+
+        # Sequences given as bytes (including str on Python 2) are decoded
+        # first, so that encoding the text below cannot fail on non-ASCII
+        # bytes. Each such byte becomes one unknown residue.
+        sequences = [
+            sequence.decode("ascii", "replace")
+            if isinstance(sequence, bytes) else sequence
+            for sequence in sequences
+        ]
+
+        # All sequences, concatenated, with non amino acid characters
+        # replaced by X.
+        buffer = numpy.frombuffer(
+            "".join(sequences).upper().encode("ascii", "replace"),
+            dtype=numpy.uint8).copy()
+        buffer[index_encoding_table(AMINO_ACID_INDEX)[buffer] < 0] = ord(
+            EncodableSequences.unknown_character)
+        sequence_lengths = numpy.array(
+            [len(sequence) for sequence in sequences], dtype=numpy.int64)
+        sequence_starts = numpy.zeros(len(sequences), dtype=numpy.int64)
+        numpy.cumsum(sequence_lengths[:-1], out=sequence_starts[1:])
+
+        # For each allele, the predictions, buffer positions, and lengths of
+        # the binders selected so far.
+        selected = [
+            (
+                numpy.zeros(0, dtype="float32"),
+                numpy.zeros(0, dtype=numpy.int64),
+                numpy.zeros(0, dtype=numpy.int64),
+            )
+            for _ in alleles
+        ]
+        num_peptides = 0
+        for (positions, lengths) in self._scan_chunks(
+                sequence_starts, sequence_lengths, peptide_lengths, chunk_size):
+            offsets = numpy.zeros(len(positions) + 1, dtype=numpy.int64)
+            numpy.cumsum(lengths, out=offsets[1:])
+            peptides = EncodableSequences.from_buffer(
+                buffer[
+                    numpy.repeat(positions - offsets[:-1], lengths) +
+                    numpy.arange(offsets[-1])
+                ],
+                offsets)
+            predictions = self.predict_matrix(peptides, alleles)
+            num_peptides += len(peptides)
+
+            for (i, (selected_predictions, _, _)) in enumerate(selected):
+                chunk_predictions = predictions[:, i]
+                rows = numpy.arange(len(chunk_predictions))
+                if max_affinity is not None:
+                    rows = rows[chunk_predictions[rows] <= max_affinity]
+                if top_k is not None and len(selected_predictions) == top_k:
+                    # Only peptides stronger than the weakest selected binder
+                    # can be selected.
+                    rows = rows[
+                        chunk_predictions[rows] < selected_predictions.max()]
+                candidates = tuple(
+                    numpy.concatenate([previous, new])
+                    for (previous, new) in zip(selected[i], [
+                        chunk_predictions[rows], positions[rows], lengths[rows]
+                    ]))
+                if top_k is not None and len(candidates[0]) > top_k:
+                    keep = numpy.argpartition(candidates[0], top_k - 1)[:top_k]
+                    candidates = tuple(array[keep] for array in candidates)
+                selected[i] = candidates
+        logging.info(
+            "Scanned %d peptides from %d sequences for %d alleles" % (
+                num_peptides, len(sequences), len(alleles)))
+
+        dfs = []
+        for (allele, (allele_predictions, positions, lengths)) in zip(
+                alleles, selected):
+            order = numpy.argsort(allele_predictions, kind="mergesort")
+            (allele_predictions, positions, lengths) = (
+                allele_predictions[order], positions[order], lengths[order])
+            sequence_indices = numpy.searchsorted(
+                sequence_starts, positions, side="right") - 1
+            dfs.append(pandas.DataFrame(collections.OrderedDict([
+                ("sequence_name", numpy.array(names, dtype=object)[
+                    sequence_indices]),
+                ("offset", positions - sequence_starts[sequence_indices]),
+                ("peptide", [
+                    buffer[position:position + length].tobytes().decode(
+                        "ascii")
+                    for (position, length) in zip(positions, lengths)
+                ]),
+                ("allele", allele),
+                ("prediction", allele_predictions.astype(float)),
+            ])))
+        result = pandas.concat(dfs, ignore_index=True)
+        if self.allele_to_percent_rank_transform:
+            result["prediction_percentile"] = self.percentile_ranks(
+                result.prediction.values,
+                alleles=result.allele.values,
+                throw=False)
+        return result
+
+    @staticmethod
+    def _scan_chunks(
+            sequence_starts, sequence_lengths, peptide_lengths, chunk_size):
+        """
+        Generate the peptides scanned by `scan_proteins` in chunks.
+
+        Parameters
+        ----------
+        sequence_starts : numpy.array of int
+            Position of each sequence in the concatenated buffer
+        sequence_lengths : numpy.array of int
+        peptide_lengths : list of int
+        chunk_size : int
+
+        Returns
+        -------
+        generator of (positions, lengths) tuples of numpy.array of int64 giving
+        the buffer position and length of up to chunk_size peptides
+        """
+        pending_positions = []
+        pending_lengths = []
+        num_pending = 0
+        for (start, sequence_length) in zip(sequence_starts, sequence_lengths):
+            for peptide_length in peptide_lengths:
+                num_windows = sequence_length - peptide_length + 1
+                if num_windows <= 0:
+                    continue
+                pending_positions.append(
+                    numpy.arange(start, start + num_windows, dtype=numpy.int64))
+                pending_lengths.append(
+                    numpy.full(num_windows, peptide_length, dtype=numpy.int64))
+                num_pending += num_windows
+            if num_pending >= chunk_size:
+                positions = numpy.concatenate(pending_positions)
+                lengths = numpy.concatenate(pending_lengths)
+                num_full = len(positions) // chunk_size * chunk_size
+                for chunk_start in range(0, num_full, chunk_size):
+                    yield (
+                        positions[chunk_start:chunk_start + chunk_size],
+                        lengths[chunk_start:chunk_start + chunk_size])
+                pending_positions = [positions[num_full:]]
+                pending_lengths = [lengths[num_full:]]
+                num_pending = len(positions) - num_full
+        if num_pending > 0:
+            yield (
+                numpy.concatenate(pending_positions),
+                numpy.concatenate(pending_lengths))
+
+    def _predict_log_affinities(
+            self, peptides, alleles=None, allele=None, throw=True):
+        """
+        Private helper for `predict` and `predict_to_dataframe` that runs
+        each applicable model on each peptide.
+
+        Parameters
+        ----------
+        peptides : EncodableSequences or list of string
+        alleles : list of string
+        allele : string
+        throw : boolean
+
+        Returns
+        -------
+        (EncodableSequences, numpy.array, list of string, numpy.array) tuple
+            The peptides, the alleles, a name for each model column, and a
+            matrix of shape (num peptides, num model columns) giving the
+            natural log of each model's nM prediction, or NaN where a model
+            does not apply.
         """
         if isinstance(peptides, string_types):
             raise TypeError("peptides must be a list or array, not a string")
@@ -522,35 +1389,65 @@ class Class1AffinityPredictor(object):
 
         alleles = numpy.array(alleles)
         peptides = EncodableSequences.create(peptides)
-
-        df = pandas.DataFrame({
-            'peptide': peptides.sequences,
-            'allele': alleles,
-        })
-        df["normalized_allele"] = df.allele.map(
-            mhcnames.normalize_allele_name)
+        normalized_alleles = normalize_allele_names(alleles)
 
         (min_peptide_length, max_peptide_length) = (
             self.supported_peptide_lengths)
-        df["supported_peptide_length"] = (
-            (df.peptide.str.len() >= min_peptide_length) &
-            (df.peptide.str.len() <= max_peptide_length))
-        if (~df.supported_peptide_length).any():
+        peptide_lengths = peptides.sequence_lengths()
+        supported_peptide_length = (
+            (peptide_lengths >= min_peptide_length) &
+            (peptide_lengths <= max_peptide_length))
+        if not supported_peptide_length.all():
             msg = (
                 "%d peptides have lengths outside of supported range [%d, %d]: "
                 "%s" % (
-                    (~df.supported_peptide_length).sum(),
+                    (~supported_peptide_length).sum(),
                     min_peptide_length,
                     max_peptide_length,
-                    str(df.ix[~df.supported_peptide_length].peptide.unique())))
+                    str(pandas.unique(
+                        peptides.sequences[~supported_peptide_length]))))
             logging.warning(msg)
             if throw:
                 raise ValueError(msg)
 
+        supported_indices = numpy.flatnonzero(supported_peptide_length)
+        num_pan_models = len(self.class1_pan_allele_models)
+        num_single_models = max([0] + [
+            len(self.allele_to_allele_specific_models.get(allele, []))
+            for allele in pandas.unique(normalized_alleles[supported_indices])
+        ])
+        model_columns = (
+            ["model_pan_%d" % i for i in range(num_pan_models)] +
+            ["model_single_%d" % i for i in range(num_single_models)])
+        log_predictions = numpy.full(
+            (len(peptides), len(model_columns)), numpy.nan)
+
+        if self.prediction_cache is not None:
+            # Only the cache misses are run through the models.
+            cache_key = self._prediction_cache_key()
+            (cached, hit) = self.prediction_cache.get_many(
+                cache_key,
+                normalized_alleles[supported_indices],
+                peptides.sequences[supported_indices])
+            log_predictions[
+                supported_indices[hit], :cached.shape[1]
+            ] = cached[hit]
+            supported_indices = supported_indices[~hit]
+
+        # Encodings computed by the models are cached on supported_peptides
+        # and shared across all models and alleles.
+        if len(supported_indices) == len(peptides):
+            supported_peptides = peptides
+        else:
+            supported_peptides = EncodableSequences.create(
+                peptides.sequences[supported_indices])
+        (allele_codes, alleles_with_supported_peptides) = pandas.factorize(
+            normalized_alleles[supported_indices])
+
         if self.class1_pan_allele_models:
             unsupported_alleles = [
                 allele for allele in
-                df.normalized_allele.unique()
+                pandas.unique(normalized_alleles)
                 if allele not in self.allele_to_pseudosequence
             ]
             if unsupported_alleles:
@@ -562,21 +1459,25 @@ class Class1AffinityPredictor(object):
                 logging.warning(msg)
                 if throw:
                     raise ValueError(msg)
-            mask = df.supported_peptide_length
-            if mask.sum() > 0:
-                masked_allele_pseudosequences = (
-                    df.ix[mask].normalized_allele.map(
-                        self.allele_to_pseudosequence))
-                masked_peptides = peptides.sequences[mask]
-                for (i, model) in enumerate(self.class1_pan_allele_models):
-                    df.loc[mask, "model_pan_%d" % i] = model.predict(
-                        masked_peptides,
-                        allele_pseudosequences=masked_allele_pseudosequences)
+            pseudosequence_codes = self.pseudosequence_alleles.get_indexer(
+                normalized_alleles[supported_indices])
+            pan_indices = numpy.flatnonzero(pseudosequence_codes >= 0)
+            if len(pan_indices) > 0:
+                pan_peptides = supported_peptides.take(pan_indices)
+                pan_pseudosequences = self.pseudosequences.take(
+                    pseudosequence_codes[pan_indices])
+                log_predictions[
+                    supported_indices[pan_indices], :num_pan_models
+                ] = numpy.log(Class1NeuralNetwork.predict_ensemble(
+                    self.class1_pan_allele_models,
+                    pan_peptides,
+                    allele_pseudosequences=pan_pseudosequences,
+                    backend=self.backend,
+                    batch_size=self.batch_size))
 
         if self.allele_to_allele_specific_models:
-            query_alleles = df.normalized_allele.unique()
             unsupported_alleles = [
-                allele for allele in query_alleles
+                allele for allele in pandas.unique(normalized_alleles)
                 if not self.allele_to_allele_specific_models.get(allele)
             ]
             if unsupported_alleles:
@@ -588,39 +1489,267 @@ class Class1AffinityPredictor(object):
                 logging.warning(msg)
                 if throw:
                     raise ValueError(msg)
-            for allele in query_alleles:
-                models = self.allele_to_allele_specific_models.get(allele, [])
-                mask = (
-                    (df.normalized_allele == allele) &
-                    df.supported_peptide_length).values
-                if mask.sum() > 0:
-                    allele_peptides = EncodableSequences.create(
-                        df.ix[mask].peptide.values)
-                    for (i, model) in enumerate(models):
-                        df.loc[
-                            mask, "model_single_%d" % i
-                        ] = model.predict(allele_peptides)
-
-        # Geometric mean
-        df_predictions = df[
-            [c for c in df.columns if c.startswith("model_")]
-        ]
-        logs = numpy.log(df_predictions)
-        log_means = logs.mean(1)
-        df["prediction"] = numpy.exp(log_means)
-        df["prediction_low"] = numpy.exp(logs.quantile(0.05, axis=1))
-        df["prediction_high"] = numpy.exp(logs.quantile(0.95, axis=1))
-
-        del df["normalized_allele"]
-        del df["supported_peptide_length"]
+
+            self._use_alleles([
+                allele for allele in alleles_with_supported_peptides
+                if allele in self.allele_to_allele_specific_models
+            ])
+            single_log_predictions = log_predictions[:, num_pan_models:]
+            backend = Class1NeuralNetwork.resolve_backend(self.backend)
+            if backend != "keras":
+                # Rows for all alleles are evaluated together.
+                self._predict_cross_allele(
+                    single_log_predictions,
+                    supported_peptides,
+                    supported_indices,
+                    allele_codes,
+                    alleles_with_supported_peptides,
+                    precision=Class1NeuralNetwork.backend_precision(backend))
+            else:
+                # Group the supported rows by allele.
+                order = numpy.argsort(allele_codes, kind="mergesort")
+                boundaries = numpy.searchsorted(
+                    allele_codes[order],
+                    numpy.arange(len(alleles_with_supported_peptides) + 1))
+                for (code, allele) in enumerate(
+                        alleles_with_supported_peptides):
+                    models = self.allele_to_allele_specific_models.get(
+                        allele, [])
+                    allele_indices = order[
+                        boundaries[code]:boundaries[code + 1]
+                    ]
+                    if len(allele_indices) > 0 and models:
+                        single_log_predictions[
+                            supported_indices[allele_indices], :len(models)
+                        ] = numpy.log(Class1NeuralNetwork.predict_ensemble(
+                            models,
+                            supported_peptides.take(allele_indices),
+                            backend=self.backend,
+                            batch_size=self.batch_size))
+
+        if self.prediction_cache is not None and len(supported_indices) > 0:
+            self.prediction_cache.put_many(
+                cache_key,
+                normalized_alleles[supported_indices],
+                peptides.sequences[supported_indices],
+                log_predictions[supported_indices])
+
+        return (peptides, alleles, model_columns, log_predictions)
+
+    def _prediction_cache_key(self):
+        """
+        Private helper for `_predict_log_affinities` giving the key under
+        which predictions are cached: the fingerprint of the models and the
+        precision of the weights used to run them.
+
+        Returns
+        -------
+        string
+        """
+        precision = Class1NeuralNetwork.backend_precision(
+            Class1NeuralNetwork.resolve_backend(self.backend))
+        return "%s-%s" % (self.fingerprint(), precision or "float32")
+
+    def _predict_cross_allele(
+            self,
+            log_predictions,
+            peptides,
+            peptide_indices,
+            allele_codes,
+            alleles,
+            precision="float32"):
+        """
+        Private helper for `_predict_log_affinities` that fills in the
+        allele-specific model predictions for rows of any mix of alleles using
+        the stacked networks of `_cross_allele_networks`.
+
+        Parameters
+        ----------
+        log_predictions : numpy.array
+            Log nM predictions of each allele-specific model (column) for each
+            row, modified in place
+        peptides : EncodableSequences
+        peptide_indices : numpy.array of int
+            Row of log_predictions for each peptide
+        allele_codes : numpy.array of int
+            Index into alleles for each peptide
+        alleles : list of string
+        precision : string
+        """
+        for (network, encoder, allele_to_indices) in (
+                self._cross_allele_networks(precision, alleles)):
+            # The stacked networks may also include models for alleles that
+            # were not requested.
+            num_columns = 1 + max([-1] + [
+                i
+                for allele in alleles
+                for (i, _) in allele_to_indices.get(allele, [])
+            ])
+            if num_columns == 0:
+                continue
+            model_indices = numpy.full(
+                (len(alleles), num_columns), -1, dtype=int)
+            for (code, allele) in enumerate(alleles):
+                for (i, index) in allele_to_indices.get(allele, []):
+                    model_indices[code, i] = index
+            # Rows are processed in allele order, in batches of the batch
+            # size.
+            rows = numpy.flatnonzero(
+                (model_indices[allele_codes] >= 0).any(axis=1))
+            rows = rows[numpy.argsort(allele_codes[rows], kind="mergesort")]
+            batch_size = encoder.prediction_batch_size(
+                self.batch_size, num_models=num_columns)
+            # The distinct peptides are encoded once, if the encoding fits
+            # the memory budget, and the encoding is cached on them for the
+            # other groups and for later calls with the same peptides.
+            (unique_peptides, unique_inverse) = peptides.unique()
+            encoded_peptides = None
+            if encoder.encode_all_peptides(unique_peptides):
+                encoded_peptides = encoder.peptides_to_network_input(
+                    unique_peptides)
+            predictions = numpy.empty((len(rows), num_columns))
+            for start in range(0, len(rows), batch_size):
+                batch_rows = rows[start:start + batch_size]
+                (batch_unique, inverse) = numpy.unique(
+                    unique_inverse[batch_rows], return_inverse=True)
+                if encoded_peptides is not None:
+                    batch_encoded_peptides = encoded_peptides[batch_unique]
+                else:
+                    batch_encoded_peptides = encoder.peptides_to_network_input(
+                        unique_peptides.take(
+                            batch_unique, share_encodings=False))
+                predictions[start:start + len(batch_rows)] = (
+                    network.predict_by_group(
+                        {'peptide': batch_encoded_peptides},
+                        inverse,
+                        allele_codes[batch_rows],
+                        model_indices,
+                        batch_rows=batch_size).reshape(
+                        (len(batch_rows), num_columns)))
+            predictions = numpy.log(to_ic50(predictions))
+            mask = model_indices[allele_codes[rows]] >= 0
+            target = log_predictions[peptide_indices[rows], :num_columns]
+            target[mask] = predictions[mask]
+            log_predictions[peptide_indices[rows], :num_columns] = target
+
+    def predict_iter(
+            self,
+            peptides,
+            alleles=None,
+            allele=None,
+            chunk_size=100000,
+            throw=True,
+            include_individual_model_predictions=False):
+        """
+        Generator version of `predict_to_dataframe` that consumes its inputs
+        in chunks and yields a DataFrame of predictions for each chunk.
+
+        Only one chunk of peptides, its encodings, and its predictions are in
+        memory at a time, so inputs may be arbitrarily large iterables (e.g.
+        lines streamed from a file). Each chunk is predicted with
+        `predict_to_dataframe`, so its encodings are computed for that chunk
+        and released before the next one is read, rather than written into
+        buffers shared across chunks. Peak memory is therefore that of
+        predicting chunk_size peptides, independent of the input length.
+
+        One of 'allele' or 'alleles' must be specified. If 'alleles' is
+        specified it must be an iterable giving the allele for each peptide.
+        A ValueError is raised once either of peptides or alleles runs out
+        before the other.
+
+        Parameters
+        ----------
+        peptides : iterable of string
+        alleles : iterable of string
+        allele : string
+        chunk_size : int
+            Number of peptides per chunk
+        throw : boolean
+            See `predict_to_dataframe`
+        include_individual_model_predictions : boolean
+            See `predict_to_dataframe`
+
+        Returns
+        -------
+        generator of pandas.DataFrame
+            The index of each DataFrame gives the position of each row in the
+            input, so the chunks may be concatenated to get the same result
+            as `predict_to_dataframe`. Every chunk has the same columns: with
+            include_individual_model_predictions, a column is included for
+            each model that may be used for the requested alleles, and is
+            NaN where the model does not apply.
+        """
+        if isinstance(peptides, string_types):
+            raise TypeError("peptides must be an iterable, not a string")
+        if isinstance(alleles, string_types):
+            raise TypeError("alleles must be an iterable, not a string")
+        if (allele is None) == (alleles is None):
+            raise ValueError("Specify exactly one of allele or alleles")
+        if chunk_size < 1:
+            raise ValueError("chunk_size must be positive: %s" % chunk_size)
+
+        peptides = iter(peptides)
+        if alleles is not None:
+            alleles = iter(alleles)
+
+        columns = None
         if include_individual_model_predictions:
-            columns = sorted(df.columns, key=lambda c: c.startswith('model_'))
-        else:
+            # The models used depend on the alleles in each chunk, so the
+            # columns are fixed up front from all models that may be used.
+            if allele is not None:
+                (normalized_allele,) = normalize_allele_names(
+                    [allele], default=allele)
+                allele_models = [self.allele_to_allele_specific_models.get(
+                    normalized_allele, [])]
+            else:
+                allele_models = list(
+                    self.allele_to_allele_specific_models.values())
+            num_single_models = max(
+                [0] + [len(models) for models in allele_models])
             columns = [
-                c for c in df.columns if c not in df_predictions.columns
+                "peptide",
+                "allele",
+                "prediction",
+                "prediction_low",
+                "prediction_high",
             ]
-        return df[columns]
+            if self.allele_to_percent_rank_transform:
+                columns.append("prediction_percentile")
+            columns.extend(
+                "model_pan_%d" % i
+                for i in range(len(self.class1_pan_allele_models)))
+            columns.extend(
+                "model_single_%d" % i for i in range(num_single_models))
 
+        start = 0
+        while True:
+            chunk_peptides = list(itertools.islice(peptides, chunk_size))
+            if alleles is not None:
+                chunk_alleles = list(
+                    itertools.islice(alleles, len(chunk_peptides)))
+                if len(chunk_alleles) != len(chunk_peptides):
+                    raise ValueError(
+                        "alleles is shorter than peptides (%d)" % (
+                            start + len(chunk_alleles)))
+            if not chunk_peptides:
+                if alleles is not None:
+                    remaining = list(itertools.islice(alleles, 1))
+                    if remaining:
+                        raise ValueError(
+                            "alleles is longer than peptides (%d)" % start)
+                break
+            df = self.predict_to_dataframe(
+                peptides=chunk_peptides,
+                alleles=chunk_alleles if alleles is not None else None,
+                allele=allele,
+                throw=throw,
+                include_individual_model_predictions=(
+                    include_individual_model_predictions))
+            if columns is not None:
+                df = df.reindex(columns=columns)
+            df.index = pandas.RangeIndex(start, start + len(df))
+            start += len(df)
+            yield df
 
     @staticmethod
     def save_weights(weights_list, filename):
@@ -1,22 +1,19 @@
 import time
 import collections
+import hashlib
 import logging
+import threading
+from contextlib import contextmanager
+from os import environ
 
 import numpy
 import pandas
 
-import keras.models
-import keras.layers.pooling
-import keras.regularizers
-from keras.layers import Input
-import keras.layers.merge
-from keras.layers.core import Dense, Flatten, Dropout
-from keras.layers.embeddings import Embedding
-from keras.layers.normalization import BatchNormalization
-
 from mhcflurry.hyperparameters import HyperparameterDefaults
 
+from ..amino_acid import AMINO_ACID_INDEX
 from ..encodable_sequences import EncodableSequences
+from .numpy_network import NumpyNetwork
 from ..regression_target import to_ic50, from_ic50
 from ..common import random_peptides, amino_acid_distribution
 
@@ -101,29 +98,224 @@ class Class1NeuralNetwork(object):
             hyperparameters)
 
         self._network = None
+        self._numpy_networks = {}
         self.network_json = None
         self.network_weights = None
 
+        # Optional callable returning network_weights, used to load the
+        # weights on first use. See from_config.
+        self._weights_loader = None
+
+        # Optional string identifying where the weights were loaded from. See
+        # from_config and weights_fingerprint.
+        self._weights_source = None
+
+        # Number of pinned_weights blocks using the weights, and whether
+        # unload_weights was called during one. Guarded by WEIGHTS_LOCK.
+        self._pin_count = 0
+        self._unload_requested = False
+
         self.loss_history = None
         self.fit_seconds = None
         self.fit_num_points = None
 
-    # Process-wide keras model cache.
-    # architecture JSON string -> (Keras model, existing network weights)
-    KERAS_MODELS_CACHE = {}
+    # Process-wide pool of keras models, shared by all Class1NeuralNetwork
+    # instances. See checkout_network.
+    # architecture JSON string -> list of (idle Keras model, its weights),
+    # least recently used first
+    KERAS_MODELS_POOL = {}
+
+    # architecture JSON string -> number of Keras models created
+    KERAS_MODELS_POOL_COUNTS = {}
+
+    # Maximum number of Keras models created per architecture. This bounds
+    # the number of weights kept resident, as well as the number of
+    # concurrent users: when all are checked out, further checkouts wait for
+    # one to be checked in.
+    KERAS_MODELS_POOL_MAX_SIZE = 16
+
+    # Counts of checkouts where a model already held the requested weights
+    # ("hits"), or did not ("misses"), and of misses that replaced the
+    # weights of an existing model ("evictions").
+    KERAS_MODELS_POOL_STATS = collections.Counter()
+
+    KERAS_MODELS_POOL_CONDITION = threading.Condition()
+
+    # (graph, session) that pooled keras models are built and run in. With
+    # the TensorFlow backend the default graph and session are thread local,
+    # so models shared across threads must be used in the ones they were
+    # built in. See keras_session_scope.
+    KERAS_GRAPH_AND_SESSION = None
+
+    @classmethod
+    @contextmanager
+    def keras_session_scope(klass):
+        """
+        Context manager making the graph and session shared by pooled keras
+        models (see `checkout_network`) the defaults within the block, so the
+        models can be built, loaded, and run from any thread.
+
+        The graph and session are taken from the first thread to use a pooled
+        model. With keras backends other than TensorFlow this does nothing.
+        """
+        import keras.backend as K
+        if K.backend() != "tensorflow" or not hasattr(K, "get_session"):
+            yield
+            return
+        with klass.KERAS_MODELS_POOL_CONDITION:
+            if klass.KERAS_GRAPH_AND_SESSION is None:
+                session = K.get_session()
+                klass.KERAS_GRAPH_AND_SESSION = (session.graph, session)
+            (graph, session) = klass.KERAS_GRAPH_AND_SESSION
+        with graph.as_default(), session.as_default():
+            yield
+
+    # Guards loading, pinning, and unloading of weights (see pinned_weights)
+    # across all Class1NeuralNetwork instances.
+    WEIGHTS_LOCK = threading.Lock()
+
+    @classmethod
+    def checkout_network(klass, network_json, network_weights):
+        """
+        Take a keras Model with the specified architecture and weights from a
+        process-wide pool, creating one if needed.
+
+        The model is for the exclusive use of the caller until it is returned
+        with `checkin_network`, so concurrent callers (e.g. threads) each get
+        their own model.
+
+        Each model keeps the weights it was last used with. A model already
+        holding the requested weights (compared by identity) is used if
+        available. Otherwise a new model is created, or once the pool has
+        KERAS_MODELS_POOL_MAX_SIZE models for the architecture, the least
+        recently used idle model is loaded with the weights. See
+        KERAS_MODELS_POOL_STATS for counts of these cases.
+
+        Parameters
+        ----------
+        network_json : string of JSON
+        network_weights : list of numpy.array
+
+        Returns
+        -------
+        keras.models.Model
+        """
+        assert network_weights is not None
+        network = None
+        existing_weights = None
+        with klass.KERAS_MODELS_POOL_CONDITION:
+            while True:
+                idle = klass.KERAS_MODELS_POOL.setdefault(network_json, [])
+                index = next(
+                    (
+                        i for (i, (_, weights)) in enumerate(idle)
+                        if weights is network_weights
+                    ),
+                    None)
+                if index is not None:
+                    klass.KERAS_MODELS_POOL_STATS["hits"] += 1
+                    (network, existing_weights) = idle.pop(index)
+                    break
+                count = klass.KERAS_MODELS_POOL_COUNTS.get(network_json, 0)
+                if count < klass.KERAS_MODELS_POOL_MAX_SIZE:
+                    klass.KERAS_MODELS_POOL_STATS["misses"] += 1
+                    klass.KERAS_MODELS_POOL_COUNTS[network_json] = count + 1
+                    break
+                if idle:
+                    klass.KERAS_MODELS_POOL_STATS["misses"] += 1
+                    klass.KERAS_MODELS_POOL_STATS["evictions"] += 1
+                    (network, existing_weights) = idle.pop(0)
+                    break
+                klass.KERAS_MODELS_POOL_CONDITION.wait()
+
+        with klass.keras_session_scope():
+            if network is None:
+                try:
+                    import keras.models
+                    network = keras.models.model_from_json(network_json)
+
+                    # Build the predict function now, as building it lazily
+                    # is not thread safe.
+                    network._make_predict_function()
+                except:
+                    with klass.KERAS_MODELS_POOL_CONDITION:
+                        klass.KERAS_MODELS_POOL_COUNTS[network_json] -= 1
+                        klass.KERAS_MODELS_POOL_CONDITION.notify()
+                    raise
+            if existing_weights is not network_weights:
+                network.set_weights(network_weights)
+        return network
+
+    @classmethod
+    def checkin_network(klass, network_json, network, network_weights):
+        """
+        Return a keras Model taken with `checkout_network` to the pool.
+
+        Parameters
+        ----------
+        network_json : string of JSON
+        network : keras.models.Model
+        network_weights : list of numpy.array
+            The weights the model holds
+        """
+        with klass.KERAS_MODELS_POOL_CONDITION:
+            klass.KERAS_MODELS_POOL[network_json].append(
+                (network, network_weights))
+            klass.KERAS_MODELS_POOL_CONDITION.notify()
+
+    @classmethod
+    def discard_pooled_networks(klass, network_json, network_weights):
+        """
+        Remove the idle keras models holding the given weights from the
+        process-wide pool (see `checkout_network`), so that the weights can
+        be freed.
+
+        Parameters
+        ----------
+        network_json : string of JSON
+        network_weights : list of numpy.array
+        """
+        with klass.KERAS_MODELS_POOL_CONDITION:
+            idle = klass.KERAS_MODELS_POOL.get(network_json, [])
+            kept = [
+                (network, weights) for (network, weights) in idle
+                if weights is not network_weights
+            ]
+            if len(kept) < len(idle):
+                klass.KERAS_MODELS_POOL[network_json] = kept
+                klass.KERAS_MODELS_POOL_COUNTS[network_json] -= (
+                    len(idle) - len(kept))
+                klass.KERAS_MODELS_POOL_CONDITION.notify_all()
+
+    @classmethod
+    def keras_models_pool_stats(klass):
+        """
+        Statistics on the process-wide pool of keras models, for sizing it
+        with KERAS_MODELS_POOL_MAX_SIZE. See `checkout_network`.
+
+        Returns
+        -------
+        dict of string -> int
+            Keys are "hits", "misses", "evictions", and "models" (the number
+            of keras models created)
+        """
+        with klass.KERAS_MODELS_POOL_CONDITION:
+            result = dict(
+                (key, klass.KERAS_MODELS_POOL_STATS[key])
+                for key in ["hits", "misses", "evictions"])
+            result["models"] = sum(klass.KERAS_MODELS_POOL_COUNTS.values())
+        return result
 
     @classmethod
     def borrow_cached_network(klass, network_json, network_weights):
         """
         Return a keras Model with the specified architecture and weights.
         As an optimization, when possible this will reuse architectures from a
-        process-wide cache.
+        process-wide pool.
 
         The returned object is "borrowed" in the sense that its weights can
         change later after subsequent calls to this method from other objects.
-
-        If you're using this from a parallel implementation you'll need to
-        hold a lock while using the returned object.
+        It is not safe to use from multiple threads; see `borrowed_network`.
 
         Parameters
         ----------
@@ -134,19 +326,40 @@ class Class1NeuralNetwork(object):
         -------
         keras.models.Model
         """
-        assert network_weights is not None
-        if network_json not in klass.KERAS_MODELS_CACHE:
-            # Cache miss.
-            network = keras.models.model_from_json(network_json)
-            existing_weights = None
-        else:
-            # Cache hit.
-            (network, existing_weights) = klass.KERAS_MODELS_CACHE[network_json]
-        if existing_weights is not network_weights:
-            network.set_weights(network_weights)
-            klass.KERAS_MODELS_CACHE[network_json] = (network, network_weights)
+        network = klass.checkout_network(network_json, network_weights)
+        klass.checkin_network(network_json, network, network_weights)
         return network
 
+    @contextmanager
+    def borrowed_network(self):
+        """
+        Context manager giving the keras model for this predictor, for the
+        exclusive use of the caller within the block. Safe to use from
+        multiple threads.
+
+        Models are taken from the process-wide pool (see `checkout_network`)
+        unless this predictor has its own model (e.g. after `fit`). Pooled
+        models are yielded within `keras_session_scope`, so they can be run
+        directly.
+
+        Returns
+        -------
+        keras.models.Model
+        """
+        if self._network is not None:
+            self._network._make_predict_function()
+            yield self._network
+            return
+        with self.pinned_weights():
+            network_json = self.network_json
+            network_weights = self.network_weights
+            network = self.checkout_network(network_json, network_weights)
+            try:
+                with self.keras_session_scope():
+                    yield network
+            finally:
+                self.checkin_network(network_json, network, network_weights)
+
     def network(self, borrow=False):
         """
         Return the keras model associated with this predictor.
@@ -162,18 +375,122 @@ class Class1NeuralNetwork(object):
         keras.models.Model
         """
         if self._network is None and self.network_json is not None:
-            if borrow:
-                return self.borrow_cached_network(
-                    self.network_json,
-                    self.network_weights)
-            else:
-                self._network = keras.models.model_from_json(self.network_json)
+            with self.pinned_weights():
+                if borrow:
+                    return self.borrow_cached_network(
+                        self.network_json,
+                        self.network_weights)
+                import keras.models
+                self._network = keras.models.model_from_json(
+                    self.network_json)
                 if self.network_weights is not None:
                     self._network.set_weights(self.network_weights)
                 self.network_json = None
                 self.network_weights = None
         return self._network
 
+    def numpy_network(self, precision="float32"):
+        """
+        Return a NumpyNetwork that evaluates this predictor's network without
+        keras. It is created on first use and cached.
+
+        Parameters
+        ----------
+        precision : string
+            Precision of the stored weights. See `NumpyNetwork.with_precision`.
+
+        Returns
+        -------
+        NumpyNetwork
+        """
+        numpy_networks = self._numpy_networks
+        if precision not in numpy_networks:
+            with self.pinned_weights():
+                self.update_network_description()
+                numpy_networks[precision] = NumpyNetwork(
+                    self.network_json,
+                    self.network_weights).with_precision(precision)
+        return numpy_networks[precision]
+
+    def stacking_key(self):
+        """
+        Key identifying the network architecture and input encoding. Models
+        with equal keys can be evaluated together (see `NumpyNetwork.stack`).
+
+        Returns
+        -------
+        tuple
+        """
+        self.update_network_description()
+        return (
+            self.network_json,
+            tuple(sorted(
+                self.input_encoding_hyperparameter_defaults.subselect(
+                    self.hyperparameters).items())))
+
+    @property
+    def weights_loaded(self):
+        """
+        Whether the network weights are in memory (see `from_config`).
+        """
+        return self._network is not None or self.network_weights is not None
+
+    def materialize_weights(self):
+        """
+        Load the network weights with the weights loader given to
+        `from_config`, if they are not already in memory.
+
+        The weights may be released by another thread at any time unless they
+        are pinned: see `pinned_weights`.
+        """
+        if not self.weights_loaded and self._weights_loader is not None:
+            weights = self._weights_loader()
+            with self.WEIGHTS_LOCK:
+                if not self.weights_loaded:
+                    self.network_weights = weights
+
+    @contextmanager
+    def pinned_weights(self):
+        """
+        Context manager that loads the network weights if needed (see
+        `materialize_weights`) and keeps them in memory until the end of the
+        block: `unload_weights` calls made meanwhile, e.g. by other threads,
+        take effect when the last such block using this model ends.
+        """
+        with self.WEIGHTS_LOCK:
+            self._pin_count += 1
+        try:
+            self.materialize_weights()
+            yield
+        finally:
+            with self.WEIGHTS_LOCK:
+                self._pin_count -= 1
+                unload = self._pin_count == 0 and self._unload_requested
+            if unload:
+                self.unload_weights()
+
+    def unload_weights(self):
+        """
+        Release the network weights and anything derived from them, if they
+        can be reloaded later with the weights loader given to `from_config`.
+
+        Pinned weights (see `pinned_weights`) are released when unpinned.
+        Idle keras models holding the weights are removed from the
+        process-wide pool.
+        """
+        with self.WEIGHTS_LOCK:
+            if self._network is not None or self._weights_loader is None:
+                return
+            if self._pin_count > 0:
+                self._unload_requested = True
+                return
+            self._unload_requested = False
+            network_weights = self.network_weights
+            self.network_weights = None
+            self._numpy_networks = {}
+        if network_weights is not None:
+            self.discard_pooled_networks(self.network_json, network_weights)
+
     def update_network_description(self):
         if self._network is not None:
             self.network_json = self._network.to_json()
@@ -191,10 +508,17 @@ class Class1NeuralNetwork(object):
         result = dict(self.__dict__)
         result['_network'] = None
         result['network_weights'] = None
+        del result['_numpy_networks']
+        del result['_weights_loader']
+        del result['_weights_source']
+        del result['_pin_count']
+        del result['_unload_requested']
         return result
 
     @classmethod
-    def from_config(cls, config, weights=None):
+    def from_config(
+            cls, config, weights=None, weights_loader=None,
+            weights_source=None):
         """
         deserialize from a dict returned by get_config().
         
@@ -203,6 +527,15 @@ class Class1NeuralNetwork(object):
         config : dict
         weights : list of array, optional
             Network weights to restore
+        weights_loader : callable, optional
+            Function of no arguments returning the network weights. If
+            specified instead of weights, the weights are loaded when first
+            needed and may be released with `unload_weights`.
+        weights_source : string or callable, optional
+            Identifies the stored weights, e.g. by a digest of the file they
+            are stored in. May be a function of no arguments returning the
+            string, which is called when first needed. If specified, used by
+            `weights_fingerprint` instead of hashing the weights.
 
         Returns
         -------
@@ -213,8 +546,30 @@ class Class1NeuralNetwork(object):
         assert all(hasattr(instance, key) for key in config), config.keys()
         instance.__dict__.update(config)
         instance.network_weights = weights
+        instance._weights_loader = weights_loader
+        instance._weights_source = weights_source
         return instance
 
+    def weights_fingerprint(self):
+        """
+        String identifying the network weights: the weights source given to
+        `from_config` if any, otherwise a hash of the weights.
+
+        Returns
+        -------
+        string
+        """
+        if callable(self._weights_source):
+            self._weights_source = self._weights_source()
+        if self._weights_source is not None:
+            return self._weights_source
+        digest = hashlib.sha1()
+        for array in self.get_weights() or []:
+            array = numpy.ascontiguousarray(array)
+            digest.update(("%s %s" % (array.dtype.str, array.shape)).encode())
+            digest.update(array.tobytes())
+        return digest.hexdigest()
+
     def get_weights(self):
         """
         Get the network weights
@@ -224,8 +579,9 @@ class Class1NeuralNetwork(object):
         list of numpy.array giving weights for each layer
         or None if there is no network
         """
-        self.update_network_description()
-        return self.network_weights
+        with self.pinned_weights():
+            self.update_network_description()
+            return self.network_weights
 
     def __getstate__(self):
         """
@@ -236,10 +592,13 @@ class Class1NeuralNetwork(object):
         dict
 
         """
-        self.update_network_description()
-        self.update_network_description()
-        result = dict(self.__dict__)
+        with self.pinned_weights():
+            self.update_network_description()
+            result = dict(self.__dict__)
         result['_network'] = None
+        result['_numpy_networks'] = {}
+        result['_pin_count'] = 0
+        result['_unload_requested'] = False
         return result
 
     def peptides_to_network_input(self, peptides):
@@ -262,13 +621,70 @@ class Class1NeuralNetwork(object):
                 **self.input_encoding_hyperparameter_defaults.subselect(
                     self.hyperparameters))
         else:
+            # float32 matches the network's input layer, so the encoding is
+            # passed to the network without a cast copy.
             encoded = encoder.variable_length_to_fixed_length_one_hot(
                 max_length=self.hyperparameters['kmer_size'],
+                dtype="float32",
                 **self.input_encoding_hyperparameter_defaults.subselect(
                     self.hyperparameters))
         assert len(encoded) == len(peptides)
         return encoded
 
+    def peptide_encoding_cache_key(self):
+        """
+        Key in `EncodableSequences.encoding_cache` of the encoding given by
+        `peptides_to_network_input`.
+
+        Returns
+        -------
+        tuple
+        """
+        return EncodableSequences.variable_length_to_fixed_length_cache_key(
+            max_length=self.hyperparameters['kmer_size'],
+            dtype=None if self.hyperparameters['use_embedding'] else "float32",
+            **self.input_encoding_hyperparameter_defaults.subselect(
+                self.hyperparameters))
+
+    def peptide_encoding_bytes_per_row(self):
+        """
+        Memory used per peptide by the encodings that
+        `peptides_to_network_input` computes and caches.
+
+        Returns
+        -------
+        int
+        """
+        length = self.hyperparameters['kmer_size']
+        if self.hyperparameters['use_embedding']:
+            return 4 * length
+        # The categorical encoding is cached along with the one-hot encoding.
+        return 4 * length * (len(AMINO_ACID_INDEX) + 1)
+
+    def encode_all_peptides(self, peptides):
+        """
+        Whether `network_input_batches` should encode all the given peptides
+        at once (and cache the encoding on them) rather than batch by batch:
+        true if the encoding is already available, or if it fits within
+        PREDICTION_MEMORY_BUDGET_BYTES.
+
+        Parameters
+        ----------
+        peptides : EncodableSequences
+
+        Returns
+        -------
+        boolean
+        """
+        if peptides.has_encoding(self.peptide_encoding_cache_key()):
+            return True
+        # Encoding an instance created with `take` encodes the instance it was
+        # taken from.
+        num_encoded = len(
+            peptides.parent if peptides.parent is not None else peptides)
+        return (
+            num_encoded * self.peptide_encoding_bytes_per_row() <=
+            self.PREDICTION_MEMORY_BUDGET_BYTES)
 
     @property
     def supported_peptide_lengths(self):
@@ -302,7 +718,7 @@ class Class1NeuralNetwork(object):
         if self.hyperparameters['pseudosequence_use_embedding']:
             encoded = encoder.fixed_length_categorical()
         else:
-            encoded = encoder.fixed_length_one_hot()
+            encoded = encoder.fixed_length_one_hot(dtype="float32")
         assert len(encoded) == len(pseudosequences)
         return encoded
 
@@ -336,6 +752,7 @@ class Class1NeuralNetwork(object):
         """
 
         self.fit_num_points = len(peptides)
+        self._numpy_networks = {}
 
         encodable_peptides = EncodableSequences.create(peptides)
         peptide_encoding = self.peptides_to_network_input(encodable_peptides)
@@ -385,6 +802,9 @@ class Class1NeuralNetwork(object):
                     self.hyperparameters))
             self.compile()
 
+        # Fitting changes the weights, so they no longer match their source.
+        self._weights_source = None
+
         y_dict_with_random_negatives = {
             "output": numpy.concatenate([
                 from_ic50(
@@ -470,7 +890,207 @@ class Class1NeuralNetwork(object):
                         break
         self.fit_seconds = time.time() - start
 
-    def predict(self, peptides, allele_pseudosequences=None):
+    def distinct_inputs(self, peptides, allele_pseudosequences=None):
+        """
+        Find the distinct inputs among the given peptides (and
+        pseudosequences, for pan-allele models).
+
+        Parameters
+        ----------
+        peptides : EncodableSequences or list of string
+
+        allele_pseudosequences : EncodableSequences or list of string, optional
+            Only required when this model is a pan-allele model
+
+        Returns
+        -------
+        (EncodableSequences, EncodableSequences or None, numpy.array of int)
+            The distinct peptides and their pseudosequences (None if no
+            pseudosequences were given), and for each input peptide the index
+            of its distinct input.
+        """
+        peptides = EncodableSequences.create(peptides)
+        (unique_peptides, inverse) = peptides.unique()
+        unique_pseudosequences = None
+        if allele_pseudosequences is not None:
+            allele_pseudosequences = EncodableSequences.create(
+                allele_pseudosequences)
+            (distinct_pseudosequences, pseudosequence_inverse) = (
+                allele_pseudosequences.unique())
+            (_, first_indices, pair_inverse) = numpy.unique(
+                inverse * len(allele_pseudosequences) + pseudosequence_inverse,
+                return_index=True,
+                return_inverse=True)
+            # Taken from the distinct peptides and pseudosequences, so that
+            # only those are encoded.
+            unique_peptides = unique_peptides.take(inverse[first_indices])
+            unique_pseudosequences = distinct_pseudosequences.take(
+                pseudosequence_inverse[first_indices])
+            inverse = pair_inverse
+        return (unique_peptides, unique_pseudosequences, inverse)
+
+    def network_input_batches(
+            self, peptides, allele_pseudosequences=None, batch_size=None):
+        """
+        Encode inputs for the network in batches.
+
+        The peptides are encoded at once, and the encoding is cached on
+        `peptides` for other models and alleles to use, if the encoding is
+        already cached or fits the memory budget (see `encode_all_peptides`).
+        Each batch is then a slice of this encoding. Otherwise each batch is
+        encoded separately, so only one batch of encoded inputs is in memory
+        at a time.
+
+        Parameters
+        ----------
+        peptides : EncodableSequences
+
+        allele_pseudosequences : EncodableSequences, optional
+            Only required when this model is a pan-allele model
+
+        batch_size : int, optional
+            Maximum number of inputs per batch. If not specified, all inputs
+            are encoded at once.
+
+        Returns
+        -------
+        generator of (int, dict of string -> numpy.array) tuples
+            Index of the first input in each batch, and the network inputs
+        """
+        if batch_size is None or len(peptides) <= batch_size:
+            batch_size = max(len(peptides), 1)
+        encoded_peptides = None
+        if len(peptides) <= batch_size or self.encode_all_peptides(peptides):
+            encoded_peptides = self.peptides_to_network_input(peptides)
+        for start in range(0, len(peptides), batch_size):
+            end = min(start + batch_size, len(peptides))
+            if encoded_peptides is not None:
+                batch_encoded_peptides = encoded_peptides[start:end]
+            else:
+                batch_encoded_peptides = self.peptides_to_network_input(
+                    peptides.take(
+                        numpy.arange(start, end), share_encodings=False))
+            x_dict = {
+                'peptide': batch_encoded_peptides,
+            }
+            if allele_pseudosequences is not None:
+                batch_pseudosequences = allele_pseudosequences
+                if end - start < len(peptides):
+                    batch_pseudosequences = allele_pseudosequences.take(
+                        numpy.arange(start, end))
+                x_dict['pseudosequence'] = self.pseudosequence_to_network_input(
+                    batch_pseudosequences)
+            yield (start, x_dict)
+
+    def prediction_bytes_per_row(self):
+        """
+        Estimate of the memory used per input while running the network,
+        covering the encoded input and the intermediate layer values.
+
+        Returns
+        -------
+        int
+        """
+        hyperparameters = self.hyperparameters
+        length = hyperparameters['kmer_size']
+        width = (
+            hyperparameters['embedding_output_dim']
+            if hyperparameters['use_embedding'] else 21)
+        num_values = length * 21 + length * width
+        for params in hyperparameters['locally_connected_layers']:
+            kernel_size = params['kernel_size']
+            output_length = length - kernel_size + 1
+            # Patches and outputs
+            num_values += output_length * (
+                kernel_size * width + params['filters'])
+            (length, width) = (output_length, params['filters'])
+        num_values += sum(hyperparameters['layer_sizes']) + 1
+        return 4 * num_values
+
+    # Memory budget used for automatic prediction batch sizes. See
+    # prediction_batch_size.
+    PREDICTION_MEMORY_BUDGET_BYTES = 2**28
+
+    def prediction_batch_size(self, batch_size="auto", num_models=1):
+        """
+        Number of inputs to encode and run through the network at once.
+
+        Parameters
+        ----------
+        batch_size : int or "auto"
+            If "auto", the batch size is chosen so that the memory estimated
+            by `prediction_bytes_per_row` stays within
+            PREDICTION_MEMORY_BUDGET_BYTES.
+
+        num_models : int
+            Number of models evaluated together on each batch
+
+        Returns
+        -------
+        int
+        """
+        if batch_size == "auto":
+            return max(1, int(
+                self.PREDICTION_MEMORY_BUDGET_BYTES // (
+                    self.prediction_bytes_per_row() * num_models)))
+        if int(batch_size) != batch_size or batch_size < 1:
+            raise ValueError(
+                "batch_size must be a positive integer or 'auto': %s" % (
+                    batch_size,))
+        return int(batch_size)
+
+    # Supported prediction backends. The "numpy-" backends evaluate networks
+    # with weights stored at reduced precision (see
+    # NumpyNetwork.with_precision).
+    BACKENDS = ("keras", "numpy", "numpy-float16", "numpy-int8")
+
+    @classmethod
+    def resolve_backend(klass, backend=None):
+        """
+        Return the name of the backend to use for prediction.
+
+        Parameters
+        ----------
+        backend : string, optional
+            One of BACKENDS. Defaults to the value of the MHCFLURRY_BACKEND
+            environment variable, or "keras" if it is not set.
+
+        Returns
+        -------
+        string
+        """
+        if backend is None:
+            backend = environ.get("MHCFLURRY_BACKEND", "keras")
+        if backend not in klass.BACKENDS:
+            raise ValueError("Unsupported backend: %s" % backend)
+        return backend
+
+    @staticmethod
+    def backend_precision(backend):
+        """
+        Weights precision used by a numpy backend, or None for keras.
+
+        Parameters
+        ----------
+        backend : string
+            One of BACKENDS
+
+        Returns
+        -------
+        string or None
+        """
+        if backend == "keras":
+            return None
+        if backend == "numpy":
+            return "float32"
+        return backend.split("-", 1)[1]
+
+    def predict(
+            self,
+            peptides,
+            allele_pseudosequences=None,
+            backend=None,
+            batch_size="auto"):
         """
         Predict affinities
         
@@ -481,19 +1101,115 @@ class Class1NeuralNetwork(object):
         allele_pseudosequences : EncodableSequences or list of string, optional
             Only required when this model is a pan-allele model
 
+        backend : string, optional
+            "keras" to run the network with keras, or "numpy" to run it with
+            numpy only (see `numpy_network`). The "numpy-float16" and
+            "numpy-int8" backends store weights at reduced precision. Defaults
+            to the value of the MHCFLURRY_BACKEND environment variable, or
+            "keras" if it is not set.
+
+        batch_size : int or "auto"
+            Number of inputs to encode and run through the network at once.
+            See `prediction_batch_size`.
+
         Returns
         -------
         numpy.array of nM affinity predictions 
         """
-        x_dict = {
-            'peptide': self.peptides_to_network_input(peptides)
-        }
-        if allele_pseudosequences is not None:
-            pseudosequences_input = self.pseudosequence_to_network_input(
-                allele_pseudosequences)
-            x_dict['pseudosequence'] = pseudosequences_input
-        (predictions,) = numpy.array(self.network(borrow=True).predict(x_dict)).T
-        return to_ic50(predictions)
+        # The network is run only on distinct inputs, and the predictions are
+        # then scattered back to the original order.
+        backend = self.resolve_backend(backend)
+        (unique_peptides, unique_pseudosequences, inverse) = (
+            self.distinct_inputs(peptides, allele_pseudosequences))
+        batch_size = self.prediction_batch_size(batch_size)
+        predictions = numpy.empty(len(unique_peptides), dtype="float32")
+        for (start, x_dict) in self.network_input_batches(
+                unique_peptides, unique_pseudosequences, batch_size):
+            if backend != "keras":
+                batch_predictions = self.numpy_network(
+                    self.backend_precision(backend)).predict(x_dict)
+            else:
+                with self.borrowed_network() as network:
+                    batch_predictions = network.predict(
+                        x_dict, batch_size=batch_size)
+            predictions[start:start + len(batch_predictions)] = (
+                numpy.asarray(batch_predictions).reshape(-1))
+        return to_ic50(predictions)[inverse]
+
+    @classmethod
+    def predict_ensemble(
+            klass,
+            models,
+            peptides,
+            allele_pseudosequences=None,
+            backend=None,
+            batch_size="auto"):
+        """
+        Predict affinities with each of several models.
+
+        With the numpy backend, models with the same architecture and input
+        encoding are evaluated together: their weights are stacked (see
+        `NumpyNetwork.stack`) and applied in one pass over a single encoding
+        of the inputs.
+
+        Parameters
+        ----------
+        models : list of Class1NeuralNetwork
+
+        peptides : EncodableSequences or list of string
+
+        allele_pseudosequences : EncodableSequences or list of string, optional
+            Only required for pan-allele models
+
+        backend : string, optional
+            See `predict`
+
+        batch_size : int or "auto"
+            See `predict`. For stacked models an automatic batch size accounts
+            for the number of models evaluated together.
+
+        Returns
+        -------
+        numpy.array of shape (num peptides, num models) giving nM affinity
+        predictions
+        """
+        backend = klass.resolve_backend(backend)
+        peptides = EncodableSequences.create(peptides)
+        result = numpy.empty((len(peptides), len(models)))
+        if backend == "keras":
+            for (i, model) in enumerate(models):
+                result[:, i] = model.predict(
+                    peptides,
+                    allele_pseudosequences=allele_pseudosequences,
+                    backend=backend,
+                    batch_size=batch_size)
+            return result
+
+        groups = collections.OrderedDict()
+        for (i, model) in enumerate(models):
+            groups.setdefault(model.stacking_key(), []).append(i)
+        for indices in groups.values():
+            encoder = models[indices[0]]
+            (unique_peptides, unique_pseudosequences, inverse) = (
+                encoder.distinct_inputs(peptides, allele_pseudosequences))
+            network = NumpyNetwork.stack(
+                [
+                    models[i].numpy_network(klass.backend_precision(backend))
+                    for i in indices
+                ])
+            predictions = numpy.empty(
+                (len(unique_peptides), len(indices)), dtype="float32")
+            for (start, x_dict) in encoder.network_input_batches(
+                    unique_peptides,
+                    unique_pseudosequences,
+                    encoder.prediction_batch_size(
+                        batch_size, num_models=len(indices))):
+                batch_predictions = network.predict(x_dict).reshape(
+                    (len(indices), -1)).T
+                predictions[start:start + len(batch_predictions)] = (
+                    batch_predictions)
+            result[:, indices] = to_ic50(predictions)[inverse]
+        return result
 
     def compile(self):
         """
@@ -524,6 +1240,18 @@ class Class1NeuralNetwork(object):
         """
         Helper function to make a keras network for class1 affinity prediction.
         """
+
+        # Keras is imported here rather than at module level, so that
+        # importing mhcflurry (e.g. to predict with the numpy backend) does
+        # not import keras and tensorflow.
+        import keras.models
+        import keras.layers
+        import keras.regularizers
+        from keras.layers import Input
+        from keras.layers.core import Dense, Flatten, Dropout
+        from keras.layers.embeddings import Embedding
+        from keras.layers.normalization import BatchNormalization
+
         if use_embedding:
             peptide_input = Input(
                 shape=(kmer_size,), dtype='int32', name='peptide')
@@ -0,0 +1,64 @@
+"""
+Convert the weights of a Class1 models directory between the per-network
+".npz" files and a single weights archive, which loads faster.
+
+Example:
+
+    mhcflurry-class1-convert-weights --models DIR --format archive
+"""
+from __future__ import (
+    print_function,
+    division,
+    absolute_import,
+)
+import os
+import sys
+import argparse
+
+from .class1_affinity_predictor import Class1AffinityPredictor
+from ..common import configure_logging
+from ..downloads import get_path
+
+
+parser = argparse.ArgumentParser(usage=__doc__)
+
+parser.add_argument(
+    "--models",
+    metavar="DIR",
+    default=None,
+    help="Directory containing models. Default: the downloaded models")
+parser.add_argument(
+    "--out-models-dir",
+    metavar="DIR",
+    default=None,
+    help="Directory to write the converted models. Default: same as --models")
+parser.add_argument(
+    "--format",
+    default="archive",
+    choices=Class1AffinityPredictor.WEIGHTS_FORMATS,
+    help="Weights format to write. Default: %(default)s")
+parser.add_argument(
+    "--verbosity",
+    type=int,
+    help="Default: %(default)s",
+    default=0)
+
+
+def run(argv=sys.argv[1:]):
+    args = parser.parse_args(argv)
+
+    configure_logging(verbose=args.verbosity > 0)
+
+    models_dir = args.models
+    if models_dir is None:
+        models_dir = get_path("models_class1", "models")
+    out_models_dir = args.out_models_dir
+    if out_models_dir is None:
+        out_models_dir = models_dir
+    if not os.path.exists(out_models_dir):
+        os.makedirs(out_models_dir)
+
+    predictor = Class1AffinityPredictor.load(models_dir, lazy=True)
+    predictor.save(out_models_dir, weights_format=args.format)
+    print("Wrote %d models to %s in format: %s" % (
+        len(predictor.manifest_df), out_models_dir, args.format))
@@ -0,0 +1,557 @@
+"""
+Forward pass of Class1NeuralNetwork models using numpy only.
+
+This supports the subset of keras layers used by
+`Class1NeuralNetwork.make_network` and needs neither keras nor tensorflow,
+only the network's JSON description and its weights.
+"""
+from __future__ import (
+    print_function,
+    division,
+    absolute_import,
+)
+
+import json
+
+import numpy
+
+
+def sigmoid(x):
+    # Equal to 1 / (1 + exp(-x)), without overflow for large negative x.
+    return numpy.exp(-numpy.logaddexp(0, -x))
+
+
+ACTIVATIONS = {
+    "linear": lambda x: x,
+    "tanh": numpy.tanh,
+    "relu": lambda x: numpy.maximum(x, 0),
+    "sigmoid": sigmoid,
+}
+
+
+# Layer implementations. Weights and values carry `model_ndim` leading model
+# axes: weights have shape (model axes..., weight shape) and layer outputs
+# (model axes..., batch, output shape). Model axes of length 1 (e.g. for
+# network inputs, which are shared by all models) broadcast against the
+# weights.
+
+
+def input_layer(config, weights, inputs, model_ndim):
+    raise AssertionError("Input layers are not evaluated")
+
+
+def embedding_layer(config, weights, inputs, model_ndim):
+    (x,) = inputs
+    (embeddings,) = weights
+    model_shape = numpy.broadcast(
+        numpy.empty(embeddings.shape[:model_ndim]),
+        numpy.empty(x.shape[:model_ndim])).shape
+    # Flatten the model axes so each model's embeddings are gathered with one
+    # fancy indexing operation.
+    indices = numpy.broadcast_to(
+        x.reshape(x.shape[:model_ndim] + (-1,)),
+        model_shape + (int(numpy.prod(x.shape[model_ndim:])),)).reshape(
+        (-1, int(numpy.prod(x.shape[model_ndim:])))).astype(numpy.intp)
+    embeddings = numpy.broadcast_to(
+        embeddings, model_shape + embeddings.shape[-2:]).reshape(
+        (-1,) + embeddings.shape[-2:])
+    result = embeddings[
+        numpy.arange(len(embeddings))[:, numpy.newaxis], indices
+    ]
+    return result.reshape(model_shape + x.shape[model_ndim:] + (
+        embeddings.shape[-1],))
+
+
+def locally_connected_1d_layer(config, weights, inputs, model_ndim):
+    (x,) = inputs
+    (kernel_size,) = config['kernel_size']
+    (stride,) = config['strides']
+    if config.get('padding', 'valid') != 'valid':
+        raise NotImplementedError(
+            "Unsupported padding: %s" % config['padding'])
+    kernel = weights[0]
+    output_length = kernel.shape[-3]
+
+    # Patches are flattened position-major, matching the layout of the
+    # keras kernel: (output_length, kernel_size * input_dim, filters).
+    positions = (
+        numpy.arange(output_length).reshape((-1, 1)) * stride +
+        numpy.arange(kernel_size))
+    patches = x[..., positions, :]
+    patches = patches.reshape(patches.shape[:-2] + (-1,))
+    result = numpy.matmul(
+        patches.swapaxes(-3, -2), kernel).swapaxes(-3, -2)
+    if config.get('use_bias', True):
+        result += numpy.expand_dims(weights[1], -3)
+    return ACTIVATIONS[config['activation']](result)
+
+
+def flatten_layer(config, weights, inputs, model_ndim):
+    (x,) = inputs
+    return x.reshape(x.shape[:model_ndim + 1] + (-1,))
+
+
+def dense_layer(config, weights, inputs, model_ndim):
+    (x,) = inputs
+    result = numpy.matmul(x, weights[0])
+    if config.get('use_bias', True):
+        result += numpy.expand_dims(weights[1], -2)
+    return ACTIVATIONS[config['activation']](result)
+
+
+def dropout_layer(config, weights, inputs, model_ndim):
+    (x,) = inputs
+    return x
+
+
+def batch_normalization_layer(config, weights, inputs, model_ndim):
+    (x,) = inputs
+    weights = [
+        w.reshape(w.shape[:-1] + (1,) * (x.ndim - model_ndim - 1) + (-1,))
+        for w in weights
+    ]
+    gamma = weights.pop(0) if config.get('scale', True) else 1.0
+    beta = weights.pop(0) if config.get('center', True) else 0.0
+    (moving_mean, moving_variance) = weights
+    return (
+        (x - moving_mean) / numpy.sqrt(moving_variance + config['epsilon']) *
+        gamma + beta)
+
+
+def concatenate_layer(config, weights, inputs, model_ndim):
+    model_shape = numpy.broadcast(
+        *[numpy.empty(x.shape[:model_ndim] + (0,)) for x in inputs]).shape[:-1]
+    inputs = [
+        numpy.broadcast_to(x, model_shape + x.shape[model_ndim:])
+        for x in inputs
+    ]
+    axis = config.get('axis', -1)
+    return numpy.concatenate(
+        inputs, axis=axis if axis < 0 else axis + model_ndim)
+
+
+class Int8Weights(object):
+    """
+    Weights stored as int8 values with a float32 scale per output channel.
+
+    Supports the operations NumpyNetwork applies to stored weights: indexing
+    along the leading models axis and concatenation (see `concatenate`).
+
+    Parameters
+    ----------
+    values : numpy.array of int8
+    scales : numpy.array of float32
+        Broadcastable against values; multiplying gives the weights
+    """
+    def __init__(self, values, scales):
+        self.values = values
+        self.scales = scales
+
+    @classmethod
+    def quantize(klass, array):
+        """
+        Quantize weights whose last axis is the output channel, e.g. dense
+        or locally connected kernels. Each channel is scaled so that its
+        largest magnitude weight is 127.
+
+        Parameters
+        ----------
+        array : numpy.array
+
+        Returns
+        -------
+        Int8Weights
+        """
+        scales = numpy.abs(array).max(axis=-2, keepdims=True) / 127.0
+        scales[scales == 0] = 1.0
+        values = numpy.round(array / scales).astype(numpy.int8)
+        return klass(values, scales.astype(numpy.float32))
+
+    @staticmethod
+    def concatenate(items):
+        return Int8Weights(
+            numpy.concatenate([item.values for item in items]),
+            numpy.concatenate([item.scales for item in items]))
+
+    def __getitem__(self, index):
+        return Int8Weights(self.values[index], self.scales[index])
+
+    def __len__(self):
+        return len(self.values)
+
+    @property
+    def nbytes(self):
+        return self.values.nbytes + self.scales.nbytes
+
+    def decode(self):
+        """
+        Return the weights as a float32 array.
+        """
+        return self.values.astype(numpy.float32) * self.scales
+
+
+def decode_weights(weights):
+    """
+    Return stored weights (see `NumpyNetwork.with_precision`) as float32
+    arrays.
+    """
+    if isinstance(weights, Int8Weights):
+        return weights.decode()
+    return weights.astype(numpy.float32, copy=False)
+
+
+def concatenate_weights(items):
+    if isinstance(items[0], Int8Weights):
+        return Int8Weights.concatenate(items)
+    return numpy.concatenate(items)
+
+
+LAYERS = {
+    "InputLayer": input_layer,
+    "Embedding": embedding_layer,
+    "LocallyConnected1D": locally_connected_1d_layer,
+    "Flatten": flatten_layer,
+    "Dense": dense_layer,
+    "Dropout": dropout_layer,
+    "BatchNormalization": batch_normalization_layer,
+    "Concatenate": concatenate_layer,
+}
+
+
+class NumpyNetwork(object):
+    """
+    A keras functional model evaluated with numpy.
+
+    Use `stack` to evaluate several models with the same architecture (e.g.
+    the members of an ensemble) together in one pass.
+
+    Parameters
+    ----------
+    network_json : string of JSON
+        As given by keras.models.Model.to_json()
+
+    network_weights : list of numpy.array
+        As given by keras.models.Model.get_weights()
+    """
+
+    # Supported precisions for stored weights. See with_precision.
+    PRECISIONS = ("float32", "float16", "int8")
+
+    def __init__(self, network_json, network_weights):
+        self.network_json = network_json
+        self.num_models = 1
+        self.precision = "float32"
+        config = json.loads(network_json)['config']
+        self.input_names = [item[0] for item in config['input_layers']]
+        self.output_names = [item[0] for item in config['output_layers']]
+
+        # Keras orders the weights by layer, in the order the layers are
+        # listed in the JSON description.
+        self.layers = []
+        weights_iterator = iter(network_weights)
+        for layer in config['layers']:
+            class_name = layer['class_name']
+            if class_name not in LAYERS:
+                raise NotImplementedError(
+                    "Unsupported layer type: %s" % class_name)
+            layer_config = layer['config']
+            layer_weights = [
+                numpy.asarray(
+                    next(weights_iterator),
+                    dtype=numpy.float32)[numpy.newaxis]
+                for _ in range(self.num_weights(class_name, layer_config))
+            ]
+            inbound_names = [
+                item[0] for item in (
+                    layer['inbound_nodes'][0] if layer['inbound_nodes']
+                    else [])
+            ]
+            self.layers.append((
+                layer['name'],
+                LAYERS[class_name],
+                layer_config,
+                layer_weights,
+                inbound_names))
+        if next(weights_iterator, None) is not None:
+            raise ValueError("More weights than the network has parameters")
+
+    @classmethod
+    def stack(klass, networks):
+        """
+        Combine networks with the same architecture into one NumpyNetwork
+        whose weights are stacked along a leading models axis, so all of them
+        are evaluated in a single pass over the inputs.
+
+        Parameters
+        ----------
+        networks : list of NumpyNetwork
+
+        Returns
+        -------
+        NumpyNetwork
+        """
+        networks = list(networks)
+        if len(networks) == 1:
+            return networks[0]
+        first = networks[0]
+        if any(n.network_json != first.network_json for n in networks):
+            raise ValueError("Only networks with the same architecture can "
+                             "be stacked")
+        if any(n.precision != first.precision for n in networks):
+            raise ValueError("Only networks with the same precision can "
+                             "be stacked")
+        result = klass.__new__(klass)
+        result.network_json = first.network_json
+        result.num_models = sum(n.num_models for n in networks)
+        result.precision = first.precision
+        result.input_names = first.input_names
+        result.output_names = first.output_names
+        result.layers = []
+        for (i, layer) in enumerate(first.layers):
+            (name, function, config, _, inbound_names) = layer
+            weights = [
+                concatenate_weights([n.layers[i][3][j] for n in networks])
+                for j in range(len(layer[3]))
+            ]
+            result.layers.append(
+                (name, function, config, weights, inbound_names))
+        return result
+
+    @staticmethod
+    def num_weights(class_name, config):
+        """
+        Number of weight arrays used by a layer.
+
+        Parameters
+        ----------
+        class_name : string
+        config : dict
+
+        Returns
+        -------
+        int
+        """
+        if class_name in ("Dense", "LocallyConnected1D"):
+            return 2 if config.get('use_bias', True) else 1
+        if class_name == "Embedding":
+            return 1
+        if class_name == "BatchNormalization":
+            return (
+                2 +
+                int(config.get('scale', True)) +
+                int(config.get('center', True)))
+        return 0
+
+    def with_precision(self, precision):
+        """
+        Return a copy of this network with weights stored at a reduced
+        precision, to save memory.
+
+        With "float16", all weights are stored as float16. With "int8", the
+        kernels of dense, locally connected, and embedding layers are stored
+        as int8 with a float32 scale per output channel (see `Int8Weights`)
+        and other weights are kept as float32. In either case, each layer's
+        weights are converted back to float32 when the layer is evaluated.
+
+        Parameters
+        ----------
+        precision : string
+            One of PRECISIONS
+
+        Returns
+        -------
+        NumpyNetwork
+        """
+        if precision not in self.PRECISIONS:
+            raise ValueError("Unsupported precision: %s" % precision)
+        if self.precision != "float32":
+            raise ValueError(
+                "Network already has reduced precision: %s" % self.precision)
+        if precision == "float32":
+            return self
+        result = self.__class__.__new__(self.__class__)
+        result.__dict__.update(self.__dict__)
+        result.precision = precision
+        result.layers = []
+        for (name, function, config, weights, inbound_names) in self.layers:
+            if precision == "float16":
+                weights = [w.astype(numpy.float16) for w in weights]
+            elif weights and function in (
+                    dense_layer, locally_connected_1d_layer, embedding_layer):
+                weights = [Int8Weights.quantize(weights[0])] + weights[1:]
+            result.layers.append(
+                (name, function, config, weights, inbound_names))
+        return result
+
+    @property
+    def nbytes(self):
+        """
+        Memory used by the stored weights.
+        """
+        return sum(w.nbytes for layer in self.layers for w in layer[3])
+
+    def evaluate(self, inputs, layer_weights, model_ndim):
+        """
+        Run the network on inputs and weights with the given number of
+        leading model axes. Used internally.
+
+        Parameters
+        ----------
+        inputs : dict of string -> numpy.array
+        layer_weights : list of list of numpy.array
+            Weights for each layer
+        model_ndim : int
+
+        Returns
+        -------
+        list of numpy.array giving each output
+        """
+        values = dict(inputs)
+        for (layer, weights) in zip(self.layers, layer_weights):
+            (name, function, config, _, inbound_names) = layer
+            if name in values:
+                continue
+            values[name] = function(
+                config,
+                [decode_weights(w) for w in weights],
+                [values[item] for item in inbound_names],
+                model_ndim)
+        return [values[name] for name in self.output_names]
+
+    def predict(self, x_dict):
+        """
+        Run the network.
+
+        Parameters
+        ----------
+        x_dict : dict of string -> numpy.array
+            Network inputs, keyed by input layer name
+
+        Returns
+        -------
+        numpy.array (or list of numpy.array if the network has multiple
+        outputs). For stacked networks (see `stack`) each output has an
+        additional leading axis giving the model.
+        """
+        inputs = dict(
+            (name, numpy.asarray(x_dict[name])[numpy.newaxis])
+            for name in self.input_names)
+        outputs = [
+            numpy.broadcast_to(
+                output, (self.num_models,) + output.shape[1:])
+            for output in self.evaluate(
+                inputs, [layer[3] for layer in self.layers], model_ndim=1)
+        ]
+        if self.num_models == 1:
+            outputs = [output[0] for output in outputs]
+        if len(outputs) == 1:
+            return outputs[0]
+        return outputs
+
+    def predict_by_group(
+            self,
+            x_dict,
+            input_indices,
+            group_codes,
+            model_indices,
+            piece_size=256,
+            batch_rows=4096):
+        """
+        Run each row through its own set of the stacked models (see `stack`),
+        for example the ensemble for the row's allele.
+
+        Rows are sorted by group and split into pieces of at most
+        `piece_size` rows from the same group. Each piece's weights are
+        gathered from the stacked weights, and batches of pieces are
+        evaluated together, so a mix of groups is handled in a few large
+        vectorized operations.
+
+        Parameters
+        ----------
+        x_dict : dict of string -> numpy.array
+            Network inputs, keyed by input layer name
+
+        input_indices : numpy.array of int of length n
+            Row of x_dict to use for each row
+
+        group_codes : numpy.array of int of length n
+            Group of each row
+
+        model_indices : numpy.array of int of shape (num groups, k)
+            Indices of the stacked models to run for each group. Entries of -1
+            indicate no model; the corresponding predictions are NaN.
+
+        piece_size : int
+            Maximum number of rows per piece
+
+        batch_rows : int
+            Approximate number of rows to evaluate at once
+
+        Returns
+        -------
+        numpy.array of shape (n, k) + output shape
+            Predictions of the (first) output
+        """
+        input_indices = numpy.asarray(input_indices)
+        group_codes = numpy.asarray(group_codes)
+        model_indices = numpy.asarray(model_indices)
+        num_rows = len(group_codes)
+
+        order = numpy.argsort(group_codes, kind="mergesort")
+        sorted_codes = group_codes[order]
+        group_starts = numpy.flatnonzero(numpy.concatenate(
+            [[True], sorted_codes[1:] != sorted_codes[:-1]]))[:num_rows]
+        group_ends = numpy.append(group_starts[1:], num_rows)
+        pieces_per_group = (
+            group_ends - group_starts + piece_size - 1) // piece_size
+        piece_group_starts = numpy.repeat(group_starts, pieces_per_group)
+        piece_starts = piece_group_starts + piece_size * (
+            numpy.arange(pieces_per_group.sum()) -
+            numpy.repeat(
+                numpy.cumsum(pieces_per_group) - pieces_per_group,
+                pieces_per_group))
+        piece_ends = numpy.minimum(
+            piece_starts + piece_size,
+            numpy.repeat(group_ends, pieces_per_group))
+
+        result = None
+        pieces_per_batch = max(1, batch_rows // piece_size)
+        for batch_start in range(0, len(piece_starts), pieces_per_batch):
+            starts = piece_starts[batch_start:batch_start + pieces_per_batch]
+            ends = piece_ends[batch_start:batch_start + pieces_per_batch]
+            positions = (
+                starts.reshape((-1, 1)) +
+                numpy.arange((ends - starts).max()))
+            valid = positions < ends.reshape((-1, 1))
+            rows = order[numpy.where(valid, positions, starts.reshape((-1, 1)))]
+
+            # Model axes: (piece, model)
+            inputs = dict(
+                (name, numpy.asarray(x_dict[name])[
+                    input_indices[rows]][:, numpy.newaxis])
+                for name in self.input_names)
+            piece_model_indices = model_indices[sorted_codes[starts]]
+            gathered = numpy.maximum(piece_model_indices, 0)
+            layer_weights = [
+                [w[gathered] for w in layer[3]] for layer in self.layers
+            ]
+            output = self.evaluate(inputs, layer_weights, model_ndim=2)[0]
+
+            # (piece, row, model, ...)
+            output = numpy.broadcast_to(
+                output, piece_model_indices.shape + output.shape[2:]
+            ).swapaxes(1, 2)
+            if result is None:
+                result = numpy.full(
+                    (num_rows,) + output.shape[2:], numpy.nan,
+                    dtype=output.dtype)
+            output = numpy.where(
+                (piece_model_indices < 0).reshape(
+                    (len(starts), 1, -1) + (1,) * (output.ndim - 3)),
+                numpy.nan,
+                output)
+            result[rows[valid]] = output[valid]
+        if result is None:
+            result = numpy.full(
+                (0, model_indices.shape[1]), numpy.nan, dtype="float32")
+        return result
@@ -0,0 +1,113 @@
+"""
+Report how much reduced-precision weights change Class1 affinity predictions.
+
+Predictions using weights stored at each reduced precision (see the
+numpy-float16 and numpy-int8 prediction backends) are compared to full
+precision predictions on a validation set.
+
+Example:
+
+    mhcflurry-class1-precision-report --data VALIDATION.csv
+"""
+from __future__ import (
+    print_function,
+    division,
+    absolute_import,
+)
+import sys
+import argparse
+
+import numpy
+import pandas
+
+from .class1_affinity_predictor import Class1AffinityPredictor
+from ..common import configure_logging
+
+
+parser = argparse.ArgumentParser(usage=__doc__)
+
+parser.add_argument(
+    "--data",
+    metavar="FILE.csv",
+    required=True,
+    help="Validation data CSV. Expected columns: allele, peptide")
+parser.add_argument(
+    "--models",
+    metavar="DIR",
+    default=None,
+    help="Directory containing models. Default: the downloaded models")
+parser.add_argument(
+    "--precisions",
+    nargs="+",
+    default=["float16", "int8"],
+    choices=["float16", "int8"],
+    help="Precisions to evaluate. Default: %(default)s")
+parser.add_argument(
+    "--max-rows",
+    type=int,
+    metavar="N",
+    default=None,
+    help="Use only the first N rows of the validation data")
+parser.add_argument(
+    "--out",
+    metavar="OUTPUT.csv",
+    help="Output CSV")
+parser.add_argument(
+    "--verbosity",
+    type=int,
+    help="Default: %(default)s",
+    default=0)
+
+
+def run(argv=sys.argv[1:]):
+    args = parser.parse_args(argv)
+
+    configure_logging(verbose=args.verbosity > 0)
+
+    df = pandas.read_csv(args.data, nrows=args.max_rows)
+    print("Loaded validation data: %s" % (str(df.shape)))
+
+    predictor = Class1AffinityPredictor.load(args.models, backend="numpy")
+    models = list(predictor.class1_pan_allele_models)
+    for allele_models in predictor.allele_to_allele_specific_models.values():
+        models.extend(allele_models)
+
+    full_precision = predictor.predict(
+        peptides=df.peptide.values,
+        alleles=df.allele.values,
+        throw=False)
+    mask = ~numpy.isnan(full_precision)
+    print("Predicted %d of %d rows" % (mask.sum(), len(mask)))
+
+    rows = []
+    for precision in ["float32"] + args.precisions:
+        backend = "numpy" if precision == "float32" else "numpy-" + precision
+        predictor.backend = backend
+        predictions = predictor.predict(
+            peptides=df.peptide.values[mask],
+            alleles=df.allele.values[mask],
+            throw=False)
+        nm_deviation = numpy.abs(predictions - full_precision[mask])
+        log10_deviation = numpy.abs(
+            numpy.log10(predictions) - numpy.log10(full_precision[mask]))
+        rows.append((
+            precision,
+            sum(model.numpy_network(precision).nbytes for model in models),
+            nm_deviation.max(),
+            numpy.median(nm_deviation),
+            log10_deviation.max(),
+            numpy.median(log10_deviation),
+        ))
+    result_df = pandas.DataFrame(rows, columns=[
+        "precision",
+        "weights_bytes",
+        "max_nm_deviation",
+        "median_nm_deviation",
+        "max_log10_nm_deviation",
+        "median_log10_nm_deviation",
+    ])
+    print(result_df.to_string(index=False))
+
+    if args.out:
+        result_df.to_csv(args.out, index=False)
+        print("Wrote: %s" % args.out)
@@ -0,0 +1,353 @@
+"""
+Cache of Class1AffinityPredictor predictions for (allele, peptide) pairs.
+"""
+from __future__ import (
+    print_function,
+    division,
+    absolute_import,
+)
+
+import collections
+import sqlite3
+import threading
+
+import numpy
+import pandas
+
+
+def group_rows(alleles):
+    """
+    Group row indices by allele.
+
+    Parameters
+    ----------
+    alleles : list of string
+
+    Returns
+    -------
+    generator of (string, numpy.array of int) pairs giving each distinct
+    allele and the indices of its rows
+    """
+    (codes, distinct_alleles) = pandas.factorize(
+        numpy.asarray(alleles, dtype=object))
+    order = numpy.argsort(codes, kind="mergesort")
+    boundaries = numpy.searchsorted(
+        codes[order], numpy.arange(len(distinct_alleles) + 1))
+    for (code, allele) in enumerate(distinct_alleles):
+        yield (allele, order[boundaries[code]:boundaries[code + 1]])
+
+
+def pad_columns(values, num_columns):
+    """
+    Pad a 2d array with columns of NaN.
+    """
+    result = numpy.full((len(values), num_columns), numpy.nan)
+    result[:, :values.shape[1]] = values
+    return result
+
+
+class AlleleEntries(object):
+    """
+    Cached values for one (fingerprint, allele) pair: row i of `values` is the
+    value for `peptides[i]`, which was last used at time `last_used[i]`.
+    """
+    def __init__(self):
+        self.peptides = pandas.Index([], dtype=object)
+        self.values = numpy.zeros((0, 0))
+        self.last_used = numpy.zeros(0, dtype=numpy.int64)
+
+    def __len__(self):
+        return len(self.peptides)
+
+    def add(self, peptides, values, times):
+        """
+        Add or replace rows. The peptides must be distinct.
+        """
+        num_columns = max(values.shape[1], self.values.shape[1])
+        if values.shape[1] < num_columns:
+            values = pad_columns(values, num_columns)
+        if self.values.shape[1] < num_columns:
+            self.values = pad_columns(self.values, num_columns)
+        positions = self.peptides.get_indexer(peptides)
+        existing = positions >= 0
+        self.values[positions[existing]] = values[existing]
+        self.last_used[positions[existing]] = times[existing]
+        if not existing.all():
+            self.peptides = self.peptides.append(
+                pandas.Index(peptides[~existing], dtype=object))
+            self.values = numpy.concatenate([self.values, values[~existing]])
+            self.last_used = numpy.concatenate(
+                [self.last_used, times[~existing]])
+
+    def keep(self, mask):
+        """
+        Remove the rows where mask is False.
+        """
+        self.peptides = self.peptides[mask]
+        self.values = self.values[mask]
+        self.last_used = self.last_used[mask]
+
+
+class PredictionCache(object):
+    """
+    Cache of the individual model predictions for (allele, peptide) pairs,
+    consulted by `Class1AffinityPredictor` before running any models.
+
+    Entries are keyed by a fingerprint of the predictor's models (see
+    `Class1AffinityPredictor.fingerprint`) in addition to the allele and
+    peptide, so predictions from different models are never mixed up:
+    entries for other models simply stop being used.
+
+    Recently used entries are kept in memory, up to `max_entries`. If `path`
+    is given, all entries are also stored in an sqlite database there, so
+    they persist across processes.
+
+    Lookups and insertions work on arrays of alleles and peptides, using a
+    hash index of the peptides cached for each allele, so there is no Python
+    work per peptide on the in-memory tier.
+
+    Parameters
+    ----------
+    max_entries : int
+        Maximum number of entries to keep in memory. Beyond this, the least
+        recently used entries are evicted, down to LOW_WATER_FRACTION of
+        max_entries so that evictions (which scan all entries) are
+        infrequent.
+
+    path : string, optional
+        Path to an sqlite database to use as a persistent tier. Created if it
+        does not exist.
+    """
+    # Number of peptides per sqlite query.
+    QUERY_CHUNK_SIZE = 500
+
+    # Fraction of max_entries kept in memory after an eviction.
+    LOW_WATER_FRACTION = 0.9
+
+    def __init__(self, max_entries=1000000, path=None):
+        self.max_entries = max_entries
+        self.path = path
+
+        # (fingerprint, allele) -> AlleleEntries
+        self.entries = {}
+        self.stats = collections.Counter()
+        self.lock = threading.Lock()
+        self._connection = None
+
+        # Incremented for each entry used, to order entries by last use.
+        self._time = 0
+
+    def connection(self):
+        """
+        Return the sqlite connection, creating the database if needed, or
+        None if there is no persistent tier.
+
+        Returns
+        -------
+        sqlite3.Connection
+        """
+        if self.path is not None and self._connection is None:
+            self._connection = sqlite3.connect(
+                self.path, check_same_thread=False)
+            self._connection.execute(
+                "CREATE TABLE IF NOT EXISTS predictions ("
+                "fingerprint TEXT, allele TEXT, peptide TEXT, value BLOB, "
+                "PRIMARY KEY (fingerprint, allele, peptide))")
+            self._connection.commit()
+        return self._connection
+
+    def get_many(self, fingerprint, alleles, peptides):
+        """
+        Look up cached values.
+
+        Parameters
+        ----------
+        fingerprint : string
+        alleles : list of string
+            Normalized allele names
+        peptides : list of string
+
+        Returns
+        -------
+        (numpy.array of float64, numpy.array of bool) pair. The first array
+        has a row for each peptide, giving the cached value for hits padded
+        with NaN to the length of the longest value found. The second array
+        indicates which peptides were hits.
+        """
+        peptides = numpy.asarray(peptides, dtype=object)
+        hit = numpy.zeros(len(peptides), dtype=bool)
+        found = []
+        with self.lock:
+            misses = []
+            for (allele, rows) in group_rows(alleles):
+                entries = self.entries.get((fingerprint, allele))
+                if entries is not None:
+                    positions = entries.peptides.get_indexer(peptides[rows])
+                    memory_hit = positions >= 0
+                    found.append(
+                        (rows[memory_hit],
+                         entries.values[positions[memory_hit]]))
+                    entries.last_used[positions[memory_hit]] = self._times(
+                        memory_hit.sum())
+                    self.stats["memory_hits"] += int(memory_hit.sum())
+                    rows = rows[~memory_hit]
+                if len(rows) > 0:
+                    misses.append((allele, rows))
+
+            connection = self.connection()
+            if connection is not None:
+                for (allele, rows) in misses:
+                    (disk_peptides, disk_values) = self._select(
+                        connection, fingerprint, allele, peptides[rows])
+                    positions = disk_peptides.get_indexer(peptides[rows])
+                    disk_hit = positions >= 0
+                    found.append(
+                        (rows[disk_hit], disk_values[positions[disk_hit]]))
+                    self.stats["disk_hits"] += int(disk_hit.sum())
+                    if len(disk_peptides) > 0:
+                        self._add(
+                            fingerprint,
+                            allele,
+                            disk_peptides.values,
+                            disk_values)
+
+            num_columns = max([0] + [values.shape[1] for (_, values) in found])
+            result = numpy.full((len(peptides), num_columns), numpy.nan)
+            for (rows, values) in found:
+                result[rows, :values.shape[1]] = values
+                hit[rows] = True
+            self.stats["misses"] += int((~hit).sum())
+        return (result, hit)
+
+    def put_many(self, fingerprint, alleles, peptides, values):
+        """
+        Add entries.
+
+        Parameters
+        ----------
+        fingerprint : string
+        alleles : list of string
+            Normalized allele names
+        peptides : list of string
+        values : 2d numpy.array
+            Value for each peptide. Trailing columns that are NaN for every
+            peptide of an allele are taken to be padding and are not stored.
+        """
+        peptides = numpy.asarray(peptides, dtype=object)
+        values = numpy.asarray(values, dtype=numpy.float64)
+        with self.lock:
+            connection = self.connection()
+            for (allele, rows) in group_rows(alleles):
+                # Keep the last value given for each peptide.
+                (_, last) = numpy.unique(
+                    peptides[rows][::-1], return_index=True)
+                rows = rows[len(rows) - 1 - last]
+                present = numpy.flatnonzero(
+                    ~numpy.isnan(values[rows]).all(axis=0))
+                num_columns = present[-1] + 1 if len(present) > 0 else 0
+                allele_values = values[rows, :num_columns]
+                self._add(fingerprint, allele, peptides[rows], allele_values)
+                if connection is not None:
+                    connection.executemany(
+                        "INSERT OR REPLACE INTO predictions VALUES "
+                        "(?, ?, ?, ?)",
+                        [
+                            (fingerprint, allele, peptide, value.tobytes())
+                            for (peptide, value) in zip(
+                                peptides[rows], allele_values)
+                        ])
+            if connection is not None:
+                connection.commit()
+
+    def _select(self, connection, fingerprint, allele, peptides):
+        """
+        Read entries for one allele from the database.
+
+        Returns
+        -------
+        (pandas.Index, numpy.array of float64) pair giving the peptides found
+        and their values
+        """
+        distinct_peptides = list(pandas.unique(peptides))
+        found_peptides = []
+        blobs = []
+        for start in range(0, len(distinct_peptides), self.QUERY_CHUNK_SIZE):
+            chunk = distinct_peptides[start:start + self.QUERY_CHUNK_SIZE]
+            rows = connection.execute(
+                "SELECT peptide, value FROM predictions WHERE "
+                "fingerprint = ? AND allele = ? AND peptide IN "
+                "(%s)" % ", ".join("?" * len(chunk)),
+                [fingerprint, allele] + chunk)
+            for (peptide, value) in rows:
+                found_peptides.append(peptide)
+                blobs.append(bytes(value))
+        values = numpy.frombuffer(b"".join(blobs), dtype=numpy.float64)
+        values = values.reshape(
+            (len(blobs), len(values) // len(blobs)) if blobs else (0, 0))
+        return (pandas.Index(found_peptides, dtype=object), values)
+
+    def _times(self, num):
+        """
+        Return num increasing times, later than any returned before.
+        """
+        result = numpy.arange(self._time, self._time + num, dtype=numpy.int64)
+        self._time += num
+        return result
+
+    def _add(self, fingerprint, allele, peptides, values):
+        key = (fingerprint, allele)
+        if key not in self.entries:
+            self.entries[key] = AlleleEntries()
+        self.entries[key].add(peptides, values, self._times(len(peptides)))
+
+        # Once over max_entries, evict the least recently used entries
+        # across all alleles down to the low water mark.
+        num_entries = sum(len(entries) for entries in self.entries.values())
+        if num_entries > self.max_entries:
+            excess = num_entries - int(
+                self.max_entries * self.LOW_WATER_FRACTION)
+            if excess >= num_entries:
+                self.entries.clear()
+                return
+            cutoff = numpy.partition(
+                numpy.concatenate([
+                    entries.last_used for entries in self.entries.values()
+                ]),
+                excess)[excess]
+            for (key, entries) in list(self.entries.items()):
+                entries.keep(entries.last_used >= cutoff)
+                if len(entries) == 0:
+                    del self.entries[key]
+
+    def statistics(self):
+        """
+        Hit counts and hit rate since the cache was created.
+
+        Returns
+        -------
+        dict with keys "memory_hits", "disk_hits", "misses", "hit_rate", and
+        "memory_entries"
+        """
+        with self.lock:
+            lookups = sum(self.stats.values())
+            return {
+                "memory_hits": self.stats["memory_hits"],
+                "disk_hits": self.stats["disk_hits"],
+                "misses": self.stats["misses"],
+                "hit_rate": (
+                    (self.stats["memory_hits"] + self.stats["disk_hits"]) /
+                    lookups if lookups else float("nan")),
+                "memory_entries": sum(
+                    len(entries) for entries in self.entries.values()),
+            }
+
+    def clear(self):
+        """
+        Remove all entries, including those on disk.
+        """
+        with self.lock:
+            self.entries.clear()
+            connection = self.connection()
+            if connection is not None:
+                connection.execute("DELETE FROM predictions")
+                connection.commit()
@@ -0,0 +1,193 @@
+"""
+Single-file storage for the weights of many Class1NeuralNetwork models.
+
+A weights archive is one uncompressed file holding every model's weight
+arrays, each aligned to ALIGNMENT bytes, preceded by a JSON index giving the
+offset, dtype, and shape of each array. Archives are read with numpy.memmap, so
+loading is a single open() regardless of the number of models, arrays are
+read from disk only when used, and processes loading the same archive share
+its pages in the operating system's page cache.
+
+Layout:
+
+    MAGIC (8 bytes)
+    length of the JSON index in bytes (8 byte little-endian unsigned int)
+    JSON index, padded with spaces so the first array is aligned
+    arrays, in index order, each padded to ALIGNMENT bytes
+"""
+from __future__ import (
+    print_function,
+    division,
+    absolute_import,
+)
+
+import os
+import json
+import struct
+import hashlib
+import collections
+
+import numpy
+
+MAGIC = b"MHCFWA01"
+ALIGNMENT = 64
+
+# Precisions at which weights may be stored.
+DTYPES = ("float32", "float16")
+
+
+def aligned(offset):
+    """
+    Smallest multiple of ALIGNMENT that is at least offset.
+    """
+    return -(-offset // ALIGNMENT) * ALIGNMENT
+
+
+def file_digest(filename, block_size=2 ** 20):
+    """
+    SHA1 hex digest of the contents of a file. This identifies the contents
+    regardless of where the file is or when it was written, so copies of the
+    same file have the same digest.
+    """
+    digest = hashlib.sha1()
+    with open(filename, "rb") as fd:
+        while True:
+            block = fd.read(block_size)
+            if not block:
+                break
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def write_weights_archive(filename, model_name_and_weights, dtype="float32"):
+    """
+    Write a weights archive.
+
+    The archive is written to a temporary file that then replaces filename,
+    so processes that have the previous archive open are not affected.
+
+    Parameters
+    ----------
+    filename : string
+
+    model_name_and_weights : iterable of (string, list of numpy.array) pairs
+        Model name and weights (as given by Class1NeuralNetwork.get_weights)
+        for each model
+
+    dtype : string
+        One of DTYPES. Floating point arrays are stored with this dtype.
+    """
+    if dtype not in DTYPES:
+        raise ValueError("Unsupported dtype: %s" % dtype)
+
+    index = collections.OrderedDict()
+    arrays = []
+    offset = 0
+    for (model_name, weights) in model_name_and_weights:
+        if model_name in index:
+            raise ValueError("Duplicate model name: %s" % model_name)
+        entries = []
+        for array in weights:
+            array = numpy.asarray(array)
+            if array.dtype.kind == "f":
+                array = array.astype(dtype, copy=False)
+            array = numpy.ascontiguousarray(array)
+            entries.append((offset, array.dtype.str, list(array.shape)))
+            arrays.append((offset, array))
+            offset = aligned(offset + array.nbytes)
+        index[model_name] = entries
+
+    index_bytes = json.dumps({"models": index}).encode("ascii")
+    data_start = aligned(len(MAGIC) + 8 + len(index_bytes))
+    index_bytes += b" " * (data_start - len(MAGIC) - 8 - len(index_bytes))
+
+    temp_filename = "%s.tmp%d" % (filename, os.getpid())
+    with open(temp_filename, "wb") as fd:
+        fd.write(MAGIC)
+        fd.write(struct.pack("<Q", len(index_bytes)))
+        fd.write(index_bytes)
+        for (array_offset, array) in arrays:
+            fd.seek(data_start + array_offset)
+            fd.write(array.tobytes())
+        fd.truncate(data_start + offset)
+    if os.path.exists(filename):
+        os.remove(filename)
+    os.rename(temp_filename, filename)
+
+
+class WeightsArchive(object):
+    """
+    Read-only access to a weights archive written by `write_weights_archive`.
+
+    Arrays returned by `get_weights` are views of a read-only memory map of
+    the file.
+
+    Parameters
+    ----------
+    filename : string
+    """
+    def __init__(self, filename):
+        self.filename = filename
+        with open(filename, "rb") as fd:
+            magic = fd.read(len(MAGIC))
+            if magic != MAGIC:
+                raise ValueError("Not a weights archive: %s" % filename)
+            (index_length,) = struct.unpack("<Q", fd.read(8))
+            self.index = json.loads(fd.read(index_length).decode("ascii"))[
+                "models"]
+        self.data_start = len(MAGIC) + 8 + index_length
+
+        # Digest of the archive contents, computed on first use. See
+        # signature.
+        self._signature = None
+        self._memmap = None
+
+    def __getstate__(self):
+        result = dict(self.__dict__)
+        result["_memmap"] = None
+        return result
+
+    def signature(self):
+        """
+        String identifying the contents of the archive, computed by reading
+        it once. Used as the weights source of models loaded from the
+        archive: see Class1NeuralNetwork.weights_fingerprint.
+
+        Returns
+        -------
+        string
+        """
+        if self._signature is None:
+            self._signature = "%s %s" % (
+                MAGIC.decode("ascii"), file_digest(self.filename))
+        return self._signature
+
+    @property
+    def model_names(self):
+        return list(self.index)
+
+    def __contains__(self, model_name):
+        return model_name in self.index
+
+    def get_weights(self, model_name):
+        """
+        Weights for a model.
+
+        Parameters
+        ----------
+        model_name : string
+
+        Returns
+        -------
+        list of numpy.array
+        """
+        if self._memmap is None:
+            self._memmap = numpy.memmap(self.filename, dtype="uint8", mode="r")
+        weights = []
+        for (offset, dtype, shape) in self.index[model_name]:
+            dtype = numpy.dtype(dtype)
+            start = self.data_start + offset
+            size = int(numpy.prod(shape)) * dtype.itemsize
+            weights.append(
+                self._memmap[start:start + size].view(dtype).reshape(shape))
+        return weights
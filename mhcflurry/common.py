@@ -146,6 +146,66 @@ def drop_nulls_and_warn(df, related_df_with_same_index_to_describe=None):
     return new_df
 
 
+def nanmean_rows(values):
+    """
+    Mean of each row of a matrix, ignoring NaNs. Rows that are entirely NaN
+    give NaN (without the warning numpy.nanmean issues).
+
+    Parameters
+    ----------
+    values : numpy.array of shape (n, k)
+
+    Returns
+    -------
+    numpy.array of length n
+    """
+    counts = (~numpy.isnan(values)).sum(axis=1)
+    with numpy.errstate(invalid="ignore", divide="ignore"):
+        return numpy.where(
+            counts > 0, numpy.nansum(values, axis=1) / counts, numpy.nan)
+
+
+def nanquantile_rows(values, quantiles):
+    """
+    Quantiles of each row of a matrix, ignoring NaNs, with linear
+    interpolation (as in pandas.DataFrame.quantile). Rows that are entirely
+    NaN give NaN.
+
+    Unlike numpy.nanpercentile, which handles rows containing NaNs one at a
+    time, this sorts all rows at once, so it is fast for matrices with many
+    rows and few columns.
+
+    Parameters
+    ----------
+    values : numpy.array of shape (n, k)
+    quantiles : list of float
+        Each between 0 and 1
+
+    Returns
+    -------
+    list of numpy.array of length n giving each quantile
+    """
+    if values.shape[1] == 0:
+        return [numpy.full(len(values), numpy.nan) for _ in quantiles]
+
+    # NaNs sort to the end of each row.
+    sorted_values = numpy.sort(values, axis=1)
+    last = (~numpy.isnan(values)).sum(axis=1) - 1
+    rows = numpy.arange(len(values))
+    results = []
+    for quantile in quantiles:
+        position = numpy.maximum(last, 0) * quantile
+        lower = numpy.floor(position).astype(int)
+        upper = numpy.ceil(position).astype(int)
+        lower_values = sorted_values[rows, lower]
+        upper_values = sorted_values[rows, upper]
+        result = lower_values + (upper_values - lower_values) * (
+            position - lower)
+        result[last < 0] = numpy.nan
+        results.append(result)
+    return results
+
+
 def amino_acid_distribution(peptides, smoothing=0.0):
     """
     Compute the fraction of each amino acid across a collection of peptides.
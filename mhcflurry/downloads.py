@@ -21,13 +21,11 @@ from __future__ import (
     absolute_import,
 )
 import logging
-import yaml
 from os.path import join, exists
 from pipes import quote
 from os import environ
 from collections import OrderedDict
 from appdirs import user_data_dir
-from pkg_resources import resource_string
 
 ENVIRONMENT_VARIABLES = [
     "MHCFLURRY_DATA_DIR",
@@ -35,6 +33,8 @@ ENVIRONMENT_VARIABLES = [
     "MHCFLURRY_DOWNLOADS_DIR",
 ]
 
+# Set by configure(), which is called on first use rather than at import
+# time, so that importing mhcflurry does not read downloads.yml.
 _DOWNLOADS_DIR = None
 _CURRENT_RELEASE = None
 _METADATA = None
@@ -44,6 +44,8 @@ def get_downloads_dir():
     """
     Return the path to local downloaded data
     """
+    if _DOWNLOADS_DIR is None:
+        configure()
     return _DOWNLOADS_DIR
 
 
@@ -51,6 +53,8 @@ def get_current_release():
     """
     Return the current downloaded data release
     """
+    if _DOWNLOADS_DIR is None:
+        configure()
     return _CURRENT_RELEASE
 
 
@@ -60,6 +64,8 @@ def get_downloads_metadata():
     """
     global _METADATA
     if _METADATA is None:
+        import yaml
+        from pkg_resources import resource_string
         _METADATA = yaml.load(resource_string(__name__, "downloads.yml"))
     return _METADATA
 
@@ -122,6 +128,11 @@ def get_path(download_name, filename='', test_exists=True):
 def configure():
     """
     Setup various global variables based on environment variables.
+
+    This is called automatically on first use. Call it again to pick up
+    changes to the environment variables.
+
+    If MHCFLURRY_DOWNLOADS_DIR is set, downloads.yml is not read.
     """
     global _DOWNLOADS_DIR
     global _CURRENT_RELEASE
@@ -155,5 +166,3 @@ def configure():
         _DOWNLOADS_DIR = join(data_dir, _CURRENT_RELEASE)
 
     logging.debug("Configured MHCFLURRY_DOWNLOADS_DIR: %s" % _DOWNLOADS_DIR)
-
-configure()
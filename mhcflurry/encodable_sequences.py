@@ -19,19 +19,120 @@ from __future__ import (
 )
 
 import math
+import json
+from os import makedirs
+from os.path import join, exists
 
-import pandas
 import numpy
+import pandas
 
 import typechecks
 
 from . import amino_acid
 
 
+def sequences_to_byte_matrix(sequences):
+    """
+    Given a sequence of n strings, return an n * k array of their character
+    codes, where k is the length of the longest string.
+
+    Shorter strings are padded on the right with zeros. Characters outside the
+    single byte range are also set to zero, so they are treated as unknown
+    letters by `byte_matrix_index_encoding`.
+
+    Numpy arrays of dtype 'S' are viewed without copying.
+
+    Parameters
+    ----------
+    sequences : list of string or numpy.array of dtype 'U' or 'S'
+
+    Returns
+    -------
+    numpy.array of uint8 with shape (n, k)
+    """
+    sequences = numpy.asarray(sequences)
+    if len(sequences) == 0:
+        return numpy.zeros((0, 0), dtype=numpy.uint8)
+    if sequences.dtype.kind == 'S':
+        codes = numpy.ascontiguousarray(sequences).view(numpy.uint8).reshape(
+            (len(sequences), -1))
+        return codes[:, :nonzero_width(codes)]
+    if sequences.dtype.kind != 'U':
+        sequences = sequences.astype(str)
+    codes = numpy.ascontiguousarray(sequences).view(numpy.uint32).reshape(
+        (len(sequences), -1))
+    # The array's item size may exceed the longest string (e.g. for a subset
+    # of a larger array).
+    codes = codes[:, :nonzero_width(codes)]
+    result = codes.astype(numpy.uint8)
+    result[codes > 255] = 0
+    return result
+
+
+def nonzero_width(matrix):
+    """
+    Number of leading columns of a matrix up to and including the last
+    column with a nonzero entry.
+    """
+    nonzero_columns = numpy.flatnonzero(matrix.any(axis=0))
+    return nonzero_columns[-1] + 1 if len(nonzero_columns) > 0 else 0
+
+
+def index_encoding_table(letter_to_index_dict):
+    """
+    Return a 256-entry lookup table mapping character codes to the indices
+    given by letter_to_index_dict. Characters not in the dict map to -1.
+
+    Parameters
+    ----------
+    letter_to_index_dict : dict : string -> int
+
+    Returns
+    -------
+    numpy.array of int32 with shape (256,)
+    """
+    table = numpy.empty(256, dtype=numpy.int32)
+    table.fill(-1)
+    for (letter, index) in letter_to_index_dict.items():
+        table[ord(letter)] = index
+    return table
+
+
+def byte_matrix_index_encoding(byte_matrix, letter_to_index_dict):
+    """
+    Given an n * k array of character codes (as returned by
+    `sequences_to_byte_matrix`), return an n * k array where the (i, j)th
+    element is letter_to_index_dict[chr(byte_matrix[i][j])].
+
+    Raises ValueError if any character is not in letter_to_index_dict.
+
+    Parameters
+    ----------
+    byte_matrix : numpy.array of uint8 with shape (n, k)
+    letter_to_index_dict : dict : string -> int
+
+    Returns
+    -------
+    numpy.array of int32 with shape (n, k)
+    """
+    result = index_encoding_table(letter_to_index_dict)[byte_matrix]
+    if result.size > 0 and result.min() < 0:
+        bad_rows = numpy.flatnonzero((result < 0).any(axis=1))
+        example = byte_matrix[bad_rows[0]].tobytes().rstrip(b"\0")
+        raise ValueError(
+            "%d sequence(s) have unsupported characters or unequal lengths, "
+            "for example: '%s'" % (
+                len(bad_rows), example.decode("ascii", "replace")))
+    return result
+
+
 def index_encoding(sequences, letter_to_index_dict):
     """
-    Given a sequence of n strings all of length k, return a k * n array where
+    Given a sequence of n strings all of length k, return a n * k array where
     the (i, j)th element is letter_to_index_dict[sequence[i][j]].
+
+    Raises ValueError if any character is not in letter_to_index_dict or the
+    strings are not all the same length.
     
     Parameters
     ----------
@@ -40,14 +141,13 @@ def index_encoding(sequences, letter_to_index_dict):
 
     Returns
     -------
-    numpy.array of integers with shape (k, n)
+    numpy.array of integers with shape (n, k)
     """
-    df = pandas.DataFrame(iter(s) for s in sequences)
-    result = df.replace(letter_to_index_dict)
-    return result.values
+    return byte_matrix_index_encoding(
+        sequences_to_byte_matrix(sequences), letter_to_index_dict)
 
 
-def one_hot_encoding(index_encoded, alphabet_size):
+def one_hot_encoding(index_encoded, alphabet_size, dtype="int32"):
     """
     Given an n * k array of integers in the range [0, alphabet_size), return
     an n * k * alphabet_size array where element (i, k, j) is 1 if element
@@ -57,36 +157,66 @@ def one_hot_encoding(index_encoded, alphabet_size):
     ----------
     index_encoded : numpy.array of integers with shape (n, k)
     alphabet_size : int 
+    dtype : numpy dtype, optional
+        dtype of the result, for example "uint8", "bool", or "float32"
 
     Returns
     -------
-    numpy.array of integers of shape (n, k, alphabet_size)
+    numpy.array of shape (n, k, alphabet_size)
 
     """
     alphabet_size = int(alphabet_size)
     (num_sequences, sequence_length) = index_encoded.shape
     result = numpy.zeros(
         (num_sequences, sequence_length, alphabet_size),
-        dtype='int32')
-
-    # Transform the index encoded array into an array of indices into the
-    # flattened result, which we will set to 1.
-    flattened_indices = (
-        index_encoded +
-        (
-            sequence_length * alphabet_size * numpy.arange(num_sequences)
-        ).reshape((-1, 1)) +
-        numpy.tile(numpy.arange(sequence_length),
-                   (num_sequences, 1)) * alphabet_size)
-    result.put(flattened_indices, 1)
+        dtype=dtype)
+
+    # Set one element in each row of the flattened (n * k, alphabet_size)
+    # result.
+    result.reshape((-1, alphabet_size))[
+        numpy.arange(num_sequences * sequence_length),
+        index_encoded.reshape(-1)
+    ] = 1
     return result
 
 
+def gather_segments(buffer, offsets, indices):
+    """
+    Given sequences stored as a concatenated buffer and offsets (see
+    `EncodableSequences.from_buffer`), return the buffer and offsets for the
+    sequences at the given indices.
+
+    Parameters
+    ----------
+    buffer : numpy.array of uint8
+    offsets : numpy.array of int of length n + 1
+    indices : numpy.array of int
+
+    Returns
+    -------
+    (numpy.array of uint8, numpy.array of int) tuple
+    """
+    starts = offsets[:-1][indices].astype(numpy.int64)
+    lengths = (offsets[1:][indices] - offsets[:-1][indices]).astype(
+        numpy.int64)
+    new_offsets = numpy.zeros(len(indices) + 1, dtype=numpy.int64)
+    numpy.cumsum(lengths, out=new_offsets[1:])
+    positions = (
+        numpy.repeat(starts - new_offsets[:-1], lengths) +
+        numpy.arange(new_offsets[-1]))
+    return (buffer[positions], new_offsets)
+
+
 class EncodableSequences(object):
     """
     Sequences of amino acids.
     
     This class caches various encodings of a list of sequences.
+
+    Subsets created with `take` share the encodings of the instance they were
+    taken from, so a set of sequences is only encoded once however it is
+    partitioned. Use `unique` to encode and predict each distinct sequence
+    only once.
     """
     unknown_character = "X"
 
@@ -96,23 +226,412 @@ class EncodableSequences(object):
         Factory that returns an EncodableSequences given a list of
         strings. As a convenience, you can also pass it an EncodableSequences
         instance, in which case the object is returned unchanged.
+
+        Numpy arrays of dtype 'S' are stored in the compact representation
+        described in `from_buffer`.
         """
         if isinstance(sequences, klass):
             return sequences
+        if isinstance(sequences, numpy.ndarray) and sequences.dtype.kind == 'S':
+            return klass.from_bytes_array(sequences)
         return klass(sequences)
 
     def __init__(self, sequences):
-        typechecks.require_iterable_of(
-            sequences, typechecks.string_types, "sequences")
-        self.sequences = numpy.array(sequences)
+        if not (isinstance(sequences, numpy.ndarray) and
+                sequences.dtype.kind == 'U'):
+            typechecks.require_iterable_of(
+                sequences, typechecks.string_types, "sequences")
+        self._sequences = numpy.asarray(sequences, dtype=str)
+        self.byte_buffer = None
+        self.offsets = None
+        self._setup()
+
+    @classmethod
+    def from_buffer(klass, buffer, offsets):
+        """
+        Create an EncodableSequences from a compact representation: the
+        concatenated sequences as a buffer of single-byte characters, and
+        n + 1 offsets giving the start of each sequence in the buffer followed
+        by the end of the last sequence.
+
+        Validation is vectorized, with no per-sequence Python work, and the
+        sequences are held in this form (about one byte per residue) until
+        the `sequences` attribute is accessed.
+
+        Parameters
+        ----------
+        buffer : bytes or numpy.array of uint8
+        offsets : numpy.array of int
+
+        Returns
+        -------
+        EncodableSequences
+        """
+        if isinstance(buffer, bytes):
+            buffer = numpy.frombuffer(buffer, dtype=numpy.uint8)
+        buffer = numpy.asarray(buffer)
+        offsets = numpy.asarray(offsets)
+        if buffer.dtype != numpy.uint8 or buffer.ndim != 1:
+            raise ValueError("buffer must be a 1-dimensional uint8 array")
+        if offsets.dtype.kind not in "iu" or offsets.ndim != 1 or (
+                len(offsets) == 0):
+            raise ValueError("offsets must be a non-empty array of integers")
+        if offsets[0] < 0 or offsets[-1] > len(buffer) or (
+                numpy.diff(offsets.astype(numpy.int64)) < 0).any():
+            raise ValueError(
+                "offsets must be non-decreasing and within the buffer")
+        if (buffer[offsets[0]:offsets[-1]] == 0).any():
+            raise ValueError("Sequences may not contain null characters")
+
+        result = klass.__new__(klass)
+        result._sequences = None
+        result.byte_buffer = buffer
+        result.offsets = offsets
+        result._setup()
+        return result
+
+    @classmethod
+    def from_bytes_array(klass, sequences):
+        """
+        Create an EncodableSequences from a numpy array of dtype 'S', stored
+        in the compact representation described in `from_buffer`.
+
+        Parameters
+        ----------
+        sequences : numpy.array of dtype 'S'
+
+        Returns
+        -------
+        EncodableSequences
+        """
+        byte_matrix = sequences_to_byte_matrix(sequences)
+        non_null = byte_matrix != 0
+        lengths = non_null.sum(axis=1)
+        if not (non_null == (
+                numpy.arange(byte_matrix.shape[1]) <
+                lengths.reshape((-1, 1)))).all():
+            raise ValueError("Sequences may not contain null characters")
+        offsets = numpy.zeros(len(lengths) + 1, dtype=numpy.int64)
+        numpy.cumsum(lengths, out=offsets[1:])
+        return klass.from_buffer(byte_matrix[non_null], offsets)
+
+    def _setup(self):
+        """
+        Initialize the attributes common to all representations.
+        """
+        if self.offsets is not None and self.offsets[-1] < 2**32:
+            self.offsets = self.offsets.astype(numpy.uint32)
+
+        self._sequence_lengths = None
         self.encoding_cache = {}
         self.fixed_sequence_length = None
-        if len(self.sequences) > 0 and all(
-                len(s) == len(self.sequences[0]) for s in self.sequences):
-            self.fixed_sequence_length = len(self.sequences[0])
+        lengths = self.sequence_lengths()
+        if len(lengths) > 0 and lengths.min() == lengths.max():
+            self.fixed_sequence_length = int(lengths[0])
+
+        # Set for instances created with take()
+        self.parent = None
+        self.parent_indices = None
+
+        # Computed on first call to unique()
+        self._unique = None
 
     def __len__(self):
-        return len(self.sequences)
+        if self.offsets is not None:
+            return len(self.offsets) - 1
+        return len(self._sequences)
+
+    @property
+    def sequences(self):
+        """
+        numpy.array of the sequences as strings.
+
+        For instances in the compact representation (see `from_buffer`) this
+        is decoded on first access.
+        """
+        if self._sequences is None:
+            if len(self) == 0:
+                self._sequences = numpy.array([], dtype=str)
+            else:
+                byte_matrix = self.byte_matrix()
+                self._sequences = byte_matrix.view(
+                    "S%d" % max(byte_matrix.shape[1], 1)).reshape(-1).astype(
+                    str)
+        return self._sequences
+
+    def sequence_lengths(self):
+        """
+        Lengths of the sequences, computed without per-sequence Python work.
+
+        Returns
+        -------
+        numpy.array of int
+        """
+        if self._sequence_lengths is None:
+            if self.offsets is not None:
+                self._sequence_lengths = numpy.diff(
+                    self.offsets.astype(numpy.int64))
+            else:
+                self._sequence_lengths = numpy.char.str_len(self._sequences)
+        return self._sequence_lengths
+
+    def byte_matrix(self):
+        """
+        Character codes of the sequences as an n * k matrix, where k is the
+        length of the longest sequence. See `sequences_to_byte_matrix`.
+
+        Returns
+        -------
+        numpy.array of uint8
+        """
+        if self.offsets is None:
+            return sequences_to_byte_matrix(self._sequences)
+        lengths = self.sequence_lengths()
+        width = lengths.max() if len(lengths) > 0 else 0
+        result = numpy.zeros((len(lengths), width), dtype=numpy.uint8)
+        result[numpy.arange(width) < lengths.reshape((-1, 1))] = (
+            self.byte_buffer[self.offsets[0]:self.offsets[-1]])
+        return result
+
+    def save(self, path):
+        """
+        Write the sequences and their cached encodings to a directory.
+
+        Only encodings that have already been computed (i.e. are in
+        `encoding_cache`) are written. Each is stored as a ".npy" file, which
+        `load` opens as a read-only memory map, along with a "manifest.csv"
+        giving the encoding cache key of each file.
+
+        Parameters
+        ----------
+        path : string
+            Directory to write. It and any missing parent directories will be
+            created if they do not exist.
+        """
+        if not exists(path):
+            makedirs(path)
+        numpy.save(join(path, "sequences.npy"), self.sequences)
+        rows = []
+        for (i, (cache_key, encoded)) in enumerate(
+                self.encoding_cache.items()):
+            filename = "encoding_%d.npy" % i
+            numpy.save(join(path, filename), encoded)
+            rows.append((filename, json.dumps(cache_key)))
+        pandas.DataFrame(
+            rows, columns=["filename", "cache_key_json"]).to_csv(
+            join(path, "manifest.csv"), index=False)
+
+    @classmethod
+    def load(klass, path, mmap=True):
+        """
+        Read an EncodableSequences written with `save`.
+
+        Parameters
+        ----------
+        path : string
+            Directory written by `save`
+
+        mmap : boolean
+            If True (default), the encodings are opened as read-only
+            numpy.memmap arrays instead of being read into memory.
+
+        Returns
+        -------
+        EncodableSequences
+
+        Raises
+        ------
+        ValueError
+            If the shape or dtype of an encoding does not match the sequences
+            and the encoding's cache key.
+        """
+        result = klass(numpy.load(join(path, "sequences.npy")))
+        manifest_df = pandas.read_csv(join(path, "manifest.csv"))
+        for (_, row) in manifest_df.iterrows():
+            cache_key = tuple(json.loads(row.cache_key_json))
+            encoded = numpy.load(
+                join(path, row.filename), mmap_mode="r" if mmap else None)
+            (expected_shape, expected_dtype) = result.encoding_layout(
+                cache_key)
+            if expected_shape is None:
+                expected_shape = (len(result),) + encoded.shape[1:]
+            if (len(encoded.shape) != len(expected_shape) or any(
+                    expected is not None and actual != expected
+                    for (actual, expected) in zip(
+                        encoded.shape, expected_shape))):
+                raise ValueError(
+                    "Encoding %s in %s has shape %s, expected %s" % (
+                        row.filename,
+                        path,
+                        encoded.shape,
+                        expected_shape))
+            if expected_dtype is not None and encoded.dtype != expected_dtype:
+                raise ValueError(
+                    "Encoding %s in %s has dtype %s, expected %s" % (
+                        row.filename, path, encoded.dtype, expected_dtype))
+            result.encoding_cache[cache_key] = encoded
+        return result
+
+    def encoding_layout(self, cache_key):
+        """
+        Shape and dtype of the encoding of these sequences with the given
+        `encoding_cache` key. Used by `load` to check saved encodings.
+
+        Parameters
+        ----------
+        cache_key : tuple
+
+        Returns
+        -------
+        (tuple, numpy.dtype) pair giving the shape, with None for dimensions
+        that are not known, and the dtype. Either is None if it is not known.
+        """
+        alphabet_size = len(amino_acid.AMINO_ACID_INDEX)
+        if cache_key[0] == "categorical":
+            return ((len(self), self.fixed_sequence_length), None)
+        if cache_key[0] == "one_hot":
+            return (
+                (len(self), self.fixed_sequence_length, alphabet_size),
+                numpy.dtype(cache_key[1]))
+        if cache_key[0] == "fixed_length_categorical":
+            return ((len(self), cache_key[3]), None)
+        if cache_key[0] == "fixed_length_one_hot":
+            return (
+                (len(self), cache_key[3], alphabet_size),
+                numpy.dtype(cache_key[4]))
+        return (None, None)
+
+    def take(self, indices, share_encodings=True):
+        """
+        Return an EncodableSequences of the sequences at the given indices.
+
+        Encodings of the result are taken by slicing the corresponding
+        encodings of this instance, which are computed (and cached) the first
+        time any subset needs them.
+
+        Parameters
+        ----------
+        indices : list or numpy.array of int
+
+        share_encodings : boolean
+            If False, the result is independent of this instance and encodes
+            only its own sequences. Useful for processing a large set of
+            sequences in pieces without encoding all of them at once.
+
+        Returns
+        -------
+        EncodableSequences
+        """
+        indices = numpy.asarray(indices, dtype=numpy.intp)
+        if self.offsets is not None:
+            result = self.__class__.from_buffer(
+                *gather_segments(self.byte_buffer, self.offsets, indices))
+        else:
+            result = self.__class__(self._sequences[indices])
+        if not share_encodings:
+            return result
+        if self.parent is not None:
+            result.parent = self.parent
+            result.parent_indices = self.parent_indices[indices]
+        else:
+            result.parent = self
+            result.parent_indices = indices
+        return result
+
+    def unique(self):
+        """
+        Return the distinct sequences, along with the index of each sequence
+        among them.
+
+        The distinct sequences are computed once and cached. Subsets created
+        with `take` use the distinct sequences of the instance they were taken
+        from, so each distinct sequence is encoded only once. Values computed
+        for the distinct sequences can be mapped back to the original order by
+        indexing them with the returned indices.
+
+        Returns
+        -------
+        (EncodableSequences, numpy.array of int) tuple
+        """
+        if self._unique is None:
+            if self.parent is not None:
+                (parent_unique, parent_inverse) = self.parent.unique()
+                (unique_indices, inverse) = numpy.unique(
+                    parent_inverse[self.parent_indices], return_inverse=True)
+                self._unique = (parent_unique.take(unique_indices), inverse)
+            else:
+                if self.offsets is not None:
+                    byte_matrix = self.byte_matrix()
+                    (inverse, unique_sequences) = pandas.factorize(
+                        byte_matrix.view(
+                            "S%d" % max(byte_matrix.shape[1], 1)).reshape(-1))
+                else:
+                    (inverse, unique_sequences) = pandas.factorize(
+                        self._sequences)
+                if len(unique_sequences) == len(self):
+                    unique = self
+                elif self.encoding_cache:
+                    # Share the encodings that have already been computed.
+                    (_, first_indices) = numpy.unique(
+                        inverse, return_index=True)
+                    unique = self.take(first_indices)
+                elif self.offsets is not None:
+                    unique = self.__class__.from_bytes_array(
+                        numpy.asarray(unique_sequences, dtype=bytes))
+                else:
+                    unique = self.__class__(
+                        numpy.asarray(unique_sequences, dtype=str))
+                self._unique = (unique, inverse)
+        return self._unique
+
+    @staticmethod
+    def variable_length_to_fixed_length_cache_key(
+            left_edge=4, right_edge=4, max_length=15, dtype=None):
+        """
+        Key in `encoding_cache` of the encoding given by
+        `variable_length_to_fixed_length_categorical` (if dtype is None) or
+        `variable_length_to_fixed_length_one_hot` (otherwise) with the given
+        arguments.
+
+        Returns
+        -------
+        tuple
+        """
+        if dtype is None:
+            return (
+                "fixed_length_categorical", left_edge, right_edge, max_length)
+        return (
+            "fixed_length_one_hot",
+            left_edge,
+            right_edge,
+            max_length,
+            numpy.dtype(dtype).name)
+
+    def has_encoding(self, cache_key):
+        """
+        Whether the encoding with the given cache key is available without
+        encoding any sequences: cached on this instance or, for an instance
+        created with `take`, on the instance it was taken from.
+
+        Parameters
+        ----------
+        cache_key : tuple
+
+        Returns
+        -------
+        boolean
+        """
+        return cache_key in self.encoding_cache or (
+            self.parent is not None and
+            cache_key in self.parent.encoding_cache)
+
+    def _parent_encoding(self, method_name, **kwargs):
+        """
+        Compute an encoding for an instance created with `take` by slicing the
+        encoding of the parent instance.
+        """
+        encoded = getattr(self.parent, method_name)(**kwargs)
+        return numpy.take(encoded, self.parent_indices, axis=0)
 
     def fixed_length_categorical(self):
         """
@@ -124,27 +643,42 @@ class EncodableSequences(object):
         numpy.array of integers
         """
         cache_key = ("categorical",)
+        if cache_key not in self.encoding_cache and self.parent is not None:
+            self.encoding_cache[cache_key] = self._parent_encoding(
+                "fixed_length_categorical")
+
         if cache_key not in self.encoding_cache:
             assert self.fixed_sequence_length
-            self.encoding_cache[cache_key] = index_encoding(
-                self.sequences, amino_acid.AMINO_ACID_INDEX)
+            self.encoding_cache[cache_key] = byte_matrix_index_encoding(
+                self.byte_matrix(), amino_acid.AMINO_ACID_INDEX)
         return self.encoding_cache[cache_key]
 
-    def fixed_length_one_hot(self):
+    def fixed_length_one_hot(self, dtype="int32"):
         """
         Returns a binary one-hot encoding of the  sequences, which must already
         be all the same length.
+
+        Parameters
+        ----------
+        dtype : numpy dtype, optional
+            dtype of the result, for example "uint8", "bool", or "float32"
         
         Returns
         -------
-        numpy.array of integers
+        numpy.array of the given dtype
         """
-        cache_key = ("one_hot",)
+        cache_key = ("one_hot", numpy.dtype(dtype).name)
+        if cache_key not in self.encoding_cache and self.parent is not None:
+            self.encoding_cache[cache_key] = self._parent_encoding(
+                "fixed_length_one_hot", dtype=dtype)
+
         if cache_key not in self.encoding_cache:
             assert self.fixed_sequence_length
-            encoded = self.categorical_encoding()
+            encoded = self.fixed_length_categorical()
             result = one_hot_encoding(
-                encoded, alphabet_size=len(amino_acid.AMINO_ACID_INDEX))
+                encoded,
+                alphabet_size=len(amino_acid.AMINO_ACID_INDEX),
+                dtype=dtype)
             self.encoding_cache[cache_key] = result
         return self.encoding_cache[cache_key]
 
@@ -168,27 +702,56 @@ class EncodableSequences(object):
         numpy.array of integers with shape (num sequences, max_length)
         """
 
-        cache_key = (
-            "fixed_length_categorical",
-            left_edge,
-            right_edge,
-            max_length)
+        cache_key = self.variable_length_to_fixed_length_cache_key(
+            left_edge=left_edge, right_edge=right_edge, max_length=max_length)
+
+        if cache_key not in self.encoding_cache and self.parent is not None:
+            self.encoding_cache[cache_key] = self._parent_encoding(
+                "variable_length_to_fixed_length_categorical",
+                left_edge=left_edge,
+                right_edge=right_edge,
+                max_length=max_length)
 
         if cache_key not in self.encoding_cache:
-            fixed_length_sequences = [
-                self.sequence_to_fixed_length_string(
-                    sequence,
-                    left_edge=left_edge,
-                    right_edge=right_edge,
-                    max_length=max_length)
-                for sequence in self.sequences
-            ]
-            self.encoding_cache[cache_key] = index_encoding(
-                fixed_length_sequences, amino_acid.AMINO_ACID_INDEX)
+            lengths = self.sequence_lengths()
+            min_length = left_edge + right_edge
+            if len(lengths) > 0 and lengths.min() < min_length:
+                sequence = self.sequences[numpy.argmin(lengths)]
+                raise ValueError(
+                    "Sequence '%s' (length %d) unsupported: length must be at "
+                    "least %d" % (sequence, len(sequence), min_length))
+            if len(lengths) > 0 and lengths.max() > max_length:
+                sequence = self.sequences[numpy.argmax(lengths)]
+                raise ValueError(
+                    "Sequence '%s' (length %d) unsupported: length must be at "
+                    "most %d" % (sequence, len(sequence), max_length))
+
+            # Character codes with an extra column (at index max_length)
+            # holding the unknown character, so that a single gather per
+            # peptide length builds the fixed length sequences.
+            byte_matrix = self.byte_matrix()
+            padded = numpy.empty(
+                (len(self), max_length + 1), dtype=numpy.uint8)
+            padded.fill(ord(self.unknown_character))
+            padded[:, :byte_matrix.shape[1]] = byte_matrix
+
+            gather_table = self.fixed_length_gather_table(
+                left_edge=left_edge,
+                right_edge=right_edge,
+                max_length=max_length)
+            fixed_length_byte_matrix = numpy.empty(
+                (len(self), max_length), dtype=numpy.uint8)
+            for length in numpy.unique(lengths):
+                rows = numpy.flatnonzero(lengths == length)
+                fixed_length_byte_matrix[rows] = padded[
+                    rows.reshape((-1, 1)), gather_table[length]
+                ]
+            self.encoding_cache[cache_key] = byte_matrix_index_encoding(
+                fixed_length_byte_matrix, amino_acid.AMINO_ACID_INDEX)
         return self.encoding_cache[cache_key]
 
     def variable_length_to_fixed_length_one_hot(
-            self, left_edge=4, right_edge=4, max_length=15):
+            self, left_edge=4, right_edge=4, max_length=15, dtype="int32"):
         """
         Encode variable-length sequences using a fixed-length encoding designed
         for preserving the anchor positions of class I peptides.
@@ -201,17 +764,29 @@ class EncodableSequences(object):
         left_edge : int, size of fixed-position left side
         right_edge : int, size of the fixed-position right side
         max_length : sequence length of the resulting encoding
+        dtype : numpy dtype, optional
+            dtype of the result, for example "uint8", "bool", or "float32".
+            Use the dtype consumed by the network input layer to avoid a
+            copy when predicting.
 
         Returns
         -------
         binary numpy.array with shape (num sequences, max_length, 21)
         """
 
-        cache_key = (
-            "fixed_length_one_hot",
-            left_edge,
-            right_edge,
-            max_length)
+        cache_key = self.variable_length_to_fixed_length_cache_key(
+            left_edge=left_edge,
+            right_edge=right_edge,
+            max_length=max_length,
+            dtype=dtype)
+
+        if cache_key not in self.encoding_cache and self.parent is not None:
+            self.encoding_cache[cache_key] = self._parent_encoding(
+                "variable_length_to_fixed_length_one_hot",
+                left_edge=left_edge,
+                right_edge=right_edge,
+                max_length=max_length,
+                dtype=dtype)
 
         if cache_key not in self.encoding_cache:
             encoded = self.variable_length_to_fixed_length_categorical(
@@ -219,14 +794,63 @@ class EncodableSequences(object):
                 right_edge=right_edge,
                 max_length=max_length)
             result = one_hot_encoding(
-                encoded, alphabet_size=len(amino_acid.AMINO_ACID_INDEX))
+                encoded,
+                alphabet_size=len(amino_acid.AMINO_ACID_INDEX),
+                dtype=dtype)
             assert result.shape == (
-                len(self.sequences),
+                len(self),
                 encoded.shape[1],
                 len(amino_acid.AMINO_ACID_INDEX))
             self.encoding_cache[cache_key] = result
         return self.encoding_cache[cache_key]
 
+    # Process-wide cache of position gather tables.
+    # (left_edge, right_edge, max_length) -> numpy.array
+    GATHER_TABLES_CACHE = {}
+
+    @classmethod
+    def fixed_length_gather_table(
+            klass, left_edge=4, right_edge=4, max_length=15):
+        """
+        Return a table giving, for each supported sequence length, the
+        sequence position that each position of the fixed-length encoding is
+        taken from. See `sequence_to_fixed_length_string` for the scheme.
+
+        Row L of the table is used for sequences of length L. Positions that
+        are filled in with the unknown character are given as max_length.
+        Rows for unsupported lengths are -1.
+
+        Parameters
+        ----------
+        left_edge : int
+        right_edge : int
+        max_length : int
+
+        Returns
+        -------
+        numpy.array of integers with shape (max_length + 1, max_length)
+        """
+        cache_key = (left_edge, right_edge, max_length)
+        if cache_key not in klass.GATHER_TABLES_CACHE:
+            table = numpy.empty(
+                (max_length + 1, max_length), dtype=numpy.intp)
+            table.fill(-1)
+            middle_length = max_length - left_edge - right_edge
+            for length in range(left_edge + right_edge, max_length + 1):
+                num_null = max_length - length
+                num_null_left = int(math.ceil(num_null / 2))
+                num_null_right = int(math.floor(num_null / 2))
+                num_not_null_middle = middle_length - num_null
+                table[length] = numpy.concatenate([
+                    numpy.arange(left_edge),
+                    numpy.repeat(max_length, num_null_left),
+                    numpy.arange(left_edge, left_edge + num_not_null_middle),
+                    numpy.repeat(max_length, num_null_right),
+                    numpy.arange(length - right_edge, length),
+                ])
+            klass.GATHER_TABLES_CACHE[cache_key] = table
+        return klass.GATHER_TABLES_CACHE[cache_key]
+
     @classmethod
     def sequence_to_fixed_length_string(
             klass, sequence, left_edge=4, right_edge=4, max_length=15):
@@ -0,0 +1,65 @@
+"""
+Reading protein sequences from FASTA files.
+"""
+from __future__ import (
+    print_function,
+    division,
+    absolute_import,
+)
+
+import bz2
+import collections
+import gzip
+
+
+def read_fasta(filename):
+    """
+    Read the sequences in a FASTA file. Files ending in ".gz" or ".bz2" are
+    decompressed.
+
+    Each sequence is named by the first word of its header line, e.g.
+    "sp|P04637|P53_HUMAN" for the header
+    ">sp|P04637|P53_HUMAN Cellular tumor antigen p53".
+
+    Parameters
+    ----------
+    filename : string
+
+    Returns
+    -------
+    collections.OrderedDict of string -> string giving the sequence for each
+    name, in file order
+    """
+    if filename.endswith(".gz"):
+        fd = gzip.open(filename, "rt")
+    elif filename.endswith(".bz2"):
+        fd = bz2.BZ2File(filename, "r")
+    else:
+        fd = open(filename)
+
+    result = collections.OrderedDict()
+    name = None
+    lines = []
+    with fd:
+        for line in fd:
+            if isinstance(line, bytes):
+                line = line.decode("ascii")
+            line = line.strip()
+            if line.startswith(">"):
+                if name is not None:
+                    result[name] = "".join(lines)
+                words = line[1:].split()
+                name = words[0] if words else ""
+                if name in result:
+                    raise ValueError(
+                        "Duplicate sequence name in %s: %s" % (filename, name))
+                lines = []
+            elif line and not line.startswith(";"):
+                if name is None:
+                    raise ValueError(
+                        "Expected a '>' header line in %s, found: %s" % (
+                            filename, line))
+                lines.append(line)
+    if name is not None:
+        result[name] = "".join(lines)
+    return result
@@ -0,0 +1,77 @@
+import numpy
+import pandas
+
+
+class PercentRankTransform(object):
+    """
+    Transform arbitrary values into percent ranks.
+    """
+
+    def __init__(self, n_bins=1e5):
+        self.n_bins = int(n_bins)
+        self.cdf = None
+        self.bin_edges = None
+
+    def fit(self, values, bins=None):
+        """
+        Fit the transform using the given values, which are used to
+        establish percentiles.
+
+        Parameters
+        ----------
+        values : numpy.array
+        bins : numpy.array, optional
+            Bin edges to use. If not specified, n_bins equal width bins
+            spanning the values are used.
+        """
+        assert self.cdf is None
+        assert self.bin_edges is None
+        assert len(values) > 0
+        (hist, self.bin_edges) = numpy.histogram(
+            values, bins=self.n_bins if bins is None else bins)
+        self.cdf = numpy.ones(len(hist) + 3) * numpy.nan
+        self.cdf[0] = 0.0
+        self.cdf[1] = 0.0
+        self.cdf[-1] = 100.0
+        numpy.cumsum(hist * 100.0 / numpy.sum(hist), out=self.cdf[2:-1])
+        assert not numpy.isnan(self.cdf).any()
+
+    def transform(self, values):
+        """
+        Return percent ranks (range [0, 100]) for the given values.
+        """
+        assert self.cdf is not None
+        assert self.bin_edges is not None
+        indices = numpy.searchsorted(self.bin_edges, values)
+        result = self.cdf[indices]
+        assert len(result) == len(values)
+        return result
+
+    def to_series(self):
+        """
+        Serialize the fit to a pandas.Series of percent ranks indexed by bin
+        edges. See `from_series`.
+
+        Returns
+        -------
+        pandas.Series
+        """
+        return pandas.Series(self.cdf[1:-1], index=self.bin_edges)
+
+    @staticmethod
+    def from_series(series):
+        """
+        Deserialize a PercentRankTransform from a series given by `to_series`.
+
+        Parameters
+        ----------
+        series : pandas.Series
+
+        Returns
+        -------
+        PercentRankTransform
+        """
+        result = PercentRankTransform(n_bins=len(series) - 1)
+        result.bin_edges = series.index.values.astype(float)
+        result.cdf = numpy.concatenate([[0.0], series.values, [100.0]])
+        return result
@@ -47,7 +47,21 @@ import logging
 import pandas
 
 from .downloads import get_path
-from .class1_affinity_prediction import Class1AffinityPredictor
+from .class1_affinity_prediction import (
+    Class1AffinityPredictor, Class1NeuralNetwork, PredictionCache)
+
+
+def batch_size_argument(value):
+    if value == "auto":
+        return value
+    try:
+        result = int(value)
+    except ValueError:
+        result = 0
+    if result < 1:
+        raise argparse.ArgumentTypeError(
+            "must be a positive integer or 'auto': %s" % value)
+    return result
 
 
 parser = argparse.ArgumentParser(
@@ -129,14 +143,35 @@ model_args.add_argument(
     "--models",
     metavar="DIR",
     default=None,
-    help="Directory containing models. "
-    "Default: %s" % get_path("models_class1", "models", test_exists=False))
+    help="Directory containing models. Default: the models_class1 download "
+    "(see 'mhcflurry-downloads path models_class1')")
 model_args.add_argument(
     "--include-individual-model-predictions",
     action="store_true",
     default=False,
     help="Include predictions from each model in the ensemble"
 )
+model_args.add_argument(
+    "--backend",
+    choices=Class1NeuralNetwork.BACKENDS,
+    default=None,
+    help="Run the networks with keras or with numpy only (optionally with "
+    "weights stored at reduced precision). "
+    "Default: the MHCFLURRY_BACKEND environment variable, or keras")
+model_args.add_argument(
+    "--batch-size",
+    metavar="N",
+    type=batch_size_argument,
+    default="auto",
+    help="Number of inputs to encode and run through each network at once, "
+    "or 'auto' to size batches from a memory budget. Default: '%(default)s'")
+model_args.add_argument(
+    "--prediction-cache",
+    metavar="FILE.sqlite",
+    default=None,
+    help="Cache predictions in this sqlite database, so (allele, peptide) "
+    "pairs predicted by previous runs with the same models are not "
+    "predicted again")
 
 
 def run(argv=sys.argv[1:]):
@@ -148,7 +183,15 @@ def run(argv=sys.argv[1:]):
         # we want to test_exists at this point, so the user gets a message instructing
         # them to download the models if needed.
         models_dir = get_path("models_class1", "models")
-    predictor = Class1AffinityPredictor.load(models_dir)
+    # Weights are loaded only for the alleles that are predicted.
+    predictor = Class1AffinityPredictor.load(
+        models_dir,
+        backend=args.backend,
+        batch_size=args.batch_size,
+        lazy=True,
+        prediction_cache=(
+            PredictionCache(path=args.prediction_cache)
+            if args.prediction_cache else None))
 
     # The following two are informative commands that can come 
     # if a wrapper would like to incorporate input validation 
@@ -207,6 +250,10 @@ def run(argv=sys.argv[1:]):
         alleles=df[args.allele_column].values,
         include_individual_model_predictions=args.include_individual_model_predictions,
         throw=not args.no_throw)
+    if predictor.prediction_cache is not None:
+        logging.info(
+            "Prediction cache statistics: %s" % (
+                predictor.prediction_cache.statistics()))
 
     for col in predictions.columns:
         if col not in ("allele", "peptide"):
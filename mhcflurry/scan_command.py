@@ -0,0 +1,155 @@
+'''
+Scan protein sequences for MHC class I binders.
+
+Every peptide of the given lengths (default: 8-15) at every position of the
+sequences in the given FASTA files is predicted, and the strongest binders for
+each allele are written as a CSV file.
+
+Examples:
+
+Write the 100 strongest binders to each allele:
+
+    mhcflurry-scan PROTEINS.fasta --alleles HLA-A0201 HLA-B0702 \\
+        --top-k 100 --out RESULT.csv
+
+Write all 9mers predicted to bind with affinity 500 nM or stronger:
+
+    mhcflurry-scan PROTEINS.fasta --alleles HLA-A0201 \\
+        --peptide-lengths 9 --max-affinity 500
+
+If --out is not specified, results are written to standard out.
+'''
+from __future__ import (
+    print_function,
+    division,
+    absolute_import,
+)
+import sys
+import argparse
+import collections
+import logging
+
+from .downloads import get_path
+from .fasta import read_fasta
+from .class1_affinity_prediction import (
+    Class1AffinityPredictor, Class1NeuralNetwork)
+
+
+parser = argparse.ArgumentParser(
+    description=__doc__,
+    formatter_class=argparse.RawDescriptionHelpFormatter)
+
+input_args = parser.add_argument_group(title="Required input arguments")
+input_args.add_argument(
+    "fasta",
+    metavar="INPUT.fasta",
+    nargs="+",
+    help="FASTA files of protein sequences (may be compressed with gzip or "
+    "bzip2)")
+input_args.add_argument(
+    "--alleles",
+    metavar="ALLELE",
+    nargs="+",
+    required=True,
+    help="Alleles to predict")
+
+selection_args = parser.add_argument_group(
+    title="Binders to output (at least one is required)")
+selection_args.add_argument(
+    "--top-k",
+    metavar="N",
+    type=int,
+    default=None,
+    help="Output the N strongest binders for each allele")
+selection_args.add_argument(
+    "--max-affinity",
+    metavar="NM",
+    type=float,
+    default=None,
+    help="Output only binders with predicted affinity at most this many nM")
+
+input_mod_args = parser.add_argument_group(title="Optional input modifiers")
+input_mod_args.add_argument(
+    "--peptide-lengths",
+    metavar="L",
+    type=int,
+    nargs="+",
+    default=None,
+    help="Peptide lengths to scan. Default: the supported lengths from 8 "
+    "to 15")
+
+output_args = parser.add_argument_group(title="Optional output modifiers")
+output_args.add_argument(
+    "--out",
+    metavar="OUTPUT.csv",
+    help="Output CSV")
+output_args.add_argument(
+    "--prediction-column-prefix",
+    metavar="NAME",
+    default="mhcflurry_",
+    help="Prefix for output column names. Default: '%(default)s'")
+
+model_args = parser.add_argument_group(title="Optional model settings")
+model_args.add_argument(
+    "--models",
+    metavar="DIR",
+    default=None,
+    help="Directory containing models. Default: the models_class1 download "
+    "(see 'mhcflurry-downloads path models_class1')")
+model_args.add_argument(
+    "--backend",
+    choices=Class1NeuralNetwork.BACKENDS,
+    default=None,
+    help="Run the networks with keras or with numpy only (optionally with "
+    "weights stored at reduced precision). "
+    "Default: the MHCFLURRY_BACKEND environment variable, or keras")
+model_args.add_argument(
+    "--chunk-size",
+    metavar="N",
+    type=int,
+    default=100000,
+    help="Number of peptides to predict at once. Default: %(default)s")
+
+
+def run(argv=sys.argv[1:]):
+    args = parser.parse_args(argv)
+
+    if args.top_k is None and args.max_affinity is None:
+        parser.error("at least one of --top-k and --max-affinity is required")
+    if args.top_k is not None and args.top_k < 1:
+        parser.error("--top-k must be at least 1")
+
+    models_dir = args.models
+    if models_dir is None:
+        models_dir = get_path("models_class1", "models")
+    # Weights are loaded only for the alleles that are predicted.
+    predictor = Class1AffinityPredictor.load(
+        models_dir, backend=args.backend, lazy=True)
+
+    sequences = collections.OrderedDict()
+    for filename in args.fasta:
+        for (name, sequence) in read_fasta(filename).items():
+            if name in sequences:
+                raise ValueError("Duplicate sequence name: %s" % name)
+            sequences[name] = sequence
+    logging.info(
+        "Read %d sequences from %d files" % (len(sequences), len(args.fasta)))
+
+    result = predictor.scan_proteins(
+        sequences,
+        alleles=args.alleles,
+        peptide_lengths=args.peptide_lengths,
+        top_k=args.top_k,
+        max_affinity=args.max_affinity,
+        chunk_size=args.chunk_size)
+    result.columns = [
+        col if col in ("sequence_name", "offset", "peptide", "allele")
+        else args.prediction_column_prefix + col
+        for col in result.columns
+    ]
+
+    if args.out:
+        result.to_csv(args.out, index=False)
+        print("Wrote: %s" % args.out)
+    else:
+        result.to_csv(sys.stdout, index=False)
@@ -75,9 +75,19 @@ if __name__ == '__main__':
             'console_scripts': [
                 'mhcflurry-downloads = mhcflurry.downloads_command:run',
                 'mhcflurry-predict = mhcflurry.predict_command:run',
+                'mhcflurry-scan = mhcflurry.scan_command:run',
                 'mhcflurry-class1-train-allele-specific-models = '
                     'mhcflurry.class1_affinity_prediction.'
                     'train_allele_specific_models_command:run',
+                'mhcflurry-class1-precision-report = '
+                    'mhcflurry.class1_affinity_prediction.'
+                    'precision_report_command:run',
+                'mhcflurry-class1-convert-weights = '
+                    'mhcflurry.class1_affinity_prediction.'
+                    'convert_weights_command:run',
+                'mhcflurry-class1-calibrate-percentile-ranks = '
+                    'mhcflurry.class1_affinity_prediction.'
+                    'calibrate_percentile_ranks_command:run',
             ]
         },
         classifiers=[
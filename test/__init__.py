@@ -3,6 +3,9 @@ Utility functions for tests.
 '''
 
 import os
+from contextlib import contextmanager
+
+from mhcflurry import encodable_sequences
 
 
 def data_path(name):
@@ -11,3 +14,25 @@ def data_path(name):
     The name specified should be relative to test/data.
     '''
     return os.path.join(os.path.dirname(__file__), "data", name)
+
+
+@contextmanager
+def count_encoded_rows():
+    '''
+    Context manager yielding a list that receives the number of sequences
+    in each call to encodable_sequences.byte_matrix_index_encoding, i.e.
+    each time sequences are encoded, within the block.
+    '''
+    counts = []
+    original = encodable_sequences.byte_matrix_index_encoding
+
+    def counting_byte_matrix_index_encoding(byte_matrix, letter_to_index_dict):
+        counts.append(len(byte_matrix))
+        return original(byte_matrix, letter_to_index_dict)
+
+    encodable_sequences.byte_matrix_index_encoding = (
+        counting_byte_matrix_index_encoding)
+    try:
+        yield counts
+    finally:
+        encodable_sequences.byte_matrix_index_encoding = original
@@ -0,0 +1,68 @@
+import tempfile
+import shutil
+from os.path import join
+
+from mhcflurry import allele_names
+from nose.tools import eq_, assert_raises
+from numpy.testing import assert_equal
+
+
+def test_normalize_allele_names():
+    assert_equal(
+        allele_names.normalize_allele_names(
+            ["HLA-A0201", "A*02:01", "HLA-A0201", "HLA-B*27:05"]),
+        ["HLA-A*02:01", "HLA-A*02:01", "HLA-A*02:01", "HLA-B*27:05"])
+    assert_equal(
+        allele_names.normalize_allele_names(
+            ["HLA-A0201", "not an allele"], default="UNKNOWN"),
+        ["HLA-A*02:01", "UNKNOWN"])
+    assert_raises(
+        Exception,
+        allele_names.normalize_allele_names,
+        ["HLA-A0201", "not an allele"])
+    eq_(len(allele_names.normalize_allele_names([])), 0)
+
+    # Missing names.
+    assert_raises(
+        ValueError,
+        allele_names.normalize_allele_names,
+        ["HLA-A0201", None])
+    assert_raises(
+        ValueError,
+        allele_names.normalize_allele_names,
+        ["HLA-A0201", float("nan")])
+    assert_equal(
+        allele_names.normalize_allele_names(
+            ["HLA-A0201", None], default="UNKNOWN"),
+        ["HLA-A*02:01", "UNKNOWN"])
+
+
+def test_normalize_allele_name_errors():
+    errors = []
+    for _ in range(2):
+        try:
+            allele_names.normalize_allele_name("not an allele")
+        except Exception as e:
+            errors.append(e)
+    eq_(len(errors), 2)
+    assert errors[0] is not errors[1]
+    eq_(type(errors[0]), type(errors[1]))
+    eq_(str(errors[0]), str(errors[1]))
+
+
+def test_allele_aliases():
+    aliases = allele_names.allele_aliases("HLA-A*02:01")
+    assert "HLA-A*02:01" in aliases
+    assert "A0201" in aliases
+    for alias in aliases:
+        eq_(allele_names.normalize_allele_name(alias), "HLA-A*02:01")
+
+    tempdir = tempfile.mkdtemp()
+    try:
+        path = join(tempdir, "allele_aliases.csv")
+        allele_names.write_allele_aliases(path, ["HLA-A*02:01", "H-2-Kb"])
+        loaded = allele_names.read_allele_aliases(path)
+        eq_(loaded["A0201"], "HLA-A*02:01")
+        eq_(loaded["H-2-Kb"], "H-2-Kb")
+    finally:
+        shutil.rmtree(tempdir)
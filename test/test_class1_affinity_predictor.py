@@ -1,8 +1,11 @@
+import collections
 import tempfile
+import threading
 import shutil
 import logging
 import warnings
 import traceback
+from os.path import join
 import sys
 
 import numpy
@@ -10,12 +13,18 @@ import pandas
 numpy.random.seed(0)
 
 from mhcflurry import Class1AffinityPredictor
+from mhcflurry.class1_affinity_prediction import (
+    Class1NeuralNetwork, PredictionCache)
+from mhcflurry.common import random_peptides
+from mhcflurry.encodable_sequences import EncodableSequences
 
 from nose.tools import eq_, assert_raises
 from numpy import testing
 
 from mhcflurry.downloads import get_path
 
+from . import count_encoded_rows
+
 DOWNLOADED_PREDICTOR = Class1AffinityPredictor.load()
 
 logging.basicConfig(level=logging.DEBUG)
@@ -217,3 +226,442 @@ def test_class1_affinity_predictor_a0205_memorize_training_data():
     assert not numpy.isnan(ic50_pred[1])
     assert numpy.isnan(ic50_pred[2])
 
+
+
+def test_predict_multiple_alleles():
+    alleles = ["HLA-A*02:01", "HLA-A*01:01", "HLA-B*07:02"]
+    peptides = random_peptides(50, length=9) + random_peptides(50, length=11)
+    df = pandas.DataFrame({
+        "allele": numpy.random.choice(alleles, len(peptides)),
+        "peptide": peptides,
+    })
+    encodable_peptides = EncodableSequences.create(df.peptide.values)
+    df["prediction"] = DOWNLOADED_PREDICTOR.predict(
+        encodable_peptides, alleles=df.allele.values)
+
+    # All alleles share a single peptide encoding.
+    eq_(len(encodable_peptides.encoding_cache), 2)
+
+    for (allele, sub_df) in df.groupby("allele"):
+        testing.assert_allclose(
+            sub_df.prediction.values,
+            DOWNLOADED_PREDICTOR.predict(
+                sub_df.peptide.values, allele=allele),
+            rtol=1e-5)
+
+
+def test_predict_iter():
+    alleles = ["HLA-A*02:01", "HLA-A*01:01"]
+    peptides = random_peptides(100, length=9)
+    peptide_alleles = numpy.random.choice(alleles, len(peptides))
+    expected = DOWNLOADED_PREDICTOR.predict_to_dataframe(
+        peptides, alleles=peptide_alleles)
+
+    chunks = list(DOWNLOADED_PREDICTOR.predict_iter(
+        iter(peptides), alleles=iter(peptide_alleles), chunk_size=30))
+    eq_([len(chunk) for chunk in chunks], [30, 30, 30, 10])
+    pandas.testing.assert_frame_equal(pandas.concat(chunks), expected)
+
+    # At most one chunk of peptides is encoded at a time.
+    with count_encoded_rows() as counts:
+        for chunk in DOWNLOADED_PREDICTOR.predict_iter(
+                iter(peptides), alleles=iter(peptide_alleles), chunk_size=30):
+            pass
+    assert counts
+    assert max(counts) <= 30, counts
+
+    # Individual model columns are the same in every chunk, even when a
+    # chunk has no peptides of the right length for some models.
+    peptides = random_peptides(30, length=9) + random_peptides(30, length=20)
+    chunks = list(DOWNLOADED_PREDICTOR.predict_iter(
+        iter(peptides),
+        allele="HLA-A*02:01",
+        chunk_size=30,
+        throw=False,
+        include_individual_model_predictions=True))
+    eq_(list(chunks[0].columns), list(chunks[1].columns))
+    assert chunks[1].prediction.isnull().all()
+    assert not chunks[0].prediction.isnull().any()
+
+    # Inputs of different lengths.
+    for (num_peptides, num_alleles) in [(100, 99), (99, 100), (90, 100)]:
+        assert_raises(
+            ValueError,
+            list,
+            DOWNLOADED_PREDICTOR.predict_iter(
+                iter(peptides[:num_peptides]),
+                alleles=iter(peptide_alleles[:num_alleles]),
+                chunk_size=30))
+
+
+def test_predict_numpy_backend():
+    alleles = ["HLA-A*02:01", "HLA-A*01:01", "HLA-B*07:02"]
+    peptides = random_peptides(100, length=9) + random_peptides(20, length=10)
+    peptide_alleles = numpy.random.choice(alleles, len(peptides))
+    numpy_predictor = Class1AffinityPredictor.load(backend="numpy")
+    result = numpy_predictor.predict_to_dataframe(
+        peptides,
+        alleles=peptide_alleles,
+        include_individual_model_predictions=True)
+    expected = DOWNLOADED_PREDICTOR.predict_to_dataframe(
+        peptides,
+        alleles=peptide_alleles,
+        include_individual_model_predictions=True)
+    eq_(list(result.columns), list(expected.columns))
+    eq_(list(result.peptide), list(expected.peptide))
+    eq_(list(result.allele), list(expected.allele))
+    for column in expected.columns[2:]:
+        testing.assert_allclose(
+            result[column].values, expected[column].values, rtol=1e-4)
+
+
+def test_concurrent_predict():
+    alleles = ["HLA-A*02:01", "HLA-A*01:01", "HLA-B*07:02", "HLA-B*27:05"]
+    peptides = random_peptides(200, length=9)
+    expected = dict(
+        (allele, DOWNLOADED_PREDICTOR.predict(peptides, allele=allele))
+        for allele in alleles)
+    results = collections.defaultdict(list)
+
+    def work(allele):
+        for _ in range(5):
+            results[allele].append(
+                DOWNLOADED_PREDICTOR.predict(peptides, allele=allele))
+
+    threads = [
+        threading.Thread(target=work, args=(allele,))
+        for allele in alleles * 2
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    for allele in alleles:
+        eq_(len(results[allele]), 10)
+        for result in results[allele]:
+            testing.assert_allclose(result, expected[allele], rtol=1e-5)
+
+
+def test_predict_reduced_precision():
+    peptides = random_peptides(200, length=9)
+    predictor = Class1AffinityPredictor.load(backend="numpy")
+    full_precision = predictor.predict(peptides, allele="HLA-A*02:01")
+    for (backend, max_log10_deviation) in [
+            ("numpy-float16", 0.05), ("numpy-int8", 0.2)]:
+        predictor.backend = backend
+        deviation = numpy.abs(numpy.log10(
+            predictor.predict(peptides, allele="HLA-A*02:01") /
+            full_precision))
+        assert deviation.max() < max_log10_deviation, (backend, deviation)
+
+
+def test_lazy_load():
+    peptides = random_peptides(100, length=9)
+    expected = DOWNLOADED_PREDICTOR.predict(peptides, allele="HLA-A*02:01")
+
+    predictor = Class1AffinityPredictor.load(lazy=True, max_loaded_alleles=1)
+    models = predictor.allele_to_allele_specific_models
+    assert not any(
+        model.weights_loaded
+        for allele_models in models.values()
+        for model in allele_models)
+
+    testing.assert_allclose(
+        predictor.predict(peptides, allele="HLA-A*02:01"), expected)
+    assert all(model.weights_loaded for model in models["HLA-A*02:01"])
+    assert not any(model.weights_loaded for model in models["HLA-B*27:05"])
+
+    # Weights for the least recently used allele are released, along with
+    # pooled keras models holding them.
+    released_weights = [
+        model.network_weights for model in models["HLA-A*02:01"]
+    ]
+    predictor.predict(peptides, allele="HLA-B*27:05")
+    assert all(model.weights_loaded for model in models["HLA-B*27:05"])
+    assert not any(model.weights_loaded for model in models["HLA-A*02:01"])
+    assert not any(
+        weights is released
+        for idle in Class1NeuralNetwork.KERAS_MODELS_POOL.values()
+        for (_, weights) in idle
+        for released in released_weights)
+
+    # Weights in use are released when no longer in use.
+    model = models["HLA-B*27:05"][0]
+    with model.pinned_weights():
+        predictor.predict(peptides, allele="HLA-A*02:01")
+        assert model.weights_loaded
+    assert not model.weights_loaded
+
+
+def test_cross_allele_networks_cache():
+    predictor = Class1AffinityPredictor.load(backend="numpy")
+    alleles = ["HLA-A*02:01", "HLA-B*27:05"]
+    networks = predictor._cross_allele_networks(alleles=alleles)
+
+    # Stacks including the requested alleles are reused.
+    assert predictor._cross_allele_networks(alleles=alleles[:1]) is networks
+    assert predictor._cross_allele_networks(alleles=alleles[1:]) is networks
+    eq_(len(predictor._cross_allele_networks_cache), 1)
+
+
+def test_weights_archive():
+    peptides = random_peptides(100, length=9)
+    predictor = Class1AffinityPredictor(
+        allele_to_allele_specific_models={
+            "HLA-A*02:01":
+                DOWNLOADED_PREDICTOR.allele_to_allele_specific_models[
+                    "HLA-A*02:01"]
+        })
+    expected = predictor.predict(peptides, allele="HLA-A*02:01")
+
+    models_dir = tempfile.mkdtemp("_models")
+    predictor.save(models_dir, weights_format="archive")
+    for lazy in [False, True]:
+        predictor2 = Class1AffinityPredictor.load(models_dir, lazy=lazy)
+        testing.assert_allclose(
+            predictor2.predict(peptides, allele="HLA-A*02:01"),
+            expected,
+            rtol=1e-5)
+
+    predictor.save(models_dir, weights_format="archive-float16")
+    predictor3 = Class1AffinityPredictor.load(models_dir)
+    deviation = numpy.abs(numpy.log10(
+        predictor3.predict(peptides, allele="HLA-A*02:01") / expected))
+    assert deviation.max() < 0.05, deviation
+    shutil.rmtree(models_dir)
+
+
+def test_predict_aggregation():
+    peptides = random_peptides(100, length=9) + ["A" * 20]
+    alleles = ["HLA-A*02:01", "HLA-B*27:05"] * 50 + ["HLA-A*02:01"]
+    df = DOWNLOADED_PREDICTOR.predict_to_dataframe(
+        peptides,
+        alleles=alleles,
+        throw=False,
+        include_individual_model_predictions=True)
+    logs = numpy.log(df[[c for c in df.columns if c.startswith("model_")]])
+    testing.assert_allclose(df.prediction, numpy.exp(logs.mean(1)))
+    testing.assert_allclose(
+        df.prediction_low, numpy.exp(logs.quantile(0.05, axis=1)))
+    testing.assert_allclose(
+        df.prediction_high, numpy.exp(logs.quantile(0.95, axis=1)))
+    assert numpy.isnan(df.prediction.values[-1])
+    testing.assert_allclose(
+        DOWNLOADED_PREDICTOR.predict(peptides, alleles=alleles, throw=False),
+        df.prediction.values)
+
+
+def test_prediction_cache():
+    peptides = random_peptides(100, length=9)
+    alleles = ["HLA-A*02:01", "HLA-B*27:05"] * 50
+    expected = DOWNLOADED_PREDICTOR.predict_to_dataframe(
+        peptides, alleles=alleles, include_individual_model_predictions=True)
+
+    models_dir = tempfile.mkdtemp("_models")
+    cache_path = join(models_dir, "cache.sqlite")
+    predictor = Class1AffinityPredictor.load(
+        prediction_cache=PredictionCache(max_entries=10, path=cache_path))
+    for _ in range(2):
+        pandas.testing.assert_frame_equal(
+            predictor.predict_to_dataframe(
+                peptides,
+                alleles=alleles,
+                include_individual_model_predictions=True),
+            expected)
+    statistics = predictor.prediction_cache.statistics()
+    # Entries beyond max_entries are evicted down to the low water mark.
+    eq_(statistics["misses"], 100)
+    eq_(statistics["memory_hits"], 9)
+    eq_(statistics["disk_hits"], 91)
+
+    # Entries for other models are not used.
+    predictor._fingerprint = "other"
+    predictor.predict(peptides, alleles=alleles)
+    eq_(predictor.prediction_cache.statistics()["misses"], 200)
+    shutil.rmtree(models_dir)
+
+
+def test_fingerprint():
+    models = DOWNLOADED_PREDICTOR.allele_to_allele_specific_models[
+        "HLA-A*02:01"]
+    predictor = Class1AffinityPredictor(
+        allele_to_allele_specific_models={"HLA-A*02:01": models})
+
+    # Models with the same configuration but different weights.
+    model = Class1NeuralNetwork.from_config(
+        models[0].get_config(),
+        weights=[array * 2 for array in models[0].get_weights()])
+    predictor2 = Class1AffinityPredictor(
+        allele_to_allele_specific_models={
+            "HLA-A*02:01": [model] + models[1:]
+        })
+    assert predictor2.fingerprint() != predictor.fingerprint()
+
+    # The same models saved at different precisions.
+    models_dir = tempfile.mkdtemp("_models")
+    fingerprints = set()
+    for weights_format in ["npz", "archive", "archive-float16"]:
+        predictor.save(models_dir, weights_format=weights_format)
+        fingerprints.add(
+            Class1AffinityPredictor.load(models_dir, lazy=True).fingerprint())
+    eq_(len(fingerprints), 3)
+
+    # Copies of a models directory have the same fingerprint.
+    copy_parent_dir = tempfile.mkdtemp("_models")
+    copy_dir = join(copy_parent_dir, "copy")
+    shutil.copytree(models_dir, copy_dir)
+    eq_(
+        Class1AffinityPredictor.load(copy_dir, lazy=True).fingerprint(),
+        Class1AffinityPredictor.load(models_dir, lazy=True).fingerprint())
+    shutil.rmtree(models_dir)
+    shutil.rmtree(copy_parent_dir)
+
+
+def test_predict_matrix():
+    peptides = random_peptides(50, length=9) + random_peptides(50, length=10)
+    alleles = ["HLA-A*02:01", "HLA-B*27:05", "HLA-A*01:01"]
+    (predictions, low, high) = DOWNLOADED_PREDICTOR.predict_matrix(
+        peptides, alleles, include_interval=True)
+    eq_(predictions.shape, (100, 3))
+    eq_(predictions.dtype, numpy.float32)
+    for (i, allele) in enumerate(alleles):
+        df = DOWNLOADED_PREDICTOR.predict_to_dataframe(peptides, allele=allele)
+        testing.assert_allclose(predictions[:, i], df.prediction, rtol=1e-6)
+        testing.assert_allclose(low[:, i], df.prediction_low, rtol=1e-6)
+        testing.assert_allclose(high[:, i], df.prediction_high, rtol=1e-6)
+
+    predictions = DOWNLOADED_PREDICTOR.predict_matrix(
+        ["SIINFEKL", "A" * 20], alleles, throw=False)
+    assert not numpy.isnan(predictions[0]).any()
+    assert numpy.isnan(predictions[1]).all()
+
+    # All alleles are predicted together, here with the numpy backend.
+    numpy_predictor = Class1AffinityPredictor.load(backend="numpy")
+    calls = []
+    original = numpy_predictor._predict_log_affinities
+
+    def counting_predict_log_affinities(*args, **kwargs):
+        calls.append(1)
+        return original(*args, **kwargs)
+
+    numpy_predictor._predict_log_affinities = counting_predict_log_affinities
+    testing.assert_allclose(
+        numpy_predictor.predict_matrix(peptides, alleles),
+        DOWNLOADED_PREDICTOR.predict_matrix(peptides, alleles),
+        rtol=1e-4)
+    eq_(len(calls), 1)
+
+
+def test_percentile_ranks():
+    predictor = Class1AffinityPredictor(
+        allele_to_allele_specific_models={
+            "HLA-A*02:01":
+                DOWNLOADED_PREDICTOR.allele_to_allele_specific_models[
+                    "HLA-A*02:01"]
+        })
+    predictor.calibrate_percentile_ranks(num_peptides_per_length=1000)
+    eq_(list(predictor.allele_to_percent_rank_transform), ["HLA-A*02:01"])
+
+    # Stronger binders have lower percentile ranks.
+    ranks = predictor.percentile_ranks(
+        [1.0, 100.0, 1000.0, 1e6], allele="HLA-A*02:01")
+    testing.assert_almost_equal(ranks[0], 0.0)
+    testing.assert_almost_equal(ranks[-1], 100.0)
+    assert (numpy.diff(ranks) >= 0).all(), ranks
+
+    peptides = random_peptides(100, length=9)
+    df = predictor.predict_to_dataframe(peptides, allele="HLA-A*02:01")
+    testing.assert_allclose(
+        df.prediction_percentile,
+        predictor.percentile_ranks(df.prediction, allele="HLA-A*02:01"))
+
+    models_dir = tempfile.mkdtemp("_models")
+    predictor.save(models_dir)
+    predictor2 = Class1AffinityPredictor.load(models_dir)
+    df2 = predictor2.predict_to_dataframe(peptides, allele="HLA-A0201")
+    testing.assert_allclose(
+        df2.prediction_percentile, df.prediction_percentile)
+
+    with assert_raises(ValueError):
+        predictor2.percentile_ranks([100.0], allele="HLA-B*27:05")
+    assert numpy.isnan(predictor2.percentile_ranks(
+        [100.0], allele="HLA-B*27:05", throw=False)).all()
+    shutil.rmtree(models_dir)
+
+
+def test_scan_proteins():
+    sequences = collections.OrderedDict([
+        ("protein1", random_peptides(1, length=30)[0]),
+        ("protein2", "MKU*" + random_peptides(1, length=20)[0]),
+        ("protein3", "SIINFEK"),
+    ])
+    alleles = ["HLA-A*02:01", "HLA-B*27:05"]
+
+    # All peptides, with non amino acid characters replaced by X.
+    rows = []
+    for (name, sequence) in sequences.items():
+        sequence = sequence.replace("U", "X").replace("*", "X")
+        for length in [8, 9, 10]:
+            for offset in range(len(sequence) - length + 1):
+                rows.append(
+                    (name, offset, sequence[offset:offset + length]))
+    all_peptides = pandas.DataFrame(
+        rows, columns=["sequence_name", "offset", "peptide"])
+
+    for (top_k, max_affinity) in [(5, None), (None, 1000.0), (5, 1000.0)]:
+        result = DOWNLOADED_PREDICTOR.scan_proteins(
+            sequences,
+            alleles,
+            peptide_lengths=[8, 9, 10],
+            top_k=top_k,
+            max_affinity=max_affinity,
+            chunk_size=7)
+        for allele in alleles:
+            expected = all_peptides.copy()
+            expected["prediction"] = DOWNLOADED_PREDICTOR.predict(
+                expected.peptide.values, allele=allele)
+            if max_affinity is not None:
+                expected = expected.ix[expected.prediction <= max_affinity]
+            expected = expected.sort_values("prediction")
+            if top_k is not None:
+                expected = expected.head(top_k)
+            sub_result = result.ix[result.allele == allele]
+            eq_(
+                list(zip(sub_result.sequence_name, sub_result.offset)),
+                list(zip(expected.sequence_name, expected.offset)))
+            eq_(list(sub_result.peptide), list(expected.peptide))
+            testing.assert_allclose(
+                sub_result.prediction, expected.prediction, rtol=1e-5)
+
+    with assert_raises(ValueError):
+        DOWNLOADED_PREDICTOR.scan_proteins(sequences, alleles)
+    for top_k in [0, -1]:
+        with assert_raises(ValueError):
+            DOWNLOADED_PREDICTOR.scan_proteins(
+                sequences, alleles, top_k=top_k)
+
+    # Each chunk of peptides is encoded once, for all alleles.
+    with count_encoded_rows() as counts:
+        DOWNLOADED_PREDICTOR.scan_proteins(
+            sequences,
+            alleles,
+            peptide_lengths=[8, 9, 10],
+            top_k=5,
+            chunk_size=7)
+    eq_(len(counts), -(-len(all_peptides) // 7))
+
+    # Non-ASCII residues, in text or bytes, are scanned as X.
+    for sequence in [u"SIINFEKL\u00c4SIINFEKL", b"SIINFEKL\xc4SIINFEKL"]:
+        result = DOWNLOADED_PREDICTOR.scan_proteins(
+            [sequence], alleles, peptide_lengths=[9], top_k=100)
+        eq_(len(result), 9 * len(alleles))
+        eq_(
+            set(result.peptide),
+            set("SIINFEKLXSIINFEKL"[i:i + 9] for i in range(9)))
+
+    result = DOWNLOADED_PREDICTOR.scan_proteins(sequences, [], top_k=5)
+    eq_(len(result), 0)
+    eq_(
+        list(result.columns),
+        list(DOWNLOADED_PREDICTOR.scan_proteins(
+            sequences, alleles, top_k=5).columns))
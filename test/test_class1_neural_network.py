@@ -3,12 +3,16 @@ import pandas
 numpy.random.seed(0)
 
 from mhcflurry import Class1NeuralNetwork
+from mhcflurry.common import random_peptides
+from mhcflurry.encodable_sequences import EncodableSequences
 
 from nose.tools import eq_
 from numpy import testing
 
 from mhcflurry.downloads import get_path
 
+from . import count_encoded_rows
+
 
 def test_class1_affinity_predictor_a0205_training_accuracy():
     # Memorize the dataset.
@@ -80,3 +84,132 @@ def test_class1_affinity_predictor_a0205_training_accuracy():
     predictor2.fit(df.peptide.values, df.measurement_value.values)
     eq_(predictor.network().to_json(), predictor2.network().to_json())
 
+
+
+def test_numpy_backend():
+    peptides = random_peptides(500, length=9) + random_peptides(500, length=11)
+    affinities = numpy.random.uniform(10, 50000, len(peptides))
+    for hyperparameters in [
+            dict(max_epochs=2),
+            dict(
+                max_epochs=2,
+                use_embedding=True,
+                batch_normalization=True,
+                dropout_probability=0.5,
+                layer_sizes=[16, 8])]:
+        predictor = Class1NeuralNetwork(**hyperparameters)
+        predictor.fit(peptides, affinities, verbose=0)
+        testing.assert_allclose(
+            predictor.predict(peptides, backend="numpy"),
+            predictor.predict(peptides, backend="keras"),
+            rtol=1e-4)
+
+
+def test_predict_ensemble():
+    peptides = random_peptides(500, length=9)
+    affinities = numpy.random.uniform(10, 50000, len(peptides))
+    models = []
+    for _ in range(3):
+        model = Class1NeuralNetwork(max_epochs=2)
+        model.fit(peptides, affinities, verbose=0)
+        models.append(model)
+    expected = numpy.array([
+        model.predict(peptides, backend="keras") for model in models
+    ]).T
+    for backend in ["keras", "numpy"]:
+        testing.assert_allclose(
+            Class1NeuralNetwork.predict_ensemble(
+                models, peptides, backend=backend),
+            expected,
+            rtol=1e-4)
+
+
+def test_predict_batch_size():
+    peptides = random_peptides(500, length=9) + random_peptides(100, length=10)
+    affinities = numpy.random.uniform(10, 50000, len(peptides))
+    predictor = Class1NeuralNetwork(max_epochs=2)
+    predictor.fit(peptides, affinities, verbose=0)
+    assert predictor.prediction_batch_size() > 1000
+    expected = predictor.predict(peptides)
+    for batch_size in [1, 33, 1000]:
+        for backend in ["keras", "numpy"]:
+            testing.assert_allclose(
+                predictor.predict(
+                    peptides, backend=backend, batch_size=batch_size),
+                expected,
+                rtol=1e-4)
+
+
+def test_distinct_inputs():
+    peptides = random_peptides(50, length=9) * 20
+    pseudosequences = ["YFAMYQENVA", "YYAMYQENVA"] * 500
+    model = Class1NeuralNetwork()
+    (unique_peptides, unique_pseudosequences, inverse) = (
+        model.distinct_inputs(peptides, pseudosequences))
+    eq_(
+        list(zip(
+            unique_peptides.sequences[inverse],
+            unique_pseudosequences.sequences[inverse])),
+        list(zip(peptides, pseudosequences)))
+
+    # Only the distinct peptides and pseudosequences are encoded.
+    with count_encoded_rows() as counts:
+        model.peptides_to_network_input(unique_peptides)
+        model.pseudosequence_to_network_input(unique_pseudosequences)
+    eq_(sum(counts), len(set(peptides)) + 2)
+
+
+def test_predict_batches_encode_once():
+    peptides = random_peptides(500, length=9) + random_peptides(100, length=10)
+    affinities = numpy.random.uniform(10, 50000, len(peptides))
+    models = []
+    for _ in range(2):
+        model = Class1NeuralNetwork(max_epochs=2)
+        model.fit(peptides, affinities, verbose=0)
+        models.append(model)
+
+    # Inputs larger than the batch size are encoded once, and the encoding
+    # is shared by all batches and models.
+    for backend in ["keras", "numpy"]:
+        encodable_peptides = EncodableSequences.create(peptides)
+        with count_encoded_rows() as counts:
+            Class1NeuralNetwork.predict_ensemble(
+                models, encodable_peptides, backend=backend, batch_size=33)
+            models[0].predict(
+                encodable_peptides, backend=backend, batch_size=33)
+        eq_(sum(counts), len(set(peptides)))
+
+    # Unless the encoding would exceed the memory budget.
+    original_budget = Class1NeuralNetwork.PREDICTION_MEMORY_BUDGET_BYTES
+    Class1NeuralNetwork.PREDICTION_MEMORY_BUDGET_BYTES = 1000
+    try:
+        with count_encoded_rows() as counts:
+            predictions = models[0].predict(peptides, batch_size=33)
+        eq_(max(counts), 33)
+    finally:
+        Class1NeuralNetwork.PREDICTION_MEMORY_BUDGET_BYTES = original_budget
+    testing.assert_allclose(predictions, models[0].predict(peptides), rtol=1e-4)
+
+
+def test_keras_models_pool():
+    peptides = random_peptides(100, length=9)
+    affinities = numpy.random.uniform(10, 50000, len(peptides))
+    trained = Class1NeuralNetwork(max_epochs=1)
+    trained.fit(peptides, affinities, verbose=0)
+    models = [
+        Class1NeuralNetwork.from_config(
+            trained.get_config(),
+            weights=[w + i for w in trained.get_weights()])
+        for i in range(3)
+    ]
+    for model in models:
+        model.predict(peptides)
+    stats_before = Class1NeuralNetwork.keras_models_pool_stats()
+    for _ in range(2):
+        for model in models:
+            model.predict(peptides)
+    stats_after = Class1NeuralNetwork.keras_models_pool_stats()
+
+    # All three sets of weights stay resident.
+    eq_(stats_after["hits"] - stats_before["hits"], 6)
+    eq_(stats_after["misses"], stats_before["misses"])
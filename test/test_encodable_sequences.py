@@ -1,5 +1,13 @@
+import os
+import shutil
+import tempfile
+
+import numpy
+
 from mhcflurry import encodable_sequences
-from nose.tools import eq_
+from mhcflurry.amino_acid import AMINO_ACID_INDEX
+from mhcflurry.common import random_peptides
+from nose.tools import eq_, assert_raises
 from numpy.testing import assert_equal
 
 letter_to_index_dict = {
@@ -37,3 +45,202 @@ def test_index_and_one_hot_encoding():
             [1, 0, 0],
         ])
 
+
+def test_index_encoding_unknown_letters():
+    assert_raises(
+        ValueError,
+        encodable_sequences.index_encoding,
+        ["AAAA", "ABZA"],
+        letter_to_index_dict)
+    assert_raises(
+        ValueError,
+        encodable_sequences.index_encoding,
+        ["AAAA", "ABA"],
+        letter_to_index_dict)
+
+
+def test_index_encoding_bytes():
+    assert_equal(
+        encodable_sequences.index_encoding(
+            numpy.array([b"AAAA", b"ABCA"]), letter_to_index_dict),
+        [
+            [0, 0, 0, 0],
+            [0, 1, 2, 0],
+        ])
+
+
+def test_variable_length_to_fixed_length_categorical():
+    peptides = []
+    for length in range(8, 16):
+        peptides.extend(random_peptides(10, length=length))
+    encoder = encodable_sequences.EncodableSequences.create(peptides)
+    expected = encodable_sequences.index_encoding(
+        [
+            encoder.sequence_to_fixed_length_string(peptide)
+            for peptide in peptides
+        ],
+        AMINO_ACID_INDEX)
+    assert_equal(
+        encoder.variable_length_to_fixed_length_categorical(), expected)
+
+    assert_raises(
+        ValueError,
+        encodable_sequences.EncodableSequences.create(
+            ["SIINFEKL", "SIINFEK"]).variable_length_to_fixed_length_categorical)
+    assert_raises(
+        ValueError,
+        encodable_sequences.EncodableSequences.create(
+            ["A" * 16]).variable_length_to_fixed_length_categorical)
+
+    # Subset of an array whose item size exceeds the supported length.
+    sequences = numpy.array(["SIINFEKL", "A" * 20])[:1]
+    eq_(encodable_sequences.sequences_to_byte_matrix(sequences).shape, (1, 8))
+    eq_(
+        encodable_sequences.sequences_to_byte_matrix(
+            sequences.astype("S")).shape,
+        (1, 8))
+    encodable_sequences.EncodableSequences.create(
+        sequences).variable_length_to_fixed_length_categorical()
+
+
+def test_one_hot_encoding_dtypes():
+    encoder = encodable_sequences.EncodableSequences.create(
+        ["SIINFEKL", "SIINFEKLL"])
+    expected = encoder.variable_length_to_fixed_length_one_hot()
+    for dtype in ["uint8", "bool", "float32"]:
+        result = encoder.variable_length_to_fixed_length_one_hot(dtype=dtype)
+        eq_(result.dtype, numpy.dtype(dtype))
+        assert_equal(result.astype("int32"), expected)
+
+
+def test_take_shares_encodings():
+    peptides = random_peptides(20, length=9) + random_peptides(20, length=10)
+    encoder = encodable_sequences.EncodableSequences.create(peptides)
+    indices = [3, 25, 0, 3]
+    subset = encoder.take(indices)
+    eq_(list(subset.sequences), [peptides[i] for i in indices])
+    eq_(len(encoder.encoding_cache), 0)
+
+    result = subset.variable_length_to_fixed_length_one_hot()
+    eq_(len(encoder.encoding_cache), 2)  # categorical and one-hot
+    assert_equal(
+        result,
+        encodable_sequences.EncodableSequences.create(
+            [peptides[i] for i in indices]
+        ).variable_length_to_fixed_length_one_hot())
+
+    # Subsets of subsets are taken from the original instance.
+    subsubset = subset.take([1])
+    assert subsubset.parent is encoder
+    eq_(list(subsubset.parent_indices), [25])
+
+
+def test_unique():
+    peptides = ["SIINFEKL", "SIINFEKLL", "SIINFEKL", "AAAAAAAA", "SIINFEKLL"]
+    encoder = encodable_sequences.EncodableSequences.create(peptides)
+    (unique, inverse) = encoder.unique()
+    eq_(len(unique), 3)
+    eq_(list(unique.sequences[inverse]), peptides)
+
+    # Subsets use the distinct sequences of the original instance.
+    (subset_unique, subset_inverse) = encoder.take([4, 1, 3]).unique()
+    eq_(list(subset_unique.sequences[subset_inverse]),
+        ["SIINFEKLL", "SIINFEKLL", "AAAAAAAA"])
+    assert subset_unique.parent is unique
+    subset_unique.variable_length_to_fixed_length_one_hot()
+    eq_(len(unique.encoding_cache), 2)
+
+
+def test_save_and_load():
+    peptides = random_peptides(20, length=9) + random_peptides(20, length=10)
+    encoder = encodable_sequences.EncodableSequences.create(peptides)
+    one_hot = encoder.variable_length_to_fixed_length_one_hot(dtype="uint8")
+
+    path = tempfile.mkdtemp()
+    try:
+        encoder.save(path)
+        loaded = encodable_sequences.EncodableSequences.load(path)
+        eq_(list(loaded.sequences), peptides)
+        eq_(set(loaded.encoding_cache), set(encoder.encoding_cache))
+        loaded_one_hot = loaded.variable_length_to_fixed_length_one_hot(
+            dtype="uint8")
+        assert isinstance(loaded_one_hot, numpy.memmap)
+        assert_equal(loaded_one_hot, one_hot)
+        assert_equal(
+            loaded.take([2, 3]).variable_length_to_fixed_length_one_hot(
+                dtype="uint8"),
+            one_hot[[2, 3]])
+        del loaded, loaded_one_hot
+
+        # Missing parent directories are created.
+        nested_path = os.path.join(path, "a", "b")
+        encoder.save(nested_path)
+        eq_(
+            list(encodable_sequences.EncodableSequences.load(
+                nested_path).sequences),
+            peptides)
+
+        # Encodings that do not match the sequences are rejected.
+        numpy.save(os.path.join(nested_path, "sequences.npy"), peptides[:-1])
+        with assert_raises(ValueError):
+            encodable_sequences.EncodableSequences.load(nested_path)
+    finally:
+        shutil.rmtree(path)
+
+
+def test_fixed_length_one_hot():
+    pseudosequences = ["YFAMYQENVA", "YYAMYQENVA", "YFAMYQENVA"]
+    encoder = encodable_sequences.EncodableSequences.create(pseudosequences)
+    one_hot = encoder.fixed_length_one_hot(dtype="float32")
+    eq_(one_hot.shape, (3, 10, 21))
+    assert_equal(one_hot.argmax(axis=2), encoder.fixed_length_categorical())
+    assert_equal(
+        encoder.take([2, 2, 1]).fixed_length_one_hot(dtype="float32"),
+        one_hot[[2, 2, 1]])
+
+
+def test_from_buffer():
+    peptides = random_peptides(100, length=9) + ["SIINFEKL", "QQQQQQQQQQ"]
+    buffer = "".join(peptides).encode("ascii")
+    offsets = numpy.cumsum([0] + [len(p) for p in peptides])
+
+    compact = encodable_sequences.EncodableSequences.from_buffer(
+        buffer, offsets)
+    eq_(len(compact), len(peptides))
+    eq_(list(compact.sequences), peptides)
+    eq_(compact.fixed_sequence_length, None)
+
+    from_bytes = encodable_sequences.EncodableSequences.create(
+        numpy.array(peptides, dtype=bytes))
+    eq_(list(from_bytes.sequences), peptides)
+
+    expected = encodable_sequences.EncodableSequences.create(peptides)
+    assert_equal(
+        compact.variable_length_to_fixed_length_one_hot(),
+        expected.variable_length_to_fixed_length_one_hot())
+
+    subset = compact.take([0, 100, 101, 0])
+    eq_(
+        list(subset.sequences),
+        [peptides[0], "SIINFEKL", "QQQQQQQQQQ", peptides[0]])
+    (unique, inverse) = subset.unique()
+    eq_(list(unique.sequences[inverse]), list(subset.sequences))
+
+    fixed = encodable_sequences.EncodableSequences.create(
+        numpy.array(peptides[:100], dtype=bytes))
+    eq_(fixed.fixed_sequence_length, 9)
+    assert_equal(
+        fixed.fixed_length_categorical(),
+        encodable_sequences.EncodableSequences.create(
+            peptides[:100]).fixed_length_categorical())
+
+    assert_raises(
+        ValueError,
+        encodable_sequences.EncodableSequences.from_buffer,
+        buffer,
+        [0, 5, 3])
+    assert_raises(
+        ValueError,
+        encodable_sequences.EncodableSequences.from_buffer,
+        buffer,
+        [0, len(buffer) + 1])
@@ -0,0 +1,65 @@
+import tempfile
+import os
+
+import pandas
+from numpy.testing import assert_equal
+from nose.tools import assert_raises
+
+from mhcflurry import scan_command
+
+TEST_FASTA = '''
+>protein1 first test protein
+MTMDKSELVQKAKLAEQAERYDDMAAAMKAVTEQGHELSNEERNLLSVAYKNVVGARRSSWRVISSIEQK
+>protein2
+SIINFEKLDENDREKL
+LLGYTVQAAV
+'''.strip()
+
+
+def test_scan():
+    deletes = []
+    try:
+        with tempfile.NamedTemporaryFile(delete=False, suffix=".fasta") as fd:
+            fd.write(TEST_FASTA.encode())
+            deletes.append(fd.name)
+        fd_out = tempfile.NamedTemporaryFile(delete=False, suffix=".csv")
+        deletes.append(fd_out.name)
+        full_args = [
+            fd.name,
+            "--alleles", "HLA-A0201", "HLA-B*27:05",
+            "--top-k", "10",
+            "--out", fd_out.name,
+        ]
+        print("Running with args: %s" % full_args)
+        scan_command.run(full_args)
+        result = pandas.read_csv(fd_out.name)
+        print(result)
+    finally:
+        for delete in deletes:
+            os.unlink(delete)
+
+    assert_equal(result.shape[0], 20)
+    assert_equal(
+        sorted(result.allele.unique()), ["HLA-A*02:01", "HLA-B*27:05"])
+    assert_equal(set(result.sequence_name), set(["protein1", "protein2"]))
+    for (_, row) in result.iterrows():
+        assert 8 <= len(row.peptide) <= 15
+        assert row.mhcflurry_prediction > 0
+    sub_result = result.ix[result.sequence_name == "protein2"]
+    sequence = "SIINFEKLDENDREKLLLGYTVQAAV"
+    for (_, row) in sub_result.iterrows():
+        assert_equal(
+            sequence[row.offset:row.offset + len(row.peptide)], row.peptide)
+
+
+def test_scan_rejects_nonpositive_top_k():
+    with tempfile.NamedTemporaryFile(suffix=".fasta") as fd:
+        fd.write(TEST_FASTA.encode())
+        fd.flush()
+        for top_k in ["0", "-3"]:
+            with assert_raises(SystemExit):
+                scan_command.run([
+                    fd.name,
+                    "--alleles", "HLA-A0201",
+                    "--top-k", top_k,
+                ])
@@ -5,9 +5,12 @@ import cProfile
 import pstats
 
 import pandas
+from numpy.testing import assert_equal
 
 from mhcflurry import Class1AffinityPredictor
+from mhcflurry.amino_acid import AMINO_ACID_INDEX
 from mhcflurry.common import random_peptides
+from mhcflurry.encodable_sequences import index_encoding
 
 NUM = 10000
 
@@ -46,6 +49,29 @@ def test_speed(profile=False):
         (key, pstats.Stats(value)) for (key, value) in profilers.items())
 
 
+def pandas_index_encoding(sequences, letter_to_index_dict):
+    # Previous implementation of index_encoding, kept here for comparison.
+    df = pandas.DataFrame(iter(s) for s in sequences)
+    return df.replace(letter_to_index_dict).values
+
+
+def test_speed_index_encoding():
+    peptides = random_peptides(NUM, length=15)
+    timings = {}
+
+    start = time.time()
+    result = index_encoding(peptides, AMINO_ACID_INDEX)
+    timings["index_encoding"] = time.time() - start
+
+    start = time.time()
+    expected = pandas_index_encoding(peptides, AMINO_ACID_INDEX)
+    timings["pandas_index_encoding"] = time.time() - start
+
+    assert_equal(result, expected)
+    print("ENCODING SPEED BENCHMARK")
+    print("Results:\n%s" % str(pandas.Series(timings)))
+
+
 if __name__ == '__main__':
     # If run directly from python, do profiling and leave the user in a shell
     # to explore results.
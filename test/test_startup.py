@@ -0,0 +1,54 @@
+"""
+Startup time benchmark. Importing mhcflurry and running informative commands
+should not import keras or tensorflow or parse the downloads configuration.
+"""
+import os
+import subprocess
+import sys
+import time
+
+import pandas
+from nose.tools import eq_
+
+from mhcflurry.downloads import ENVIRONMENT_VARIABLES, get_path
+
+HEAVY_MODULES = ["keras", "tensorflow", "yaml"]
+
+
+def imported_heavy_modules(code):
+    """
+    Run python code in a new interpreter, without any of the mhcflurry
+    environment variables set, and return the heavy modules it imported and
+    the time taken.
+    """
+    code += (
+        "\nimport sys\n"
+        "print('Heavy modules: ' + "
+        "' '.join(m for m in %r if m in sys.modules))" % HEAVY_MODULES)
+    env = dict(
+        (key, value) for (key, value) in os.environ.items()
+        if key not in ENVIRONMENT_VARIABLES)
+    start = time.time()
+    output = subprocess.check_output([sys.executable, "-c", code], env=env)
+    elapsed = time.time() - start
+    (line,) = [
+        line for line in output.decode().splitlines()
+        if line.startswith("Heavy modules:")
+    ]
+    return (line.split()[2:], elapsed)
+
+
+def test_startup():
+    timings = {}
+
+    (modules, timings["import"]) = imported_heavy_modules("import mhcflurry")
+    eq_(modules, [])
+
+    (modules, timings["list_supported_alleles"]) = imported_heavy_modules(
+        "from mhcflurry import predict_command\n"
+        "predict_command.run(['--list-supported-alleles', '--models', %r])" % (
+            get_path("models_class1", "models")))
+    eq_(modules, [])
+
+    print("STARTUP BENCHMARK")
+    print("Results:\n%s" % str(pandas.Series(timings)))